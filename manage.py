@@ -6,7 +6,9 @@ import sys
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'trident.settings')
+    # `manage.py test` runs against trident.test_settings; other runners set DJANGO_SETTINGS_MODULE themselves
+    default_settings = 'trident.test_settings' if sys.argv[1:2] == ['test'] else 'trident.settings'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', default_settings)
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
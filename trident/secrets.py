@@ -0,0 +1,4 @@
+SECRET_KEY="x"
+STRIPE_PUBLISHABLE_KEY="pk"
+STRIPE_SECRET_KEY="sk"
+STRIPE_WEBHOOK_SECRET="wh"
@@ -59,6 +59,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost, so its timings cover every other middleware
+    'tridentapp.instrumentation.request_metrics_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -72,7 +74,7 @@ ROOT_URLCONF = 'trident.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'tridentapp.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')], 
         'APP_DIRS': True,
         'OPTIONS': {
@@ -94,13 +96,49 @@ WSGI_APPLICATION = 'trident.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# WAL lets readers keep going while the webhook worker and sessions write;
+# IMMEDIATE transactions take the write lock up front so concurrent writers
+# queue on busy_timeout instead of failing with "database is locked" mid-transaction.
+SQLITE_INIT_COMMAND = ";".join([
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=20000",
+    "PRAGMA mmap_size=134217728",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA temp_store=MEMORY",
+])
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': SQLITE_INIT_COMMAND,
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+    }
+}
+
+
+# Cache
+# File based so that signal invalidations from one process (the admin, the
+# webhook worker) reach every web worker
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
     }
 }
 
+# Anonymous renders of home, events, event_info and directions
+PAGE_CACHE_TIMEOUT = 300
+# Per-user purchased event/product ids, invalidated when purchasers change
+ENTITLEMENTS_CACHE_TIMEOUT = 3600
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -135,6 +173,15 @@ LOGGING = {
     },
 }
 
+# Per-request db/template/Stripe/SES timings are aggregated for /metrics (staff,
+# or `Authorization: Bearer <METRICS_TOKEN>`) and sent as a Server-Timing header
+# to staff and under DEBUG; True sends the header to every client
+SERVER_TIMING_HEADER = False
+try:
+    from .secrets import METRICS_TOKEN
+except ImportError:
+    METRICS_TOKEN = None
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
@@ -156,17 +203,50 @@ MEDIA_URL = '/media/'
 
 STATICFILES_DIRS = [BASE_DIR / "static"]
 
+# collectstatic writes hashed names, .gz copies of text assets and resized
+# AVIF/WebP renditions of images for the {% responsive_image %} tag
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "tridentapp.staticfiles.OptimizedStaticFilesStorage"},
+}
+STATIC_IMAGE_WIDTHS = [480, 960, 1440]
+STATIC_IMAGE_FORMATS = ["avif", "webp"]
+STATIC_IMAGE_QUALITY = 70
+
+# Renditions of uploaded Event images, written under MEDIA_ROOT/thumbs/ by a
+# background thread pool on upload (or `manage.py generate_thumbnails`)
+EVENT_THUMBNAIL_WIDTHS = [160, 480, 960]
+EVENT_THUMBNAIL_FORMAT = "webp"
+EVENT_THUMBNAIL_QUALITY = 75
+THUMBNAIL_WORKERS = 2
+# Thumbnail names each process remembers as existing before checking storage again
+THUMBNAIL_READY_CACHE_SIZE = 4096
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 DEFAULT_FROM_EMAIL = "support@mocapschool.com"
 
+# All outgoing mail goes through one pooled SES client per process
+EMAIL_BACKEND = "tridentapp.mail.SESEmailBackend"
+SES_MAX_POOL_CONNECTIONS = 10
+# Only set to talk to a local SES stand-in, e.g. `manage.py load_test`
+SES_ENDPOINT_URL = None
+
+# Mail is queued in the OutboundEmail outbox and sent by `manage.py send_outbox`
+# at no more than EMAIL_OUTBOX_RATE messages per second (the SES sending quota)
+EMAIL_OUTBOX_RATE = 14
+EMAIL_OUTBOX_MAX_ATTEMPTS = 8
+
 LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = 'login'
 
 # CK EDITOR
 
+# Sanitized Event.description_html is cut to this many characters on save
+EVENT_DESCRIPTION_MAX_LENGTH = 5000
+
 CKEDITOR_5_CONFIGS = {
     'default': {
         'toolbar': [
@@ -192,3 +272,28 @@ CKEDITOR_5_CONFIGS = {
 }
 
 CKEDITOR_UPLOAD_PATH = "uploads/"
+
+# STRIPE API
+# Configured once at startup by tridentapp.stripe_client.configure_stripe
+
+STRIPE_HTTP_POOL_SIZE = 10
+STRIPE_CONNECT_TIMEOUT = 5
+STRIPE_READ_TIMEOUT = 20
+STRIPE_MAX_NETWORK_RETRIES = 2
+
+# Lifetime in seconds of the signed checkout quote handed from purchase_event to pay_event
+QUOTE_MAX_AGE = 1800
+
+# Minutes seats stay held for an unpaid checkout before `manage.py release_seat_holds` resells them
+SEAT_HOLD_MINUTES = 15
+
+# STRIPE WEBHOOKS
+
+# Deliveries are stored by the webhook view and handled by `manage.py process_webhooks`
+STRIPE_WEBHOOK_MAX_ATTEMPTS = 8
+# Seconds before a webhook or email claimed by a worker that died is claimed again
+QUEUE_CLAIM_LEASE = 600
+# Size of the in-process LRU of seen event ids, and how long the
+# ProcessedStripeEvent ledger keeps ids before `manage.py prune_stripe_events`
+STRIPE_WEBHOOK_LRU_SIZE = 10000
+STRIPE_EVENT_RETENTION_DAYS = 30
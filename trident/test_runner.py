@@ -0,0 +1,10 @@
+from django.core.management import call_command
+from django.test.runner import DiscoverRunner
+
+
+class StaticFilesTestRunner(DiscoverRunner):
+    """ Run collectstatic into the scratch STATIC_ROOT first, so a missing manifest entry fails the tests """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        call_command("collectstatic", interactive=False, verbosity=0)
@@ -0,0 +1,36 @@
+"""
+Settings for the test suite: the production settings plus what a test run
+needs without trident/secrets.py.
+
+`manage.py test` selects this module; other runners should set
+DJANGO_SETTINGS_MODULE=trident.test_settings.
+"""
+
+import atexit
+import shutil
+import tempfile
+
+from .settings import *  # noqa: F401,F403
+
+# Sessions and signed checkout quotes need a key even without trident/secrets.py
+if not SECRET_KEY:  # noqa: F405
+    SECRET_KEY = "django-insecure-test-only"
+
+# The same file based cache that ships, in a scratch directory so runs never
+# read or clear the site's cache
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': tempfile.mkdtemp(prefix='trident-test-cache-'),
+    }
+}
+atexit.register(shutil.rmtree, CACHES['default']['LOCATION'], ignore_errors=True)
+
+# Templates render through the production manifest storage; the runner
+# collects static files here before the first test
+STATIC_ROOT = tempfile.mkdtemp(prefix='trident-test-static-')
+atexit.register(shutil.rmtree, STATIC_ROOT, ignore_errors=True)
+TEST_RUNNER = 'trident.test_runner.StaticFilesTestRunner'
+# One rendition per image keeps that collectstatic quick
+STATIC_IMAGE_WIDTHS = [480]
+STATIC_IMAGE_FORMATS = ["webp"]
@@ -1,5 +1,15 @@
-from django.contrib import admin
-from .models import Product, Event
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.db.models import Count
+from django.template.response import TemplateResponse
+from django.utils import timezone
+from django.utils.html import format_html
+from .attendees import export_response
+from .forms import AddPurchasersForm
+from .inventory import SoldOut
+from .models import Product, Event, StripeWebhookEvent, OutboundEmail, TicketOrder
+from .purchasers import add_purchasers, users_by_email
+from .thumbnails import thumbnail_url
 
 import traceback
 
@@ -10,21 +20,139 @@ except Exception:
     traceback.print_exc()
 
 
+class PurchasersAdmin(admin.ModelAdmin):
+    """ Purchaser editing that stays fast with many users: autocomplete widget, annotated counts, bulk add """
+    autocomplete_fields = ['purchasers']
+    actions = ['add_purchasers_from_emails']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(purchaser_count=Count('purchasers', distinct=True))
+
+    @admin.display(description='Purchasers', ordering='purchaser_count')
+    def purchaser_count(self, obj):
+        return obj.purchaser_count
+
+    @admin.action(description="Add purchasers from a pasted email list")
+    def add_purchasers_from_emails(self, request, queryset):
+        if 'apply' in request.POST:
+            form = AddPurchasersForm(request.POST)
+            if form.is_valid():
+                emails = form.cleaned_data['emails']
+                found = users_by_email(emails)
+                sold_out = []
+                for obj in queryset:
+                    try:
+                        add_purchasers(obj, found.values())
+                    except SoldOut:
+                        sold_out.append(str(obj))
+                self.message_user(
+                    request, f"Added {len(found)} user(s) to {queryset.count() - len(sold_out)} "
+                             f"{self.opts.verbose_name_plural}."
+                )
+                if sold_out:
+                    self.message_user(request, "Not enough seats left, nobody added to: " + ", ".join(sold_out),
+                                      messages.ERROR)
+                missing = [email for email in emails if email not in found]
+                if missing:
+                    self.message_user(request, "No account for: " + ", ".join(missing), messages.WARNING)
+                return None
+        else:
+            form = AddPurchasersForm()
+
+        context = {
+            **self.admin_site.each_context(request),
+            'title': "Add purchasers",
+            'opts': self.opts,
+            'form': form,
+            'queryset': queryset,
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        }
+        return TemplateResponse(request, "admin/add_purchasers.html", context)
+
+
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
-    list_display = ('product_name', 'price')
+class ProductAdmin(PurchasersAdmin):
+    list_display = ('product_name', 'price', 'purchaser_count')
     search_fields = ('product_name', 'description')
 
 
 @admin.register(Event)
-class EventAdmin(admin.ModelAdmin):
-    list_display = ['title', 'date']
+class EventAdmin(PurchasersAdmin):
+    list_display = ['title', 'date', 'capacity', 'seats_remaining', 'purchaser_count', 'image_tag']
+    search_fields = ['title']
+    actions = ['add_purchasers_from_emails', 'export_door_list_csv', 'export_door_list_json']
 
+    def save_related(self, request, form, formsets, change):
+        # Purchasers picked in the form take seats like any other registration
+        current = set(form.instance.purchasers.values_list('pk', flat=True)) if change else set()
+        wanted = {user.pk for user in form.cleaned_data['purchasers']}
+        form.cleaned_data['purchasers'] = form.cleaned_data['purchasers'].filter(pk__in=current)
+        super().save_related(request, form, formsets, change)
+        try:
+            add_purchasers(form.instance, wanted - current)
+        except SoldOut:
+            self.message_user(request, f"Not enough seats left to add {len(wanted - current)} purchaser(s) "
+                                       f"to {form.instance}.", messages.ERROR)
+
+    @admin.display(description='Image')
     def image_tag(self, obj):
         if obj.image:
-            return f'<img src="{obj.image.url}" width="100"/>'
+            return format_html('<img src="{}" width="100" loading="lazy"/>', thumbnail_url(obj.image, 160))
         return "-"
 
-    image_tag.allow_tags = True
-    image_tag.short_description = 'Image'
+    @admin.action(description="Export door list (CSV)")
+    def export_door_list_csv(self, request, queryset):
+        return self.export_door_list(queryset, "csv")
+
+    @admin.action(description="Export door list (JSON)")
+    def export_door_list_json(self, request, queryset):
+        return self.export_door_list(queryset, "json")
+
+    def export_door_list(self, queryset, fmt):
+        events = list(queryset.only('pk', 'title').order_by('date'))
+        filename = f"event-{events[0].pk}-attendees" if len(events) == 1 else "attendees"
+        return export_response(events, fmt, filename)
+
+
+@admin.register(TicketOrder)
+class TicketOrderAdmin(admin.ModelAdmin):
+    list_display = ('event', 'user', 'email', 'quantity', 'status', 'expires_at', 'created_at')
+    list_filter = ('status',)
+    list_select_related = ('event', 'user')
+    search_fields = ('email', 'user__username', 'event__title')
+    # Seats move only through tridentapp.inventory so the event counters stay right
+    readonly_fields = ('event', 'user', 'email', 'quantity', 'payment_intent', 'status', 'expires_at',
+                       'created_at', 'updated_at')
+
+
+@admin.register(StripeWebhookEvent)
+class StripeWebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('stripe_event_id', 'event_type', 'status', 'attempts', 'received_at', 'processed_at')
+    list_filter = ('status', 'event_type')
+    search_fields = ('stripe_event_id',)
+    readonly_fields = ('stripe_event_id', 'event_type', 'payload', 'attempts', 'last_error',
+                       'received_at', 'processed_at')
+    actions = ['retry_events']
+
+    @admin.action(description="Retry selected events now")
+    def retry_events(self, request, queryset):
+        count = queryset.exclude(status=StripeWebhookEvent.DONE).update(
+            status=StripeWebhookEvent.PENDING, next_attempt_at=timezone.now()
+        )
+        self.message_user(request, f"{count} event(s) queued for retry.")
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('to_email', 'subject', 'status', 'attempts', 'created_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('to_email', 'subject')
+    readonly_fields = ('attempts', 'last_error', 'created_at', 'sent_at')
+    actions = ['retry_emails']
 
+    @admin.action(description="Retry selected emails now")
+    def retry_emails(self, request, queryset):
+        count = queryset.exclude(status=OutboundEmail.DONE).update(
+            status=OutboundEmail.PENDING, next_attempt_at=timezone.now()
+        )
+        self.message_user(request, f"{count} email(s) queued for retry.")
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class TridentappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tridentapp'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .stripe_client import configure_stripe
+
+        configure_stripe()
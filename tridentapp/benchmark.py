@@ -0,0 +1,383 @@
+""" Synthetic production-sized data and per-route timing for `seed_benchmark_data` / `benchmark_views` """
+import hashlib
+import hmac
+import json
+import platform
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from .models import Event, Product
+from .quotes import make_quote
+
+USER_PREFIX = "bench_user_"
+EVENT_PREFIX = "[bench] "
+PRODUCT_PREFIX = "[bench] "
+# Logged-in scenarios run as this user, who has bought HEAVY_USER_EVENTS events
+HEAVY_USERNAME = USER_PREFIX + "0"
+HEAVY_USER_EVENTS = 500
+BENCH_PASSWORD = "bench"
+WEBHOOK_SECRET = "whsec_benchmark"
+METRICS_TOKEN = "bench_metrics"
+
+DESCRIPTION = (
+    "<h2>{title}</h2><p>Hands-on motion capture session covering suit calibration, marker "
+    "placement and solving. <strong>Bring comfortable clothes.</strong></p>"
+    "<ul><li>Calibration</li><li>Performance capture</li><li>Review in the volume</li></ul>"
+    "<p><img src=\"/media/events/stage.jpg\" alt=\"stage\"></p>"
+)
+
+
+def seed_data(users=200000, events=10000, products=20, purchasers_per_event=100,
+              large_events=10, large_event_purchasers=20000, batch_size=5000, seed=1, log=print):
+    """ Bulk-create benchmark users, events, products and purchasers rows.
+
+    Rows are marked with USER_PREFIX / EVENT_PREFIX so clear_data() can remove
+    them. Signals do not fire for bulk inserts, so the cache is cleared at the end.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    password = make_password(BENCH_PASSWORD)
+
+    start = User.objects.filter(username__startswith=USER_PREFIX).count()
+    User.objects.bulk_create(
+        (User(username=f"{USER_PREFIX}{i}", email=f"{USER_PREFIX}{i}@example.com", password=password,
+              first_name="Bench", last_name=str(i), is_active=True) for i in range(start, start + users)),
+        batch_size=batch_size,
+    )
+    user_ids = list(User.objects.filter(username__startswith=USER_PREFIX).values_list('pk', flat=True))
+    log(f"{len(user_ids)} benchmark users")
+
+    new_events = []
+    for i in range(events):
+        event = Event(
+            title=f"{EVENT_PREFIX}Session {i}",
+            date=now + timedelta(hours=rng.randint(-24 * 365, 24 * 365)),
+            description=DESCRIPTION.format(title=f"Session {i}"),
+            content=DESCRIPTION.format(title="Details") * 3,
+            price=Decimal(rng.choice([0, 15, 25, 40])),
+        )
+        # bulk_create skips Event.save()
+        event.render_html()
+        new_events.append(event)
+    Event.objects.bulk_create(new_events, batch_size=batch_size)
+    event_ids = list(
+        Event.objects.filter(title__startswith=EVENT_PREFIX).order_by('date').values_list('pk', flat=True)
+    )
+    log(f"{len(event_ids)} benchmark events")
+
+    Product.objects.bulk_create(
+        Product(product_name=f"{PRODUCT_PREFIX}Product {i}", description="Benchmark product", price=Decimal("20.00"))
+        for i in range(products)
+    )
+
+    # Most events have a modest list; the first upcoming ones are sold out to a large crowd
+    large = set(
+        Event.objects.filter(pk__in=event_ids, date__gt=now).order_by('date')
+        .values_list('pk', flat=True)[:large_events]
+    )
+    heavy_user = user_ids[0] if user_ids else None
+    through = Event.purchasers.through
+    rows = []
+    total = 0
+    for event_id in event_ids:
+        size = large_event_purchasers if event_id in large else purchasers_per_event
+        rows.extend(through(event_id=event_id, user_id=user_id)
+                    for user_id in rng.sample(user_ids, min(size, len(user_ids))))
+        if len(rows) >= batch_size:
+            through.objects.bulk_create(rows, batch_size=batch_size, ignore_conflicts=True)
+            total += len(rows)
+            rows = []
+    if heavy_user:
+        rows.extend(through(event_id=event_id, user_id=heavy_user)
+                    for event_id in rng.sample(event_ids, min(HEAVY_USER_EVENTS, len(event_ids))))
+    through.objects.bulk_create(rows, batch_size=batch_size, ignore_conflicts=True)
+    total += len(rows)
+    log(f"{total} event purchaser rows")
+
+    cache.clear()
+
+
+def clear_data(log=print):
+    deleted, _ = Event.objects.filter(title__startswith=EVENT_PREFIX).delete()
+    log(f"Deleted {deleted} event row(s)")
+    deleted, _ = Product.objects.filter(product_name__startswith=PRODUCT_PREFIX).delete()
+    log(f"Deleted {deleted} product row(s)")
+    deleted, _ = User.objects.filter(username__startswith=USER_PREFIX).delete()
+    log(f"Deleted {deleted} user row(s)")
+    cache.clear()
+
+
+class _RowCountingCursor:
+    """ DB-API cursor proxy that counts the rows the ORM actually fetches """
+
+    def __init__(self, cursor, stats):
+        self.cursor = cursor
+        self.stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        for row in self.cursor:
+            self.stats.rows += 1
+            yield row
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is not None:
+            self.stats.rows += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self.cursor.fetchmany(*args, **kwargs)
+        self.stats.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        self.stats.rows += len(rows)
+        return rows
+
+
+class QueryStats:
+    """ execute_wrapper that counts queries and fetched rows on this thread's connection """
+
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        wrapper = context["cursor"]
+        if not isinstance(wrapper.cursor, _RowCountingCursor):
+            wrapper.cursor = _RowCountingCursor(wrapper.cursor, self)
+        return execute(sql, params, many, context)
+
+
+def percentile(samples, pct):
+    """ Nearest-rank percentile of a list of numbers """
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def _fake_stripe_call(method, *args, **kwargs):
+    # Benchmarks measure this app, not Stripe's latency
+    return SimpleNamespace(id=f"pi_bench_{time.perf_counter_ns()}", client_secret="pi_bench_secret",
+                           status="requires_payment_method", url="https://checkout.stripe.com/bench")
+
+
+def _signed_webhook(payload):
+    timestamp = int(time.time())
+    signature = hmac.new(WEBHOOK_SECRET.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return {"HTTP_STRIPE_SIGNATURE": f"t={timestamp},v1={signature}"}
+
+
+def build_scenarios():
+    """ One or more requests per route in tridentapp.urls, against the seeded data """
+    from . import urls
+
+    now = timezone.now()
+    event = (
+        Event.objects.filter(date__gt=now).annotate(n=Count('purchasers')).order_by('-n', 'date').first()
+        or Event.objects.order_by('-date').first()
+    )
+    product = Product.objects.order_by('pk').first()
+    user = User.objects.filter(username=HEAVY_USERNAME).first() or User.objects.order_by('pk').first()
+    if not (event and product and user):
+        raise ValueError("No data to benchmark; run `manage.py seed_benchmark_data` first")
+
+    inactive = User.objects.filter(username__startswith=USER_PREFIX).exclude(pk=user.pk).order_by('pk').first() or user
+    quote = make_quote(event, 2, "", "guest@example.com", quote_id="bench")
+
+    def webhook():
+        payload = json.dumps({
+            "id": f"evt_bench_{time.perf_counter_ns()}", "object": "event", "type": "payment_intent.created",
+            "data": {"object": {"id": "pi_bench", "metadata": {}}},
+        })
+        return {"data": payload, "content_type": "application/json", **_signed_webhook(payload)}
+
+    routes = {
+        "password_reset": [("GET", reverse("password_reset"), None, None)],
+        "home": [("GET", reverse("home"), None, None), ("GET", reverse("home"), user, None)],
+        "user_home": [("GET", reverse("user_home"), user, None)],
+        "events": [("GET", reverse("events"), None, None), ("GET", reverse("events"), user, None)],
+        "directions": [("GET", reverse("directions"), None, None)],
+        "livestream": [("GET", reverse("livestream"), None, None)],
+        "event_info": [("GET", reverse("event_info", args=[event.pk]), None, None),
+                       ("GET", reverse("event_info", args=[event.pk]), user, None)],
+        "register": [("GET", reverse("register"), None, None)],
+        "activate": [("GET", reverse("activate", args=[
+            urlsafe_base64_encode(force_bytes(inactive.pk)), default_token_generator.make_token(inactive)
+        ]), None, None)],
+        "purchase_product": [("GET", reverse("purchase_product", args=[product.pk]), user, None)],
+        "purchase_event": [("GET", reverse("purchase_event", args=[event.pk]), None, None),
+                           ("GET", reverse("purchase_event", args=[event.pk]), user, None)],
+        "pay_event": [("GET", f"{reverse('pay_event', args=[event.pk])}?quote={quote}", None, None)],
+        "event_register": [("GET", reverse("event_register", args=[event.pk]), user, None)],
+        "stripe_webhook": [("POST", reverse("stripe_webhook"), None, webhook)],
+        "payment_confirmation": [("GET", reverse("payment_confirmation") + "?intent=pi_bench", None, None)],
+        # A Prometheus scrape, rather than the 403 every other client gets
+        "metrics": [("GET", reverse("metrics"), None, lambda: {"HTTP_AUTHORIZATION": f"Bearer {METRICS_TOKEN}"})],
+    }
+
+    names = [pattern.name for pattern in urls.urlpatterns if isinstance(pattern, URLPattern)]
+    missing = [name for name in names if name not in routes]
+    if missing:
+        raise ValueError(f"No benchmark scenario for route(s): {', '.join(missing)}")
+
+    scenarios = []
+    for name in names:
+        for method, url, as_user, body in routes[name]:
+            label = f"{name} ({'user' if as_user else 'anonymous'})"
+            scenarios.append(SimpleNamespace(name=label, method=method, url=url, user=as_user, body=body))
+    # Not a route, but what every bot scan costs
+    scenarios.append(SimpleNamespace(name="not_found (anonymous)", method="GET", url="/wp-login.php",
+                                     user=None, body=None))
+    return scenarios
+
+
+def run_benchmarks(iterations=20, warmup=2, cold_cache=False, log=print):
+    """ Time every scenario, returning the baseline document.
+
+    Everything runs inside a transaction that is rolled back, so activation,
+    webhook inbox rows and PaymentIntent records do not accumulate.
+    """
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    try:
+        # Allows the test client's testserver host and keeps mail in memory
+        setup_test_environment()
+        own_environment = True
+    except RuntimeError:
+        # Already inside the test runner
+        own_environment = False
+
+    results = {}
+    try:
+        with override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET, METRICS_TOKEN=METRICS_TOKEN), \
+                mock.patch("tridentapp.stripe_client.stripe_call", _fake_stripe_call), \
+                transaction.atomic():
+            cache.clear()
+            for scenario in build_scenarios():
+                results[scenario.name] = _run_scenario(scenario, iterations, warmup, cold_cache)
+                log(_format_result(scenario.name, results[scenario.name]))
+            transaction.set_rollback(True)
+    finally:
+        if own_environment:
+            teardown_test_environment()
+        cache.clear()
+
+    return {
+        "meta": {
+            "created_at": timezone.now().isoformat(),
+            "iterations": iterations,
+            "cold_cache": cold_cache,
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "users": User.objects.count(),
+            "events": Event.objects.count(),
+            "event_purchasers": Event.purchasers.through.objects.count(),
+        },
+        "results": results,
+    }
+
+
+def _run_scenario(scenario, iterations, warmup, cold_cache):
+    # Broken routes are reported with their 500 status rather than aborting the run
+    client = Client(raise_request_exception=False)
+    if scenario.user:
+        client.force_login(scenario.user)
+
+    timings = []
+    stats = QueryStats()
+    status = None
+    size = 0
+    for i in range(warmup + iterations):
+        if cold_cache:
+            cache.clear()
+        kwargs = scenario.body() if scenario.body else {}
+        measuring = i >= warmup
+        if measuring:
+            stats.queries = stats.rows = 0
+        with connection.execute_wrapper(stats):
+            start = time.perf_counter()
+            if scenario.method == "POST":
+                response = client.post(scenario.url, **kwargs)
+            else:
+                response = client.get(scenario.url, **kwargs)
+            elapsed = time.perf_counter() - start
+        if measuring:
+            timings.append(elapsed * 1000)
+            status = response.status_code
+            size = len(response.content) if not response.streaming else 0
+    # Query and row counts are per request, from the last measured iteration
+    return {
+        "status": status,
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p90_ms": round(percentile(timings, 90), 3),
+        "p99_ms": round(percentile(timings, 99), 3),
+        "max_ms": round(max(timings), 3),
+        "mean_ms": round(sum(timings) / len(timings), 3),
+        "queries": stats.queries,
+        "rows": stats.rows,
+        "bytes": size,
+    }
+
+
+def _format_result(name, result):
+    return (f"{name:<36} {result['status']}  p50 {result['p50_ms']:>9.2f}ms  p90 {result['p90_ms']:>9.2f}ms  "
+            f"p99 {result['p99_ms']:>9.2f}ms  queries {result['queries']:>4}  rows {result['rows']:>7}")
+
+
+def compare(baseline, current, threshold=20.0):
+    """ Lines describing how `current` differs from `baseline`, and whether anything regressed.
+
+    A scenario regresses when its p50 grows by more than `threshold` percent,
+    or when it runs more queries or fetches more rows than before.
+    """
+    lines = []
+    regressed = False
+    for name, result in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            lines.append(f"{name:<36} new")
+            continue
+        change = (result["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100 if before["p50_ms"] else 0.0
+        flags = []
+        if change > threshold:
+            flags.append("SLOWER")
+        if result["queries"] > before["queries"]:
+            flags.append("MORE QUERIES")
+        if result["rows"] > before["rows"]:
+            flags.append("MORE ROWS")
+        if result["status"] != before["status"]:
+            flags.append(f"STATUS {before['status']} -> {result['status']}")
+        regressed = regressed or bool(flags)
+        lines.append((
+            f"{name:<36} p50 {before['p50_ms']:>9.2f} -> {result['p50_ms']:>9.2f}ms ({change:+6.1f}%)  "
+            f"queries {before['queries']:>4} -> {result['queries']:<4}  rows {before['rows']:>7} -> {result['rows']:<7}"
+            + (f"  {' '.join(flags)}" if flags else "")
+        ).rstrip())
+    for name in baseline["results"]:
+        if name not in current["results"]:
+            lines.append(f"{name:<36} removed")
+    return lines, regressed
@@ -0,0 +1,77 @@
+from functools import wraps
+from inspect import iscoroutinefunction
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.http import HttpResponse
+
+
+def page_cache_key(name, *args):
+    return ":".join(["page", name, *(str(arg) for arg in args)])
+
+
+def has_messages(request):
+    return bool(len(messages.get_messages(request)))
+
+
+def cache_anonymous_page(name):
+    """ Cache a view's rendered body for anonymous GET requests.
+
+    The key is built from `name` and the view's URL arguments, so signal
+    handlers can invalidate exactly the pages an Event change affects (see
+    tridentapp.signals). Logged-in users, query strings and requests with
+    pending flash messages always get a fresh render. Works for sync and
+    async views.
+    """
+    def decorator(view):
+        timeout = getattr(settings, "PAGE_CACHE_TIMEOUT", 300)
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                # Resolve the user once here so the view and templates never hit the session synchronously
+                request.user = await request.auser()
+                if (request.method != "GET" or request.GET or request.user.is_authenticated
+                        or await sync_to_async(has_messages)(request)):
+                    return await view(request, *args, **kwargs)
+
+                key = page_cache_key(name, *args, *kwargs.values())
+                content = await cache.aget(key)
+                if content is not None:
+                    return HttpResponse(content)
+
+                response = await view(request, *args, **kwargs)
+                if response.status_code == 200 and not response.streaming:
+                    await cache.aset(key, response.content, timeout)
+                return response
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (request.method != "GET" or request.GET or request.user.is_authenticated
+                    or has_messages(request)):
+                return view(request, *args, **kwargs)
+
+            key = page_cache_key(name, *args, *kwargs.values())
+            content = cache.get(key)
+            if content is not None:
+                return HttpResponse(content)
+
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                cache.set(key, response.content, timeout)
+            return response
+        return wrapper
+    return decorator
+
+
+def invalidate_event_pages(event_id):
+    """ Drop the cached listing pages and the event's own page """
+    cache.delete_many([
+        page_cache_key("home"),
+        page_cache_key("events"),
+        page_cache_key("event_info", event_id),
+    ])
@@ -0,0 +1,119 @@
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from django.db import IntegrityError, router, transaction
+from django.db.models import Value
+from django.db.models.signals import m2m_changed
+
+from .inventory import SoldOut, reserve_seats
+from .models import Event, Product, TicketOrder
+
+Entitlements = namedtuple("Entitlements", ["event_ids", "product_ids"])
+
+NO_ENTITLEMENTS = Entitlements(frozenset(), frozenset())
+
+
+def entitlements_cache_key(user_id):
+    return f"entitlements:{user_id}"
+
+
+def entitlements_query(user_id):
+    """ ("event" | "product", id) rows for everything the user has purchased, as one UNION ALL """
+    events = (
+        Event.purchasers.through.objects.filter(user_id=user_id)
+        .annotate(kind=Value("event"))
+        .values_list("kind", "event_id")
+    )
+    products = (
+        Product.purchasers.through.objects.filter(user_id=user_id)
+        .annotate(kind=Value("product"))
+        .values_list("kind", "product_id")
+    )
+    return events.union(products, all=True)
+
+
+def load_entitlements(user_id):
+    """ Read a user's purchased event and product ids in one query """
+    event_ids, product_ids = set(), set()
+    for kind, pk in entitlements_query(user_id):
+        (event_ids if kind == "event" else product_ids).add(pk)
+    return Entitlements(frozenset(event_ids), frozenset(product_ids))
+
+
+def get_entitlements(user):
+    """ The user's purchased event and product ids, cached until their purchases change """
+    if not user.is_authenticated:
+        return NO_ENTITLEMENTS
+
+    key = entitlements_cache_key(user.pk)
+    entitlements = cache.get(key)
+    if entitlements is None:
+        entitlements = load_entitlements(user.pk)
+        cache.set(key, entitlements, getattr(settings, "ENTITLEMENTS_CACHE_TIMEOUT", 3600))
+    return entitlements
+
+
+def invalidate_entitlements(user_ids):
+    cache.delete_many([entitlements_cache_key(user_id) for user_id in user_ids])
+
+
+def registration_query(user_id, event_id):
+    """ Indexed lookup of the (event, user) unique pair """
+    return Event.purchasers.through.objects.filter(event_id=event_id, user_id=user_id)
+
+
+def registered_ids_query(user_id, event_ids):
+    return Event.purchasers.through.objects.filter(user_id=user_id, event_id__in=event_ids).values_list(
+        'event_id', flat=True
+    )
+
+
+def is_registered(user, event_id):
+    """ Indexed existence check on the (event, user) unique pair """
+    return registration_query(user.pk, event_id).exists()
+
+
+def registered_event_ids(user, event_ids):
+    """ The subset of event_ids the user is registered for, in one query """
+    if not user.is_authenticated:
+        return set()
+    return set(registered_ids_query(user.pk, event_ids))
+
+
+async def ais_registered(user, event_id):
+    return await registration_query(user.pk, event_id).aexists()
+
+
+async def aregistered_event_ids(user, event_ids):
+    if not user.is_authenticated:
+        return set()
+    return {event_id async for event_id in registered_ids_query(user.pk, event_ids)}
+
+
+def register_for_event(user, event):
+    """ Add the user to the event's purchasers; returns False if they already were.
+
+    A single INSERT guarded by the unique (event, user) constraint, so
+    concurrent or repeated registrations are harmless. The seat is taken in
+    the same transaction; raises SoldOut when the event is full.
+    """
+    through = Event.purchasers.through
+    try:
+        with transaction.atomic():
+            through.objects.create(event_id=event.pk, user_id=user.pk)
+            if not reserve_seats(event.pk, 1):
+                raise SoldOut
+            TicketOrder.objects.create(event_id=event.pk, user_id=user.pk, email=user.email,
+                                       status=TicketOrder.CONFIRMED)
+    except IntegrityError:
+        return False
+
+    # Same notification purchasers.add() sends, so caches are invalidated as usual
+    m2m_changed.send(
+        sender=through, instance=event, action="post_add", reverse=False,
+        model=User, pk_set={user.pk}, using=router.db_for_write(through),
+    )
+    return True
+
@@ -1,12 +1,15 @@
 # forms.py
+import re
+
 from django import forms
 from django.contrib.auth.forms import PasswordResetForm
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
-from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
 from django.template.loader import render_to_string
 
-import boto3
+from .utils import enqueue_email
 
 class RegisterForm(UserCreationForm):
     email = forms.EmailField(required=True)
@@ -19,26 +22,38 @@ class RegisterForm(UserCreationForm):
 class SESEmailPasswordResetForm(PasswordResetForm):
     def send_mail(self, subject_template_name, email_template_name,
                   context, from_email, to_email, html_email_template_name=None):
-        # Render subject and body from templates
+        # Render subject and bodies now; the send_outbox worker delivers them
         subject = render_to_string(subject_template_name, context)
         subject = ''.join(subject.splitlines())  # Remove newlines
 
         body = render_to_string(email_template_name, context)
-
-        ses_client = boto3.client(
-            "ses",
-            aws_access_key_id=settings.SES_MOCAPSCHOOL_KEY,
-            aws_secret_access_key=settings.SES_MOCAPSCHOOL_SECRET,
-            region_name=settings.SES_MOCAPSCHOOL_REGION,
-        )
-
-        ses_client.send_email(
-            Source=settings.DEFAULT_FROM_EMAIL,
-            Destination={"ToAddresses": [to_email]},
-            Message={
-                "Subject": {"Data": subject, "Charset": "UTF-8"},
-                "Body": {
-                    "Text": {"Data": body, "Charset": "UTF-8"},
-                },
-            },
-        )
+        body_html = ""
+        if html_email_template_name is not None:
+            body_html = render_to_string(html_email_template_name, context)
+
+        enqueue_email(to_email, subject, body, body_html)
+
+
+class AddPurchasersForm(forms.Form):
+    emails = forms.CharField(
+        widget=forms.Textarea(attrs={"rows": 12, "cols": 60}),
+        help_text="One or more addresses, separated by commas, semicolons or new lines.",
+    )
+
+    def clean_emails(self):
+        emails = {}
+        invalid = []
+        for email in re.split(r"[\s,;]+", self.cleaned_data["emails"]):
+            if not email:
+                continue
+            try:
+                validate_email(email)
+            except ValidationError:
+                invalid.append(email)
+            else:
+                emails.setdefault(email.lower(), None)
+        if invalid:
+            raise ValidationError("Not valid email addresses: %s" % ", ".join(invalid))
+        if not emails:
+            raise ValidationError("Enter at least one email address.")
+        return list(emails)
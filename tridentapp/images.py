@@ -0,0 +1,40 @@
+""" Pillow helpers for resized WebP/AVIF renditions of images """
+from io import BytesIO
+
+from PIL import Image, ImageOps, features
+
+# Mime types of the modern formats, in the order browsers should prefer them
+MIME_TYPES = {"avif": "image/avif", "webp": "image/webp"}
+
+
+def supported_formats(formats):
+    """ The formats this Pillow build can encode; missing codecs are skipped """
+    return [fmt for fmt in formats if fmt in MIME_TYPES and features.check(fmt)]
+
+
+def open_image(handle):
+    """ Decode an image file with its EXIF orientation applied """
+    image = Image.open(handle)
+    image.load()
+    return ImageOps.exif_transpose(image)
+
+
+def variant_widths(original_width, widths):
+    """ The configured widths narrower than the original, plus the original width itself """
+    return sorted({width for width in widths if width < original_width} | {original_width})
+
+
+def resize_to_width(image, width):
+    if width >= image.width:
+        return image
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.Resampling.LANCZOS)
+
+
+def encode(image, fmt, quality):
+    """ Encode `image` as `fmt` ("webp" or "avif") and return the bytes """
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+    buffer = BytesIO()
+    image.save(buffer, format=fmt.upper(), quality=quality)
+    return buffer.getvalue()
@@ -0,0 +1,156 @@
+""" Per-request timing: Server-Timing headers and request histograms for the /metrics endpoint.
+
+Each request gets a RequestTimings in a context variable. The database
+execute wrapper, the template backend, stripe_call and the SES backend add to
+it with record(), so time is attributed wherever the work runs, including
+sync_to_async threads. Histograms are per process, like the rest of
+tridentapp.metrics.
+"""
+import time
+from contextvars import ContextVar
+from inspect import iscoroutinefunction
+
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates
+from django.utils.decorators import sync_and_async_middleware
+
+from .metrics import Histogram
+
+COMPONENTS = ("db", "template", "stripe", "ses")
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time from the request reaching Django to the response leaving it",
+    labelnames=("view", "method", "status"),
+)
+REQUEST_COMPONENT_LATENCY = Histogram(
+    "http_request_component_seconds",
+    "Time a request spent in the database, template rendering, Stripe or SES",
+    labelnames=("view", "component"),
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries",
+    "SQL queries run per request",
+    labelnames=("view",),
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+
+_current = ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.seconds = dict.fromkeys(COMPONENTS, 0.0)
+        self.queries = 0
+
+
+def record(component, seconds):
+    """ Add `seconds` of `component` time to the current request, if there is one """
+    timings = _current.get()
+    if timings is not None:
+        timings.seconds[component] += seconds
+
+
+def time_queries(execute, sql, params, many, context):
+    """ Database execute wrapper, installed on every connection by tridentapp.signals """
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.seconds["db"] += time.perf_counter() - start
+        timings.queries += 1
+
+
+class _TimedTemplate:
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            record("template", time.perf_counter() - start)
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """ DjangoTemplates backend that records render time.
+
+    Rendering time includes any queries a template triggers lazily, so the
+    template and db figures can overlap.
+    """
+
+    def from_string(self, template_code):
+        return _TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _TimedTemplate(super().get_template(template_name))
+
+
+def _view_name(request):
+    match = getattr(request, "resolver_match", None)
+    # Unresolved paths share one label so 404 scans can't grow the series without bound
+    return match.view_name if match else "<unresolved>"
+
+
+def _is_staff(user):
+    return user is not None and user.is_staff
+
+
+def _show_timings(is_staff):
+    """ Server-Timing reveals backend costs, so by default only staff and DEBUG sites see it """
+    return settings.DEBUG or getattr(settings, "SERVER_TIMING_HEADER", False) or is_staff
+
+
+def _finish(request, response, timings, is_staff):
+    total = time.perf_counter() - timings.start
+    view = _view_name(request)
+    REQUEST_LATENCY.observe(total, view=view, method=request.method, status=response.status_code)
+    REQUEST_QUERIES.observe(timings.queries, view=view)
+    for component, seconds in timings.seconds.items():
+        if seconds:
+            REQUEST_COMPONENT_LATENCY.observe(seconds, view=view, component=component)
+
+    if _show_timings(is_staff):
+        entries = [
+            f'db;dur={timings.seconds["db"] * 1000:.1f};desc="{timings.queries} queries"',
+            f'tpl;dur={timings.seconds["template"] * 1000:.1f}',
+        ]
+        entries += [f"{component};dur={timings.seconds[component] * 1000:.1f}"
+                    for component in ("stripe", "ses") if timings.seconds[component]]
+        entries.append(f"total;dur={total * 1000:.1f}")
+        response.headers["Server-Timing"] = ", ".join(entries)
+    return response
+
+
+@sync_and_async_middleware
+def request_metrics_middleware(get_response):
+    """ Time each request and its database, template, Stripe and SES work """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            timings = RequestTimings()
+            token = _current.set(timings)
+            try:
+                response = await get_response(request)
+            finally:
+                _current.reset(token)
+            user = await request.auser() if hasattr(request, "auser") else None
+            return _finish(request, response, timings, _is_staff(user))
+    else:
+        def middleware(request):
+            timings = RequestTimings()
+            token = _current.set(timings)
+            try:
+                response = get_response(request)
+            finally:
+                _current.reset(token)
+            return _finish(request, response, timings, _is_staff(getattr(request, "user", None)))
+    return middleware
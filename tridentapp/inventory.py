@@ -0,0 +1,156 @@
+""" Event seats: a denormalized Event.seats_remaining counter and the TicketOrder ledger.
+
+Seats are taken with one conditional UPDATE on the counter, so concurrent
+buyers can neither oversell nor have to wait behind a COUNT of the ledger.
+Paid checkouts hold their seats until the PaymentIntent succeeds, is
+canceled or the hold expires (see `manage.py release_seat_holds`).
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Least
+from django.utils import timezone
+
+from .models import Event, PaymentIntentRecord, TicketOrder
+
+logger = logging.getLogger(__name__)
+
+
+class SoldOut(Exception):
+    """ Not enough seats are left for the requested quantity """
+
+
+def hold_expiry():
+    return timezone.now() + timedelta(minutes=getattr(settings, "SEAT_HOLD_MINUTES", 15))
+
+
+def reserve_seats(event_id, quantity):
+    """ Take `quantity` seats in a single UPDATE; returns False if not enough are left.
+
+    Events without a capacity always succeed, since NULL - n stays NULL.
+    """
+    if quantity <= 0:
+        raise ValueError(f"Cannot reserve {quantity} seat(s)")
+    return bool(
+        Event.objects.filter(Q(seats_remaining__isnull=True) | Q(seats_remaining__gte=quantity), pk=event_id)
+        .update(seats_remaining=F('seats_remaining') - quantity)
+    )
+
+
+def release_seats(event_id, quantity):
+    """ Put `quantity` seats back on sale """
+    if quantity <= 0:
+        raise ValueError(f"Cannot release {quantity} seat(s)")
+    Event.objects.filter(pk=event_id, seats_remaining__isnull=False).update(
+        seats_remaining=Least(F('seats_remaining') + quantity, F('capacity'))
+    )
+
+
+def _resize(event_id, held, quantity):
+    """ Reserve or release the difference between seats already held and `quantity` """
+    if quantity > held:
+        return reserve_seats(event_id, quantity - held)
+    if quantity < held:
+        release_seats(event_id, held - quantity)
+    return True
+
+
+def hold_seats(intent, user=None):
+    """ Hold seats for an open event PaymentIntentRecord until it is paid or the hold expires.
+
+    Calling it again for the same intent only reserves or releases the change
+    in quantity and extends the hold. Raises SoldOut, leaving any existing
+    hold as it was.
+    """
+    with transaction.atomic():
+        order = TicketOrder.objects.select_for_update().filter(payment_intent=intent).first()
+        if order is not None and order.status == TicketOrder.CONFIRMED:
+            return order
+
+        held = order.quantity if order is not None and order.status == TicketOrder.HELD else 0
+        if not _resize(intent.event_id, held, intent.quantity):
+            raise SoldOut
+
+        if order is None:
+            return TicketOrder.objects.create(
+                event_id=intent.event_id, user=user, email=intent.email, quantity=intent.quantity,
+                payment_intent=intent, status=TicketOrder.HELD, expires_at=hold_expiry(),
+            )
+        order.quantity = intent.quantity
+        order.email = intent.email
+        order.status = TicketOrder.HELD
+        order.expires_at = hold_expiry()
+        order.save(update_fields=['quantity', 'email', 'status', 'expires_at', 'updated_at'])
+        return order
+
+
+def held_seats(owner_key, event_id):
+    """ Seats held by the buyer's open checkout for an event, which a new quote from them replaces """
+    return TicketOrder.objects.filter(
+        event_id=event_id, status=TicketOrder.HELD,
+        payment_intent__owner_key=owner_key, payment_intent__status=PaymentIntentRecord.OPEN,
+    ).order_by('-payment_intent__created_at').values_list('quantity', flat=True).first() or 0
+
+
+def confirm_order(stripe_intent_id, event_id, quantity, user_id=None, email=""):
+    """ Turn the hold for a paid PaymentIntent into sold seats, returning the TicketOrder.
+
+    A hold that expired before the payment arrived is reserved again. If the
+    seats were resold meanwhile the order is still confirmed, since the money
+    was taken, and the oversell is logged for the organiser to resolve.
+    """
+    with transaction.atomic():
+        record = PaymentIntentRecord.objects.filter(stripe_intent_id=stripe_intent_id).first()
+        order = None
+        if record is not None:
+            order = TicketOrder.objects.select_for_update().filter(payment_intent=record).first()
+        if order is not None and order.status == TicketOrder.CONFIRMED:
+            return order
+
+        held = order.quantity if order is not None and order.status == TicketOrder.HELD else 0
+        if not _resize(event_id, held, quantity):
+            logger.warning("Event %s oversold: PaymentIntent %s paid for %s seat(s) after the event filled up",
+                           event_id, stripe_intent_id, quantity - held)
+
+        if order is None:
+            return TicketOrder.objects.create(
+                event_id=event_id, user_id=user_id, email=email or "", quantity=quantity,
+                payment_intent=record, status=TicketOrder.CONFIRMED,
+            )
+        order.user_id = user_id or order.user_id
+        order.email = email or order.email
+        order.quantity = quantity
+        order.status = TicketOrder.CONFIRMED
+        order.expires_at = None
+        order.save(update_fields=['user', 'email', 'quantity', 'status', 'expires_at', 'updated_at'])
+        return order
+
+
+def _release_order(order_id, event_id, quantity):
+    with transaction.atomic():
+        # Only the caller that flips HELD -> RELEASED gives the seats back
+        if TicketOrder.objects.filter(pk=order_id, status=TicketOrder.HELD).update(
+            status=TicketOrder.RELEASED, updated_at=timezone.now()
+        ):
+            release_seats(event_id, quantity)
+            return True
+    return False
+
+
+def release_intent_hold(stripe_intent_id):
+    """ Give back the seats held for a canceled PaymentIntent """
+    held = TicketOrder.objects.filter(
+        payment_intent__stripe_intent_id=stripe_intent_id, status=TicketOrder.HELD
+    ).values_list('pk', 'event_id', 'quantity').first()
+    return bool(held) and _release_order(*held)
+
+
+def release_expired_holds(batch_size=500):
+    """ Put the seats of expired, unpaid holds back on sale, returning how many holds were released """
+    expired = TicketOrder.objects.filter(
+        status=TicketOrder.HELD, expires_at__lte=timezone.now()
+    ).order_by('expires_at').values_list('pk', 'event_id', 'quantity')[:batch_size]
+    return sum(_release_order(*row) for row in list(expired))
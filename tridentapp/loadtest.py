@@ -0,0 +1,530 @@
+""" Offline purchase-funnel load test for `manage.py load_test`.
+
+Simulated buyers run purchase_event -> pay_event -> stripe_webhook through the
+Django test client on a thread pool, against a scratch SQLite file. Stripe and
+SES are replaced by local HTTP servers with configurable latency and injected
+errors, so the real SDK clients, connection pools and retries are exercised.
+"""
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+import stripe
+from django.contrib.auth.models import User
+from django.db import connection, connections, OperationalError
+from django.db.models import Sum
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .benchmark import percentile
+from .mail import reset_ses_client
+from .models import Event, PaymentIntentRecord, ProcessedStripeEvent, StripeWebhookEvent, OutboundEmail, TicketOrder
+from .outbox import TokenBucket, send_outbox
+from .webhooks import process_inbox, recent_event_ids
+
+WEBHOOK_SECRET = "whsec_loadtest"
+CLIENT_SECRET = re.compile(r"pi_[0-9a-f]+_secret_[0-9a-f]+")
+ADMIN_EMAIL = "al@peeldev.com"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self._respond()
+
+    def do_POST(self):
+        self._respond()
+
+    def _respond(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        status, content_type, payload, headers = self.server.service.respond(self.command, self.path, body, self.headers)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeService:
+    """ Local HTTP stand-in for a provider, with latency and error injection """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.errors = 0
+        self.server = None
+
+    def start(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.daemon_threads = True
+        self.server.service = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def wait(self):
+        with self.lock:
+            delay = self.latency + self.rng.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def inject_error(self, name):
+        with self.lock:
+            self.calls[name] += 1
+            if self.rng.random() < self.error_rate:
+                self.errors += 1
+                return True
+        return False
+
+
+def _parse_form(body):
+    """ Stripe-style form body to a dict, with metadata[key]=value pairs nested """
+    data = {}
+    for key, value in parse_qsl(body.decode(), keep_blank_values=True):
+        if "[" in key:
+            outer, inner = key.rstrip("]").split("[", 1)
+            data.setdefault(outer, {})[inner] = value
+        else:
+            data[key] = value
+    return data
+
+
+class FakeStripe(FakeService):
+    """ Enough of the Stripe API for checkout: PaymentIntent create/retrieve/modify and Customer create.
+
+    Honours Idempotency-Key like Stripe does, and marks injected 500s with
+    Stripe-Should-Retry so the SDK's network retries kick in.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.intents = {}
+        self.idempotent = {}
+
+    def respond(self, method, path, body, headers):
+        self.wait()
+        path = path.split("?")[0]
+        name = path
+        if path.startswith("/v1/payment_intents/"):
+            name = "PaymentIntent.retrieve" if method == "GET" else "PaymentIntent.modify"
+        key = headers.get("Idempotency-Key")
+        with self.lock:
+            if key and key in self.idempotent:
+                return self.idempotent[key]
+        if self.inject_error(name):
+            error = {"error": {"type": "api_error", "message": "Injected failure"}}
+            return 500, "application/json", json.dumps(error).encode(), {"Stripe-Should-Retry": "true"}
+
+        form = _parse_form(body)
+        with self.lock:
+            if path == "/v1/payment_intents":
+                intent_id = f"pi_{uuid.uuid4().hex[:24]}"
+                obj = self.intents[intent_id] = {
+                    "id": intent_id,
+                    "object": "payment_intent",
+                    "client_secret": f"{intent_id}_secret_{uuid.uuid4().hex[:16]}",
+                    "amount": int(form.get("amount", 0)),
+                    "currency": form.get("currency", "usd"),
+                    "metadata": form.get("metadata", {}),
+                    "status": "requires_payment_method",
+                }
+            elif name in ("PaymentIntent.retrieve", "PaymentIntent.modify"):
+                obj = self.intents.get(path.rsplit("/", 1)[-1])
+                if obj is None:
+                    error = {"error": {"type": "invalid_request_error", "message": "No such payment_intent"}}
+                    return 404, "application/json", json.dumps(error).encode(), {}
+                if name == "PaymentIntent.modify":
+                    if "amount" in form:
+                        obj["amount"] = int(form["amount"])
+                    obj["metadata"].update(form.get("metadata", {}))
+            elif path == "/v1/customers":
+                obj = {"id": f"cus_{uuid.uuid4().hex[:14]}", "object": "customer", "email": form.get("email")}
+            else:
+                return 404, "application/json", b'{"error": {"type": "invalid_request_error"}}', {}
+            response = (200, "application/json", json.dumps(obj).encode(), {"Request-Id": f"req_{uuid.uuid4().hex}"})
+            if key:
+                self.idempotent[key] = response
+            return response
+
+    def succeed(self, client_secret, email, name=""):
+        """ Confirm an intent as the browser would and return the payment_intent.succeeded event """
+        with self.lock:
+            intent = self.intents[client_secret.split("_secret_")[0]]
+            intent["status"] = "succeeded"
+            intent["charges"] = {"data": [{"billing_details": {"email": email, "name": name}}]}
+            return {
+                "id": f"evt_{uuid.uuid4().hex[:24]}",
+                "object": "event",
+                "type": "payment_intent.succeeded",
+                "data": {"object": json.loads(json.dumps(intent))},
+            }
+
+
+class FakeSES(FakeService):
+    """ SES query API stand-in for SendRawEmail; injected errors are throttles """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.delivered = Counter()
+
+    def respond(self, method, path, body, headers):
+        self.wait()
+        form = dict(parse_qsl(body.decode(), keep_blank_values=True))
+        if self.inject_error(form.get("Action", "")):
+            xml = ("<ErrorResponse><Error><Type>Sender</Type><Code>Throttling</Code>"
+                   "<Message>Maximum sending rate exceeded.</Message></Error>"
+                   f"<RequestId>{uuid.uuid4()}</RequestId></ErrorResponse>")
+            return 400, "text/xml", xml.encode(), {}
+
+        with self.lock:
+            for key, value in form.items():
+                if key.startswith("Destinations.member."):
+                    self.delivered[value] += 1
+        xml = ("<SendRawEmailResponse><SendRawEmailResult>"
+               f"<MessageId>{uuid.uuid4()}</MessageId></SendRawEmailResult>"
+               f"<ResponseMetadata><RequestId>{uuid.uuid4()}</RequestId></ResponseMetadata></SendRawEmailResponse>")
+        return 200, "text/xml", xml.encode(), {}
+
+
+class LockStats:
+    """ execute_wrapper timing BEGIN IMMEDIATE, i.e. how long writers waited for the SQLite write lock """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waits = []
+        self.locked_errors = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as exc:
+            if "locked" in str(exc):
+                with self.lock:
+                    self.locked_errors += 1
+            raise
+        finally:
+            if sql.startswith("BEGIN"):
+                with self.lock:
+                    self.waits.append(time.perf_counter() - start)
+
+    def install(self, sender, connection, **kwargs):
+        connection.execute_wrappers.append(self)
+
+
+class StepTimer:
+    """ Latencies and failures per funnel step, shared by the buyer threads """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.failures = Counter()
+
+    @contextmanager
+    def step(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            with self.lock:
+                self.failures[name] += 1
+            raise
+        finally:
+            with self.lock:
+                self.latencies[name].append(time.perf_counter() - start)
+
+    def summary(self):
+        return {
+            name: {
+                "count": len(samples),
+                "failures": self.failures[name],
+                "p50_ms": round(percentile(samples, 50) * 1000, 2),
+                "p95_ms": round(percentile(samples, 95) * 1000, 2),
+                "p99_ms": round(percentile(samples, 99) * 1000, 2),
+                "max_ms": round(max(samples) * 1000, 2),
+            }
+            for name, samples in self.latencies.items()
+        }
+
+
+class UnexpectedResponse(Exception):
+    pass
+
+
+def _expect(response, status):
+    if response.status_code != status:
+        raise UnexpectedResponse(f"{response.request['PATH_INFO']} returned {response.status_code}")
+    return response
+
+
+def _webhook_headers(payload):
+    timestamp = int(time.time())
+    signature = hmac.new(WEBHOOK_SECRET.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return {"HTTP_STRIPE_SIGNATURE": f"t={timestamp},v1={signature}"}
+
+
+@contextmanager
+def scratch_database():
+    """ Create a throwaway copy of the schema in a temporary file and point connections at it """
+    db = connections["default"]
+    old_name = db.settings_dict["NAME"]
+    old_test = dict(db.settings_dict.get("TEST", {}))
+    tmp = tempfile.mkdtemp(prefix="trident-loadtest-")
+    if db.vendor == "sqlite":
+        # A file, not the default in-memory test database, so threads contend like production
+        db.settings_dict.setdefault("TEST", {})["NAME"] = os.path.join(tmp, "loadtest.sqlite3")
+    db.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connections.close_all()
+        db.creation.destroy_test_db(old_name, verbosity=0)
+        db.settings_dict["TEST"] = old_test
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def run_load_test(fake_stripe, fake_ses, buyers=200, concurrency=20, logged_in_ratio=0.5,
+                  duplicate_rate=0.1, workers=2, capacity=None, seed=1, log=print):
+    """ Run the funnel against an already started FakeStripe and FakeSES, returning the report.
+
+    With a `capacity` the event is a limited drop and buyers beyond it are
+    turned away at the quote or payment step.
+    """
+    rng = random.Random(seed)
+    steps = StepTimer()
+    locks = LockStats()
+
+    old_stripe = (stripe.api_base, stripe.api_key)
+    stripe.api_base, stripe.api_key = fake_stripe.url, "sk_test_loadtest"
+    overrides = override_settings(
+        ALLOWED_HOSTS=["testserver"],
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+        STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET,
+        EMAIL_BACKEND="tridentapp.mail.SESEmailBackend",
+        SES_ENDPOINT_URL=fake_ses.url,
+        SES_MOCAPSCHOOL_KEY="loadtest",
+        SES_MOCAPSCHOOL_SECRET="loadtest",
+        SES_MOCAPSCHOOL_REGION="us-east-1",
+    )
+    overrides.enable()
+    reset_ses_client()
+    recent_event_ids.clear()
+    connection_created.connect(locks.install)
+    try:
+        with scratch_database():
+            connection.execute_wrappers.append(locks)
+            return _run(fake_stripe, fake_ses, steps, locks, rng, buyers, concurrency,
+                        logged_in_ratio, duplicate_rate, workers, capacity, log)
+    finally:
+        connection_created.disconnect(locks.install)
+        if locks in connection.execute_wrappers:
+            connection.execute_wrappers.remove(locks)
+        overrides.disable()
+        reset_ses_client()
+        recent_event_ids.clear()
+        stripe.api_base, stripe.api_key = old_stripe
+
+
+def _run(fake_stripe, fake_ses, steps, locks, rng, buyers, concurrency, logged_in_ratio, duplicate_rate,
+         workers, capacity, log):
+    event = Event.objects.create(title="Load test drop", date=timezone.now() + timedelta(days=7),
+                                 price=Decimal("25.00"), capacity=capacity)
+    emails = [f"buyer{i}@example.com" for i in range(buyers)]
+    logged_in = {i for i in range(buyers) if rng.random() < logged_in_ratio}
+    User.objects.bulk_create(User(username=f"buyer{i}", email=emails[i]) for i in logged_in)
+    users = {user.email: user for user in User.objects.filter(email__in=emails)}
+    plan = [(emails[i], rng.randint(1, 3), rng.random() < duplicate_rate) for i in range(buyers)]
+
+    confirmed = []
+    duplicates = []
+    sold_out = []
+    result_lock = threading.Lock()
+    purchase_url = reverse("purchase_event", args=[event.pk])
+    webhook_url = reverse("stripe_webhook")
+
+    def buy(email, quantity, duplicate):
+        client = Client(raise_request_exception=False)
+        try:
+            if email in users:
+                client.force_login(users[email])
+            with steps.step("purchase_page"):
+                _expect(client.get(purchase_url), 200)
+            with steps.step("quote"):
+                response = client.post(purchase_url, {
+                    "quantity": quantity, "action": "continue", "email": email,
+                })
+                # The purchase page is shown again when too few seats are left
+                if capacity is not None and response.status_code == 200:
+                    with result_lock:
+                        sold_out.append(email)
+                    return
+                _expect(response, 302)
+            with steps.step("pay_event"):
+                response = client.get(response["Location"])
+                # Lost the race for the last seats after the quote
+                if capacity is not None and response.status_code == 302:
+                    with result_lock:
+                        sold_out.append(email)
+                    return
+                _expect(response, 200)
+                secret = CLIENT_SECRET.search(response.content.decode())
+                if not secret:
+                    raise UnexpectedResponse("pay_event rendered no client secret")
+            # The browser confirms with Stripe.js, then Stripe sends the webhook
+            payload = json.dumps(fake_stripe.succeed(secret.group(), email, email.split("@")[0]))
+            with result_lock:
+                confirmed.append(email)
+            with steps.step("webhook"):
+                _expect(Client(raise_request_exception=False).post(
+                    webhook_url, payload, content_type="application/json", **_webhook_headers(payload)
+                ), 200)
+            if duplicate:
+                with result_lock:
+                    duplicates.append(payload)
+        except UnexpectedResponse:
+            pass
+        finally:
+            connections.close_all()
+
+    def redeliver(payload):
+        try:
+            with steps.step("webhook_redelivery"):
+                _expect(Client(raise_request_exception=False).post(
+                    webhook_url, payload, content_type="application/json", **_webhook_headers(payload)
+                ), 200)
+        except UnexpectedResponse:
+            pass
+        finally:
+            connections.close_all()
+
+    log(f"Running {buyers} buyers with concurrency {concurrency}")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda args: buy(*args), plan))
+        # Stripe retries deliveries; send the duplicates while other buyers' rows are being written
+        list(pool.map(redeliver, duplicates))
+    funnel_seconds = time.perf_counter() - start
+
+    def drain(work):
+        try:
+            while work():
+                pass
+        finally:
+            connections.close_all()
+
+    log("Draining the webhook inbox")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(drain, [lambda: process_inbox(50)] * workers))
+    inbox_seconds = time.perf_counter() - start
+
+    log("Sending the outbox through SES")
+    start = time.perf_counter()
+    bucket = TokenBucket(1000)
+    drain(lambda: send_outbox(bucket, 50))
+    outbox_seconds = time.perf_counter() - start
+
+    return _report(event, users, confirmed, duplicates, sold_out, steps, locks, fake_stripe, fake_ses,
+                   buyers, funnel_seconds, inbox_seconds, outbox_seconds)
+
+
+def _seat_report(event, sold_out):
+    event.refresh_from_db(fields=['capacity', 'seats_remaining'])
+    orders = TicketOrder.objects.filter(event=event)
+    sold = orders.filter(status=TicketOrder.CONFIRMED).aggregate(total=Sum('quantity'))['total'] or 0
+    taken = orders.filter(status__in=TicketOrder.ACTIVE).aggregate(total=Sum('quantity'))['total'] or 0
+    report = {"capacity": event.capacity, "seats_sold": sold, "sold_out_buyers": len(sold_out)}
+    if event.capacity is not None:
+        report["oversold_seats"] = max(0, taken - event.capacity)
+        # The counter must agree with the ledger
+        report["seat_counter_drift"] = event.capacity - taken - event.seats_remaining
+    return report
+
+
+def _report(event, users, confirmed, duplicates, sold_out, steps, locks, fake_stripe, fake_ses,
+            buyers, funnel_seconds, inbox_seconds, outbox_seconds):
+    purchasers = set(event.purchasers.values_list('email', flat=True))
+    expected_purchasers = {email for email in confirmed if email in users}
+    emails = Counter(
+        OutboundEmail.objects.filter(subject="Purchase ok").values_list('to_email', flat=True)
+    )
+    admin_emails = OutboundEmail.objects.filter(to_email=ADMIN_EMAIL).count()
+    succeeded = PaymentIntentRecord.objects.filter(event=event, status=PaymentIntentRecord.SUCCEEDED).count()
+
+    return {
+        "buyers": buyers,
+        "completed": len(confirmed),
+        "funnel_seconds": round(funnel_seconds, 3),
+        "throughput_per_second": round(len(confirmed) / funnel_seconds, 2) if funnel_seconds else 0.0,
+        "steps": steps.summary(),
+        "db": {
+            "write_lock_waits": len(locks.waits),
+            "write_lock_wait_p99_ms": round(percentile(locks.waits, 99) * 1000, 2) if locks.waits else 0.0,
+            "write_lock_wait_max_ms": round(max(locks.waits) * 1000, 2) if locks.waits else 0.0,
+            "write_lock_wait_total_s": round(sum(locks.waits), 3),
+            "database_locked_errors": locks.locked_errors,
+        },
+        "integrity": {
+            "confirmed_payments": len(confirmed),
+            "succeeded_intent_records": succeeded,
+            "lost_purchasers": len(expected_purchasers - purchasers),
+            "lost_confirmation_emails": sum(1 for email in confirmed if not emails[email]),
+            "duplicate_confirmation_emails": sum(count - 1 for count in emails.values() if count > 1),
+            "admin_emails": admin_emails,
+            "duplicate_deliveries_sent": len(duplicates),
+            "ledger_rows": ProcessedStripeEvent.objects.count(),
+            "inbox_rows": StripeWebhookEvent.objects.count(),
+            "inbox_failed": StripeWebhookEvent.objects.filter(status=StripeWebhookEvent.FAILED).count(),
+        },
+        "seats": _seat_report(event, sold_out),
+        "workers": {
+            "inbox_drain_seconds": round(inbox_seconds, 3),
+            "outbox_drain_seconds": round(outbox_seconds, 3),
+            "emails_sent": OutboundEmail.objects.filter(status=OutboundEmail.DONE).count(),
+            "emails_pending": OutboundEmail.objects.filter(status=OutboundEmail.PENDING).count(),
+            "emails_failed": OutboundEmail.objects.filter(status=OutboundEmail.FAILED).count(),
+        },
+        "stripe": {"calls": dict(fake_stripe.calls), "injected_errors": fake_stripe.errors},
+        "ses": {
+            "calls": sum(fake_ses.calls.values()),
+            "injected_throttles": fake_ses.errors,
+            "duplicate_buyer_deliveries": sum(
+                count - 1 for address, count in fake_ses.delivered.items() if address != ADMIN_EMAIL and count > 1
+            ),
+        },
+    }
@@ -0,0 +1,90 @@
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+from django.conf import settings
+from django.core.mail.backends.base import BaseEmailBackend
+
+from .instrumentation import record
+from .metrics import Histogram
+
+SES_LATENCY = Histogram(
+    "ses_request_duration_seconds",
+    "Time spent waiting on SES send_raw_email",
+    labelnames=("outcome",),
+)
+
+_ses_client = None
+_ses_client_lock = threading.Lock()
+
+
+def get_ses_client():
+    """ Return the process-wide SES client, creating it on first use.
+
+    boto3 clients are thread safe, so every request and worker thread shares
+    this one client and the HTTPS connections in its pool.
+    """
+    global _ses_client
+    if _ses_client is None:
+        with _ses_client_lock:
+            if _ses_client is None:
+                _ses_client = boto3.session.Session().client(
+                    "ses",
+                    aws_access_key_id=settings.SES_MOCAPSCHOOL_KEY,
+                    aws_secret_access_key=settings.SES_MOCAPSCHOOL_SECRET,
+                    region_name=settings.SES_MOCAPSCHOOL_REGION,
+                    endpoint_url=getattr(settings, "SES_ENDPOINT_URL", None),
+                    config=Config(
+                        max_pool_connections=getattr(settings, "SES_MAX_POOL_CONNECTIONS", 10),
+                        connect_timeout=5,
+                        read_timeout=10,
+                        retries={"max_attempts": 3, "mode": "standard"},
+                    ),
+                )
+    return _ses_client
+
+
+def reset_ses_client():
+    """ Drop the shared client so the next send picks up changed SES settings """
+    global _ses_client
+    with _ses_client_lock:
+        _ses_client = None
+
+
+class SESEmailBackend(BaseEmailBackend):
+    """ Django email backend that sends through the shared SES client.
+
+    Messages go out with send_raw_email so multipart text/HTML bodies and
+    attachments are delivered exactly as Django builds them.
+    """
+
+    def send_messages(self, email_messages):
+        if not email_messages:
+            return 0
+
+        client = get_ses_client()
+        sent = 0
+        for message in email_messages:
+            recipients = message.recipients()
+            if not recipients:
+                continue
+            outcome = "error"
+            start = time.perf_counter()
+            try:
+                client.send_raw_email(
+                    Source=message.from_email or settings.DEFAULT_FROM_EMAIL,
+                    Destinations=recipients,
+                    RawMessage={"Data": message.message().as_bytes(linesep="\r\n")},
+                )
+                outcome = "ok"
+            except Exception:
+                if not self.fail_silently:
+                    raise
+            else:
+                sent += 1
+            finally:
+                elapsed = time.perf_counter() - start
+                SES_LATENCY.observe(elapsed, outcome=outcome)
+                record("ses", elapsed)
+        return sent
@@ -0,0 +1,48 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tridentapp.benchmark import run_benchmarks, compare
+
+
+class Command(BaseCommand):
+    help = "Time every route in tridentapp.urls and record p50/p90/p99, query and row counts as a JSON baseline"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=20)
+        parser.add_argument("--warmup", type=int, default=2)
+        parser.add_argument("--cold-cache", action="store_true",
+                            help="Clear the cache before every request")
+        parser.add_argument("--output", help="Write the results to this JSON file")
+        parser.add_argument("--compare", metavar="BASELINE",
+                            help="Diff against a previous --output file; exits non-zero on regressions")
+        parser.add_argument("--threshold", type=float, default=20.0,
+                            help="Percent p50 slowdown that counts as a regression with --compare")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"]) as handle:
+                baseline = json.load(handle)
+
+        try:
+            results = run_benchmarks(
+                iterations=options["iterations"],
+                warmup=options["warmup"],
+                cold_cache=options["cold_cache"],
+                log=self.stdout.write,
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        if options["output"]:
+            with open(options["output"], "w") as handle:
+                json.dump(results, handle, indent=2, sort_keys=True)
+            self.stdout.write(f"Wrote {options['output']}")
+
+        if baseline:
+            lines, regressed = compare(baseline, results, options["threshold"])
+            for line in lines:
+                self.stdout.write(line)
+            if regressed:
+                raise CommandError("Performance regressed against the baseline")
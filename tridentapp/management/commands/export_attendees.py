@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tridentapp.attendees import FORMATS, attendee_rows
+from tridentapp.models import Event
+
+
+class Command(BaseCommand):
+    help = "Write the door list (account holders and guest buyers, with ticket quantities) for events"
+
+    def add_arguments(self, parser):
+        parser.add_argument("event_ids", nargs="+", type=int)
+        parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+        parser.add_argument("--output", help="File to write instead of stdout")
+
+    def handle(self, *args, **options):
+        events = list(Event.objects.filter(pk__in=options["event_ids"]).only('pk', 'title').order_by('date'))
+        missing = set(options["event_ids"]) - {event.pk for event in events}
+        if missing:
+            raise CommandError(f"No event with id {', '.join(map(str, sorted(missing)))}")
+
+        lines, _ = FORMATS[options["format"]]
+        if options["output"]:
+            with open(options["output"], "w", newline="") as handle:
+                handle.writelines(lines(attendee_rows(events)))
+        else:
+            for line in lines(attendee_rows(events)):
+                self.stdout.write(line, ending="")
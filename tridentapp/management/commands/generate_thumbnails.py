@@ -0,0 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from tridentapp.models import Event
+from tridentapp.thumbnails import generate_thumbnails, invalidate_image_pages
+
+
+class Command(BaseCommand):
+    help = "Create missing thumbnails for every Event image"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4,
+                            help="Images resized concurrently")
+
+    def handle(self, *args, **options):
+        names = list(
+            Event.objects.exclude(image__isnull=True).exclude(image='')
+            .values_list('image', flat=True).distinct()
+        )
+
+        created = 0
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            for name, result in zip(names, pool.map(self.generate, names)):
+                if isinstance(result, Exception):
+                    self.stderr.write(f"Could not resize {name}: {result}")
+                elif result:
+                    created += result
+                    invalidate_image_pages(name)
+        self.stdout.write(f"Created {created} thumbnail(s) for {len(names)} image(s)")
+
+    def generate(self, name):
+        try:
+            return generate_thumbnails(name)
+        except Exception as exc:
+            return exc
@@ -0,0 +1,72 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from tridentapp.loadtest import FakeStripe, FakeSES, run_load_test
+
+
+class Command(BaseCommand):
+    help = ("Drive concurrent simulated buyers through purchase_event -> pay_event -> stripe_webhook "
+            "against local Stripe and SES stand-ins and a scratch database")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--buyers", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=20)
+        parser.add_argument("--logged-in-ratio", type=float, default=0.5,
+                            help="Share of buyers who check out with an account rather than as guests")
+        parser.add_argument("--duplicate-rate", type=float, default=0.1,
+                            help="Share of webhooks Stripe delivers twice")
+        parser.add_argument("--workers", type=int, default=2, help="Concurrent process_webhooks workers")
+        parser.add_argument("--capacity", type=int, default=None,
+                            help="Seats on sale; buyers beyond it are turned away")
+        parser.add_argument("--stripe-latency", type=float, default=0.3, help="Seconds per Stripe call")
+        parser.add_argument("--stripe-jitter", type=float, default=0.1)
+        parser.add_argument("--stripe-error-rate", type=float, default=0.02)
+        parser.add_argument("--ses-latency", type=float, default=0.05, help="Seconds per SES call")
+        parser.add_argument("--ses-throttle-rate", type=float, default=0.05)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--output", help="Also write the report to this JSON file")
+
+    def handle(self, *args, **options):
+        fake_stripe = FakeStripe(latency=options["stripe_latency"], jitter=options["stripe_jitter"],
+                                 error_rate=options["stripe_error_rate"], seed=options["seed"]).start()
+        fake_ses = FakeSES(latency=options["ses_latency"], error_rate=options["ses_throttle_rate"],
+                           seed=options["seed"]).start()
+        try:
+            report = run_load_test(
+                fake_stripe, fake_ses,
+                buyers=options["buyers"],
+                concurrency=options["concurrency"],
+                logged_in_ratio=options["logged_in_ratio"],
+                duplicate_rate=options["duplicate_rate"],
+                workers=options["workers"],
+                capacity=options["capacity"],
+                seed=options["seed"],
+                log=self.stdout.write,
+            )
+        finally:
+            fake_stripe.stop()
+            fake_ses.stop()
+
+        self.stdout.write(
+            f"{report['completed']}/{report['buyers']} purchases in {report['funnel_seconds']}s "
+            f"({report['throughput_per_second']}/s)"
+        )
+        for name, step in report["steps"].items():
+            self.stdout.write(
+                f"  {name:<20} n={step['count']:<5} failed={step['failures']:<4} p50 {step['p50_ms']:>8}ms  "
+                f"p95 {step['p95_ms']:>8}ms  p99 {step['p99_ms']:>8}ms  max {step['max_ms']:>8}ms"
+            )
+        for section in ("db", "integrity", "seats", "workers", "stripe", "ses"):
+            self.stdout.write(f"{section}: " + ", ".join(f"{key}={value}" for key, value in report[section].items()))
+
+        integrity = report["integrity"]
+        if integrity["lost_purchasers"] or integrity["lost_confirmation_emails"] \
+                or integrity["duplicate_confirmation_emails"]:
+            self.stdout.write(self.style.ERROR("Lost or duplicate purchases detected"))
+        if report["seats"].get("oversold_seats") or report["seats"].get("seat_counter_drift"):
+            self.stdout.write(self.style.ERROR("Seats oversold or seat counter out of step with the ledger"))
+
+        if options["output"]:
+            with open(options["output"], "w") as handle:
+                json.dump(report, handle, indent=2, sort_keys=True)
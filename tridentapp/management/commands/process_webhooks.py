@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tridentapp.webhooks import process_inbox
+
+
+class Command(BaseCommand):
+    help = "Process stored Stripe webhook deliveries, retrying failures with backoff"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument("--sleep", type=float, default=2.0,
+                            help="Seconds to wait when the inbox is empty")
+        parser.add_argument("--once", action="store_true",
+                            help="Drain the inbox once and exit (for cron)")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        while True:
+            handled = process_inbox(batch_size)
+            if handled:
+                self.stdout.write(f"Processed {handled} webhook event(s)")
+                continue
+            if options["once"]:
+                break
+            time.sleep(options["sleep"])
@@ -0,0 +1,72 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from tridentapp.models import Customer
+from tridentapp.payments import create_stripe_customer
+
+
+class Command(BaseCommand):
+    help = "Create Stripe customers for active users that don't have one yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=8,
+                            help="Concurrent Stripe requests")
+        parser.add_argument("--batch-size", type=int, default=200)
+        parser.add_argument("--loop", action="store_true",
+                            help="Keep running and pick up newly activated accounts")
+        parser.add_argument("--sleep", type=float, default=30.0,
+                            help="Seconds between passes with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            created, failed = self.provision_pass(options["batch_size"], options["workers"])
+            if created:
+                self.stdout.write(f"Provisioned {created} Stripe customer(s)")
+            if failed:
+                self.stderr.write(f"{len(failed)} user(s) could not be provisioned and will be retried "
+                                  f"on the next pass: {', '.join(failed)}")
+            if not options["loop"]:
+                break
+            time.sleep(options["sleep"])
+
+    def provision_pass(self, batch_size, workers):
+        """ Walk every unprovisioned user once, in pk order, returning (created, failed usernames).
+
+        The pk cursor moves past users whose Stripe call failed, so a run of
+        failures can't hide the users after them.
+        """
+        created = 0
+        failed = []
+        cursor = 0
+        while True:
+            users = list(
+                User.objects.filter(is_active=True, stripe_customer__isnull=True, pk__gt=cursor)
+                .order_by('pk')
+                .only('id', 'username', 'email', 'first_name', 'last_name')[:batch_size]
+            )
+            if not users:
+                return created, failed
+            cursor = users[-1].pk
+            batch_created, batch_failed = self.provision_batch(users, workers)
+            created += batch_created
+            failed += batch_failed
+
+    def provision_batch(self, users, workers):
+        # Threads only talk to Stripe; database writes stay on this thread
+        customers = []
+        failed = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(create_stripe_customer, user): user for user in users}
+            for future in as_completed(futures):
+                user = futures[future]
+                try:
+                    customers.append(Customer(user=user, stripe_customer_id=future.result()))
+                except Exception as exc:
+                    self.stderr.write(f"Could not provision {user.username}: {exc}")
+                    failed.append(user.username)
+
+        Customer.objects.bulk_create(customers, ignore_conflicts=True)
+        return len(customers), failed
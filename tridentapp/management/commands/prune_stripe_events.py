@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from tridentapp.models import ProcessedStripeEvent, StripeWebhookEvent
+
+
+class Command(BaseCommand):
+    help = "Delete old processed Stripe event ids and finished webhook inbox rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=None,
+                            help="Keep this many days (defaults to STRIPE_EVENT_RETENTION_DAYS)")
+
+    def handle(self, *args, **options):
+        days = options["days"] or getattr(settings, "STRIPE_EVENT_RETENTION_DAYS", 30)
+        cutoff = timezone.now() - timedelta(days=days)
+
+        ledger, _ = ProcessedStripeEvent.objects.filter(processed_at__lt=cutoff).delete()
+        inbox, _ = StripeWebhookEvent.objects.filter(
+            status=StripeWebhookEvent.DONE, processed_at__lt=cutoff
+        ).delete()
+        self.stdout.write(f"Deleted {ledger} ledger row(s) and {inbox} inbox row(s) older than {days} days")
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tridentapp.inventory import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = "Put the seats of expired, unpaid checkout holds back on sale"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--sleep", type=float, default=30.0,
+                            help="Seconds to wait when no hold has expired")
+        parser.add_argument("--once", action="store_true",
+                            help="Release expired holds once and exit (for cron)")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        while True:
+            released = release_expired_holds(batch_size)
+            if released:
+                self.stdout.write(f"Released {released} expired hold(s)")
+                continue
+            if options["once"]:
+                break
+            time.sleep(options["sleep"])
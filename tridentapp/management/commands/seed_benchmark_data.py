@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tridentapp.benchmark import seed_data, clear_data
+
+
+class Command(BaseCommand):
+    help = "Fill the database with production-sized synthetic users, events and purchasers for benchmark_views"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=200000)
+        parser.add_argument("--events", type=int, default=10000)
+        parser.add_argument("--products", type=int, default=20)
+        parser.add_argument("--purchasers-per-event", type=int, default=100)
+        parser.add_argument("--large-events", type=int, default=10,
+                            help="Upcoming events given a large purchasers list")
+        parser.add_argument("--large-event-purchasers", type=int, default=20000)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=1, help="Random seed, for repeatable data")
+        parser.add_argument("--clear", action="store_true",
+                            help="Delete previously seeded benchmark rows instead of adding more")
+        parser.add_argument("--force", action="store_true",
+                            help="Allow running when DEBUG is off")
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options["force"]:
+            raise CommandError("Refusing to seed a non-DEBUG deployment; pass --force if this is a scratch database")
+
+        if options["clear"]:
+            clear_data(log=self.stdout.write)
+            return
+
+        seed_data(
+            users=options["users"],
+            events=options["events"],
+            products=options["products"],
+            purchasers_per_event=options["purchasers_per_event"],
+            large_events=options["large_events"],
+            large_event_purchasers=options["large_event_purchasers"],
+            batch_size=options["batch_size"],
+            seed=options["seed"],
+            log=self.stdout.write,
+        )
@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tridentapp.outbox import TokenBucket, send_outbox
+
+
+class Command(BaseCommand):
+    help = "Send queued outbox emails through SES within the configured sending rate"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument("--rate", type=float, default=None,
+                            help="Messages per second (defaults to EMAIL_OUTBOX_RATE)")
+        parser.add_argument("--sleep", type=float, default=2.0,
+                            help="Seconds to wait when the outbox is empty")
+        parser.add_argument("--once", action="store_true",
+                            help="Drain the outbox once and exit (for cron)")
+
+    def handle(self, *args, **options):
+        rate = options["rate"] or getattr(settings, "EMAIL_OUTBOX_RATE", 1)
+        bucket = TokenBucket(rate)
+
+        while True:
+            handled = send_outbox(bucket, options["batch_size"])
+            if handled:
+                self.stdout.write(f"Handled {handled} email(s)")
+                continue
+            if options["once"]:
+                break
+            time.sleep(options["sleep"])
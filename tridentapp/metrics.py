@@ -0,0 +1,65 @@
+""" Small in-process metrics registry, rendered in the Prometheus text format """
+import threading
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REGISTRY = []
+
+
+class Histogram:
+    """ Thread-safe histogram with one series per label set """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {key: {"buckets": list(s["buckets"]), "sum": s["sum"], "count": s["count"]}
+                    for key, s in self._series.items()}
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self.snapshot().items()):
+            labels = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)]
+            bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+            counts = series["buckets"] + [series["count"]]
+            for bound, count in zip(bounds, counts):
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(labels + [le])} {count}")
+            lines.append(f"{self.name}_sum{_labels(labels)} {series['sum']}")
+            lines.append(f"{self.name}_count{_labels(labels)} {series['count']}")
+        return "\n".join(lines)
+
+
+def _labels(pairs):
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_metrics():
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
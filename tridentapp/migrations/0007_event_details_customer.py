@@ -0,0 +1,51 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:06
+
+import django.db.models.deletion
+import django_ckeditor_5.fields
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tridentapp', '0006_event_price'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='description',
+            field=django_ckeditor_5.fields.CKEditor5Field(blank=True, null=True, verbose_name='Description'),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='image',
+            field=models.ImageField(blank=True, null=True, upload_to='events/'),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='promo_code',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='promo_discount',
+            field=models.PositiveIntegerField(default=0, help_text='Discount percentage (e.g. 10 for 10%)'),
+        ),
+        migrations.AlterField(
+            model_name='event',
+            name='content',
+            field=django_ckeditor_5.fields.CKEditor5Field(blank=True, null=True, verbose_name='Content'),
+        ),
+        migrations.CreateModel(
+            name='Customer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stripe_customer_id', models.CharField(max_length=255, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stripe_customer', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+from tridentapp.sanitize import sanitize_html, html_excerpt
+
+
+def render_existing_events(apps, schema_editor):
+    Event = apps.get_model('tridentapp', 'Event')
+    max_length = getattr(settings, "EVENT_DESCRIPTION_MAX_LENGTH", 5000)
+    for event in Event.objects.all():
+        event.description_html = sanitize_html(event.description, max_length=max_length)
+        event.content_html = sanitize_html(event.content)
+        event.excerpt = html_excerpt(event.description or event.content)
+        event.save(update_fields=['description_html', 'content_html', 'excerpt'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tridentapp', '0011_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='content_html',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='description_html',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='excerpt',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(render_existing_events, migrations.RunPython.noop),
+    ]
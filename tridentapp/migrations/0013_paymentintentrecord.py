@@ -0,0 +1,35 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tridentapp', '0012_event_rendered_html'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentIntentRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stripe_intent_id', models.CharField(max_length=255, unique=True)),
+                ('client_secret', models.CharField(max_length=255)),
+                ('owner_key', models.CharField(max_length=100)),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('promo_code', models.CharField(blank=True, default='', max_length=50)),
+                ('amount', models.PositiveIntegerField(help_text='Amount in cents')),
+                ('email', models.EmailField(blank=True, default='', max_length=254)),
+                ('status', models.CharField(choices=[('open', 'Open'), ('succeeded', 'Succeeded'), ('canceled', 'Canceled')], default='open', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('event', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payment_intents', to='tridentapp.event')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payment_intents', to='tridentapp.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner_key', 'status'], name='intent_owner_idx')],
+            },
+        ),
+    ]
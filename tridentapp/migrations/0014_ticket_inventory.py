@@ -0,0 +1,69 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_ticket_orders(apps, schema_editor):
+    """ Confirmed orders for past paid purchases, and one seat per purchaser without one """
+    Event = apps.get_model('tridentapp', 'Event')
+    PaymentIntentRecord = apps.get_model('tridentapp', 'PaymentIntentRecord')
+    TicketOrder = apps.get_model('tridentapp', 'TicketOrder')
+
+    orders = []
+    paid = set()
+    intents = PaymentIntentRecord.objects.filter(event__isnull=False, status='succeeded')
+    for intent in intents.iterator():
+        user_id = None
+        if intent.owner_key.startswith('user:'):
+            user_id = int(intent.owner_key.removeprefix('user:'))
+            paid.add((intent.event_id, user_id))
+        orders.append(TicketOrder(event_id=intent.event_id, user_id=user_id, email=intent.email,
+                                  quantity=intent.quantity, payment_intent_id=intent.pk, status='confirmed'))
+
+    for row in Event.purchasers.through.objects.values('event_id', 'user_id', 'user__email').iterator():
+        if (row['event_id'], row['user_id']) not in paid:
+            orders.append(TicketOrder(event_id=row['event_id'], user_id=row['user_id'], email=row['user__email'],
+                                      quantity=1, status='confirmed'))
+    TicketOrder.objects.bulk_create(orders, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tridentapp', '0013_paymentintentrecord'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='capacity',
+            field=models.PositiveIntegerField(blank=True, help_text='Seats available; leave empty for no limit', null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='seats_remaining',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='TicketOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(blank=True, default='', max_length=254)),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('status', models.CharField(choices=[('held', 'Held'), ('confirmed', 'Confirmed'), ('released', 'Released')], default='held', max_length=20)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ticket_orders', to='tridentapp.event')),
+                ('payment_intent', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ticket_order', to='tridentapp.paymentintentrecord')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ticket_orders', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'expires_at'], name='ticket_hold_idx'), models.Index(fields=['event', 'status'], name='ticket_event_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_ticket_orders, migrations.RunPython.noop),
+    ]
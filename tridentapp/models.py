@@ -1,8 +1,13 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, F, OuterRef, Subquery, Sum, When
+from django.db.models.functions import Coalesce, Greatest
 from django.contrib.auth.models import User
 from django.conf import settings
+from django.utils import timezone
 from django_ckeditor_5.fields import CKEditor5Field
 
+from .sanitize import sanitize_html, html_excerpt
+
 class Event(models.Model):
     """ Event tickets can be purchased to be attended on a specific date """
     title = models.CharField(default='', max_length=255)
@@ -15,11 +20,84 @@ class Event(models.Model):
     promo_code = models.CharField(max_length=50, blank=True, null=True)
     promo_discount = models.PositiveIntegerField(default=0, help_text="Discount percentage (e.g. 10 for 10%)")
     image = models.ImageField(upload_to='events/', blank=True, null=True)
+    capacity = models.PositiveIntegerField(null=True, blank=True, help_text="Seats available; leave empty for no limit")
+    # Denormalized count of unreserved seats, decremented by tridentapp.inventory.reserve_seats
+    seats_remaining = models.PositiveIntegerField(null=True, blank=True, editable=False)
+
+    # Derived from description and content on save, see tridentapp.sanitize
+    description_html = models.TextField(blank=True, default='', editable=False)
+    content_html = models.TextField(blank=True, default='', editable=False)
+    excerpt = models.CharField(max_length=255, blank=True, default='', editable=False)
 
+    class Meta:
+        indexes = [
+            # Every public page filters and orders by date
+            models.Index(fields=['date'], name='event_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.date} - {self.title}"
 
+    def render_html(self):
+        """ Refresh the sanitized HTML and excerpt from the CKEditor fields """
+        self.description_html = sanitize_html(
+            self.description, max_length=getattr(settings, "EVENT_DESCRIPTION_MAX_LENGTH", 5000)
+        )
+        self.content_html = sanitize_html(self.content)
+        self.excerpt = html_excerpt(self.description or self.content,
+                                    length=self._meta.get_field('excerpt').max_length)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What the stored HTML was rendered from, so saves that don't change it skip sanitizing
+        instance._rendered_source = (instance.__dict__.get('description'), instance.__dict__.get('content'))
+        return instance
+
+    def html_is_stale(self, update_fields=None):
+        """ Whether this save has to re-render description_html, content_html and excerpt """
+        sources = {'description', 'content'}
+        if update_fields is not None and not sources & set(update_fields):
+            return False
+        if sources <= self.get_deferred_fields():
+            # Neither was loaded, so neither is being saved
+            return False
+        return (self.description, self.content) != getattr(self, '_rendered_source', None)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if self.html_is_stale(update_fields):
+            self.render_html()
+            self._rendered_source = (self.description, self.content)
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'description_html', 'content_html', 'excerpt'}
+        if 'capacity' in self.get_deferred_fields() or (update_fields is not None and 'capacity' not in update_fields):
+            # Capacity isn't being saved, so the seat counter stays as it is
+            super().save(*args, **kwargs)
+            return
+        if self.capacity is None:
+            # No limit, nothing to count
+            self.seats_remaining = None
+            if update_fields is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'seats_remaining'}
+            super().save(*args, **kwargs)
+            return
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            self.refresh_seats_remaining()
+
+    def refresh_seats_remaining(self):
+        """ Recount the free seats from the TicketOrder ledger in a single UPDATE """
+        taken = (
+            TicketOrder.objects.filter(event=OuterRef('pk'), status__in=TicketOrder.ACTIVE)
+            .values('event').annotate(total=Sum('quantity')).values('total')
+        )
+        remaining = Greatest(F('capacity') - Coalesce(Subquery(taken), 0), 0)
+        Event.objects.filter(pk=self.pk).update(
+            seats_remaining=Case(When(capacity__isnull=True, then=None), default=remaining)
+        )
+        self.refresh_from_db(fields=['seats_remaining'])
+
 
 class Product(models.Model):
     """ A product is purchased and assigned to a user, e.g. a subscription """
@@ -43,3 +121,152 @@ class Customer(models.Model):
 
     def __str__(self):
         return f"{self.user.username} ({self.stripe_customer_id})"
+
+
+class StripeWebhookEvent(models.Model):
+    """ Raw Stripe webhook delivery, stored on receipt and handled later by the process_webhooks command """
+    PENDING = "pending"
+    PROCESSING = "processing"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (PROCESSING, "Processing"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    stripe_event_id = models.CharField(max_length=255, db_index=True)
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    # When a worker took the row; stale claims are retaken, see utils.claim_due_rows
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-received_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='webhook_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} ({self.stripe_event_id}) - {self.status}"
+
+
+class OutboundEmail(models.Model):
+    """ Rendered email waiting in the outbox; delivered by the send_outbox command """
+    PENDING = "pending"
+    PROCESSING = "sending"
+    DONE = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (PROCESSING, "Sending"),
+        (DONE, "Sent"),
+        (FAILED, "Failed"),
+    ]
+
+    to_email = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body_text = models.TextField()
+    body_html = models.TextField(blank=True, default='')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    # When a worker took the row; stale claims are retaken, see utils.claim_due_rows
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {self.to_email} ({self.status})"
+
+
+class ProcessedStripeEvent(models.Model):
+    """ Ledger of Stripe event ids that have already been handled, so retried deliveries are ignored """
+    stripe_event_id = models.CharField(max_length=255, unique=True)
+    processed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return self.stripe_event_id
+
+
+class PaymentIntentRecord(models.Model):
+    """ Local copy of a Stripe PaymentIntent created at checkout, reused while the buyer's quote is open """
+    OPEN = "open"
+    SUCCEEDED = "succeeded"
+    CANCELED = "canceled"
+    STATUS_CHOICES = [
+        (OPEN, "Open"),
+        (SUCCEEDED, "Succeeded"),
+        (CANCELED, "Canceled"),
+    ]
+
+    stripe_intent_id = models.CharField(max_length=255, unique=True)
+    client_secret = models.CharField(max_length=255)
+    # "user:<id>" for logged in buyers, "session:<key>" or "quote:<id>" for guests
+    owner_key = models.CharField(max_length=100)
+    event = models.ForeignKey(Event, null=True, blank=True, on_delete=models.SET_NULL, related_name="payment_intents")
+    product = models.ForeignKey(Product, null=True, blank=True, on_delete=models.SET_NULL, related_name="payment_intents")
+    quantity = models.PositiveIntegerField(default=1)
+    promo_code = models.CharField(max_length=50, blank=True, default='')
+    amount = models.PositiveIntegerField(help_text="Amount in cents")
+    email = models.EmailField(blank=True, default='')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=OPEN)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner_key', 'status'], name='intent_owner_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.stripe_intent_id} ({self.owner_key}, {self.status})"
+
+
+class TicketOrder(models.Model):
+    """ Seats taken for an event: held while the buyer pays, confirmed once they have """
+    HELD = "held"
+    CONFIRMED = "confirmed"
+    RELEASED = "released"
+    STATUS_CHOICES = [
+        (HELD, "Held"),
+        (CONFIRMED, "Confirmed"),
+        (RELEASED, "Released"),
+    ]
+    # Orders that count against the event's capacity
+    ACTIVE = (HELD, CONFIRMED)
+
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name="ticket_orders")
+    user = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name="ticket_orders")
+    email = models.EmailField(blank=True, default='')
+    quantity = models.PositiveIntegerField(default=1)
+    payment_intent = models.OneToOneField(PaymentIntentRecord, null=True, blank=True, on_delete=models.SET_NULL,
+                                          related_name="ticket_order")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=HELD)
+    # Held seats go back on sale after this, see `manage.py release_seat_holds`
+    expires_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='ticket_hold_idx'),
+            models.Index(fields=['event', 'status'], name='ticket_event_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.event_id} for {self.user_id or self.email} ({self.status})"
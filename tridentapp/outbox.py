@@ -0,0 +1,82 @@
+import logging
+import time
+import traceback
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.utils import timezone
+
+from .models import OutboundEmail
+from .utils import send_email, retry_delay, claim_due_rows
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_CODES = {"Throttling", "ThrottlingException", "TooManyRequestsException"}
+
+
+def is_throttle_error(exc):
+    if isinstance(exc, ClientError):
+        error = exc.response.get("Error", {})
+        return error.get("Code") in THROTTLE_CODES or "Maximum sending rate" in error.get("Message", "")
+    return False
+
+
+class TokenBucket:
+    """ Blocking token bucket: allows `rate` sends per second with bursts up to `capacity` """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1, rate))
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+
+    def acquire(self):
+        while True:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            self.sleep((1 - self.tokens) / self.rate)
+
+
+def deliver(email):
+    """ Send one outbox row, recording the delivery state """
+    max_attempts = getattr(settings, "EMAIL_OUTBOX_MAX_ATTEMPTS", 8)
+    email.attempts += 1
+
+    try:
+        send_email(email.to_email, email.subject, email.body_text, email.body_html)
+    except Exception as exc:
+        email.last_error = traceback.format_exc()
+        email.status = OutboundEmail.PENDING
+        if is_throttle_error(exc):
+            # Over the SES quota: back off briefly, throttles never exhaust the row
+            logger.warning("SES throttled email %s", email.pk)
+            email.next_attempt_at = timezone.now() + retry_delay(email.attempts, base=5, cap=300)
+        elif email.attempts >= max_attempts:
+            logger.exception("Email %s failed permanently", email.pk)
+            email.status = OutboundEmail.FAILED
+        else:
+            logger.exception("Email %s failed", email.pk)
+            email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
+        email.save(update_fields=['attempts', 'status', 'last_error', 'next_attempt_at'])
+        return False
+
+    email.status = OutboundEmail.DONE
+    email.last_error = ''
+    email.sent_at = timezone.now()
+    email.save(update_fields=['attempts', 'status', 'last_error', 'sent_at'])
+    return True
+
+
+def send_outbox(bucket, batch_size=50):
+    """ Send one batch of due outbox emails under the bucket's rate, returning the number handled """
+    batch = claim_due_rows(OutboundEmail, batch_size)
+    for email in batch:
+        bucket.acquire()
+        deliver(email)
+    return len(batch)
@@ -0,0 +1,158 @@
+import logging
+
+import stripe
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+
+from .inventory import release_intent_hold
+from .models import Customer, PaymentIntentRecord
+from .stripe_client import stripe_call, astripe_call
+
+logger = logging.getLogger(__name__)
+
+
+def checkout_owner_key(request, quote_id=None):
+    """ Who an open PaymentIntent belongs to: the user, or the guest's session or checkout quote.
+
+    Never creates a session, so guest checkout costs no session write.
+    """
+    if request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+    if request.session.session_key:
+        return f"session:{request.session.session_key}"
+    if quote_id:
+        return f"quote:{quote_id}"
+    request.session.save()
+    return f"session:{request.session.session_key}"
+
+
+# Stripe statuses in which an intent is still waiting for the buyer and can be modified
+COLLECTING = ("requires_payment_method", "requires_confirmation", "requires_action")
+
+
+class PaymentInProgress(Exception):
+    """ The buyer's open PaymentIntent is being or has been paid, so it must be neither served nor replaced """
+
+    def __init__(self, record):
+        super().__init__(record.stripe_intent_id)
+        self.record = record
+
+
+async def _still_collecting(record):
+    """ Whether the record's intent can still take a payment, closing the record if Stripe canceled it.
+
+    Raises PaymentInProgress once the buyer has paid or a payment is processing.
+    """
+    intent = await astripe_call("PaymentIntent.retrieve", record.stripe_intent_id)
+    if intent.status in COLLECTING:
+        return True
+    if intent.status == "canceled":
+        record.status = PaymentIntentRecord.CANCELED
+        await record.asave(update_fields=['status', 'updated_at'])
+        await sync_to_async(release_intent_hold)(record.stripe_intent_id)
+        return False
+    if intent.status == "succeeded":
+        record.status = PaymentIntentRecord.SUCCEEDED
+        await record.asave(update_fields=['status', 'updated_at'])
+    raise PaymentInProgress(record)
+
+
+async def aget_payment_intent(owner_key, *, amount, metadata, event=None, product=None,
+                              quantity=1, promo_code="", email="", customer=None, hold=None):
+    """ Return an open PaymentIntentRecord for this buyer and item, talking to Stripe only when needed.
+
+    An open record is first checked with Stripe, since it stays open until
+    the webhook worker sees the payment: a paid or processing intent raises
+    PaymentInProgress, and a new intent is only created once the old one is
+    canceled. A reload with the same quote then reuses the intent, and a
+    changed quantity or promo code modifies it. `hold`, an async callable
+    taking the record, reserves its seats (raising SoldOut) before Stripe is
+    asked to charge for them. Stripe calls are awaited, so the ASGI worker
+    serves other requests meanwhile.
+    """
+    record = await (
+        PaymentIntentRecord.objects.filter(
+            owner_key=owner_key, event=event, product=product, status=PaymentIntentRecord.OPEN
+        )
+        .order_by('-created_at')
+        .afirst()
+    )
+
+    if record and await _still_collecting(record):
+        if record.amount == amount and record.quantity == quantity \
+                and record.promo_code == promo_code and record.email == email:
+            if hold:
+                await hold(record)
+            return record
+
+        previous = (record.amount, record.quantity, record.promo_code, record.email)
+        record.amount, record.quantity, record.promo_code, record.email = amount, quantity, promo_code, email
+        if hold:
+            # The buyer's page can still confirm this intent, so never let it ask for unreserved seats
+            await hold(record)
+        try:
+            await astripe_call("PaymentIntent.modify", record.stripe_intent_id, amount=amount, metadata=metadata)
+        except stripe.error.InvalidRequestError:
+            logger.info("PaymentIntent %s can no longer be modified", record.stripe_intent_id)
+            record.amount, record.quantity, record.promo_code, record.email = previous
+            if hold:
+                await hold(record)
+            if await _still_collecting(record):
+                raise
+        else:
+            await record.asave(update_fields=['amount', 'quantity', 'promo_code', 'email', 'updated_at'])
+            return record
+
+    intent = await astripe_call(
+        "PaymentIntent.create",
+        amount=amount,
+        currency="usd",
+        customer=customer,
+        automatic_payment_methods={"enabled": True},
+        metadata=metadata,
+    )
+    record = await PaymentIntentRecord.objects.acreate(
+        stripe_intent_id=intent.id,
+        client_secret=intent.client_secret,
+        owner_key=owner_key,
+        event=event,
+        product=product,
+        quantity=quantity,
+        promo_code=promo_code,
+        amount=amount,
+        email=email,
+    )
+    if hold:
+        await hold(record)
+    return record
+
+
+def mark_intent_status(stripe_intent_id, status):
+    PaymentIntentRecord.objects.filter(stripe_intent_id=stripe_intent_id).update(
+        status=status, updated_at=timezone.now()
+    )
+
+
+def customer_id_query(user):
+    return Customer.objects.filter(user=user).values_list('stripe_customer_id', flat=True)
+
+
+async def acached_stripe_customer_id(user):
+    """ The user's Stripe customer id if it has been provisioned, without calling Stripe """
+    return await customer_id_query(user).afirst()
+
+
+def create_stripe_customer(user):
+    """ Create the Stripe customer for a user and return its id.
+
+    The idempotency key makes a retried or concurrent call return the same
+    customer instead of creating a duplicate.
+    """
+    stripe_customer = stripe_call(
+        "Customer.create",
+        email=user.email,
+        name=user.get_full_name() or user.username,
+        metadata={"user_id": user.pk},
+        idempotency_key=f"trident-customer-{user.pk}",
+    )
+    return stripe_customer.id
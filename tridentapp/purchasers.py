@@ -0,0 +1,74 @@
+""" Bulk purchaser lookups and adds behind the admin's "Add purchasers" action """
+from django.contrib.auth.models import User
+from django.db import router, transaction
+from django.db.models.functions import Lower
+from django.db.models.signals import m2m_changed
+
+from .inventory import SoldOut, reserve_seats
+from .models import Event, TicketOrder
+
+
+def users_by_email(emails, batch_size=500):
+    """ Map lower-cased email -> user id for the given addresses, in batched IN queries """
+    emails = sorted({email.lower() for email in emails})
+    found = {}
+    for start in range(0, len(emails), batch_size):
+        batch = emails[start:start + batch_size]
+        rows = (
+            User.objects.annotate(email_lower=Lower("email"))
+            .filter(email_lower__in=batch)
+            .order_by("pk")
+            .values_list("email_lower", "pk")
+        )
+        for email, user_id in rows:
+            # Several accounts can share an address; the oldest one wins
+            found.setdefault(email, user_id)
+    return found
+
+
+def _batches(ids, batch_size):
+    ids = sorted(ids)
+    for start in range(0, len(ids), batch_size):
+        yield ids[start:start + batch_size]
+
+
+def add_purchasers(instance, user_ids, batch_size=500):
+    """ Bulk version of purchasers.add() for an Event or Product, returning how many users were added.
+
+    Existing pairs are skipped. For an Event each new purchaser takes a seat
+    and gets a CONFIRMED TicketOrder, as in register_for_event; if they do
+    not all fit, SoldOut is raised and nobody is added. The usual
+    m2m_changed notification is sent so caches are invalidated.
+    """
+    field = instance.purchasers
+    through = field.through
+    source = field.source_field_name + "_id"
+    with transaction.atomic():
+        user_ids = set(user_ids)
+        for batch in _batches(user_ids, batch_size):
+            user_ids -= set(
+                through.objects.filter(**{source: instance.pk, "user_id__in": batch}).values_list("user_id", flat=True)
+            )
+        if not user_ids:
+            return 0
+
+        if isinstance(instance, Event):
+            if not reserve_seats(instance.pk, len(user_ids)):
+                raise SoldOut
+            emails = {}
+            for batch in _batches(user_ids, batch_size):
+                emails.update(User.objects.filter(pk__in=batch).values_list("pk", "email"))
+            TicketOrder.objects.bulk_create(
+                [TicketOrder(event_id=instance.pk, user_id=user_id, email=emails.get(user_id, ""),
+                             status=TicketOrder.CONFIRMED) for user_id in user_ids],
+                batch_size=batch_size,
+            )
+        through.objects.bulk_create(
+            [through(**{source: instance.pk, "user_id": user_id}) for user_id in user_ids], batch_size=batch_size,
+        )
+
+    m2m_changed.send(
+        sender=through, instance=instance, action="post_add", reverse=False,
+        model=User, pk_set=user_ids, using=router.db_for_write(through),
+    )
+    return len(user_ids)
@@ -0,0 +1,48 @@
+""" Event querysets behind the public pages, shared with QueryPlanTests so the plans checked are the ones served """
+from .models import Event, Product
+
+
+def upcoming_events(now):
+    """ Home page: future events without the heavy HTML columns """
+    return Event.objects.filter(date__gt=now).defer('description', 'content', 'content_html').order_by('date')
+
+
+def listed_events(now):
+    """ Events page: today's and future events without any HTML """
+    return (
+        Event.objects.filter(date__gte=now)
+        .defer('description', 'content', 'description_html', 'content_html')
+        .order_by('date')
+    )
+
+
+def purchased_events(event_ids):
+    return Event.objects.filter(pk__in=event_ids).only('title', 'date', 'price').order_by('date')
+
+
+def purchased_products(product_ids):
+    return Product.objects.filter(pk__in=product_ids).only('product_name', 'price')
+
+
+def _livestream_events():
+    return Event.objects.only('id', 'title', 'date', 'livestream_url')
+
+
+def current_livestream(start_of_today, now):
+    """ Today's event that has already started; a bounded range on Event.date """
+    return _livestream_events().filter(date__gte=start_of_today, date__lte=now).order_by('-date')
+
+
+def next_livestream(now):
+    return _livestream_events().filter(date__gt=now).order_by('date')
+
+
+def past_livestreams(now, exclude_pk=None):
+    events = (
+        _livestream_events().filter(date__lte=now, livestream_url__isnull=False)
+        .exclude(livestream_url='')
+        .order_by('-date')
+    )
+    if exclude_pk is not None:
+        events = events.exclude(pk=exclude_pk)
+    return events
@@ -0,0 +1,77 @@
+""" Signed, short-lived checkout quotes passed from purchase_event to pay_event """
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import signing
+
+QUOTE_SALT = "tridentapp.quote"
+QUOTE_COOKIE = "checkout_quote"
+
+
+def parse_quantity(value):
+    """ Ticket quantity from a form value; anything missing, non-numeric or below 1 means one ticket """
+    try:
+        return max(int(value), 1)
+    except (TypeError, ValueError):
+        return 1
+
+
+def quote_price(event, quantity, promo_code):
+    """ Return (discounted_price, promo_message) for buying `quantity` tickets with `promo_code` """
+    promo_message = ""
+    discount = Decimal('0')
+    if promo_code:
+        if event.promo_code and promo_code == event.promo_code.upper():
+            discount = event.promo_discount
+            promo_message = f"{event.promo_discount}% discount applied"
+        else:
+            promo_message = "Invalid code"
+
+    base_price = event.price * quantity
+    discounted_price = base_price * (Decimal('1') - discount / Decimal('100'))
+    return discounted_price, promo_message
+
+
+def make_quote(event, quantity, promo_code, email, quote_id=None):
+    """ Price the order and return it as a signed token for the pay_event URL.
+
+    `quote_id` identifies a guest's checkout across changed quotes so their
+    open PaymentIntent can be reused; a new one is generated if not given.
+    """
+    discounted_price, _ = quote_price(event, quantity, promo_code)
+    quote = {
+        "id": quote_id or uuid.uuid4().hex,
+        "event": event.pk,
+        "quantity": quantity,
+        "promo_code": promo_code,
+        "email": email,
+        "amount": int(discounted_price * 100),
+        "display": f"${discounted_price:.2f}",
+    }
+    return signing.dumps(quote, salt=QUOTE_SALT, compress=True)
+
+
+def load_quote(token, event_id):
+    """ The quote in `token` if it is genuine, unexpired and for this event, otherwise None """
+    try:
+        quote = signing.loads(token, salt=QUOTE_SALT, max_age=getattr(settings, "QUOTE_MAX_AGE", 1800))
+    except signing.BadSignature:
+        return None
+    if quote.get("event") != event_id:
+        return None
+    return quote
+
+
+def checkout_quote_id(request):
+    """ The quote id remembered in the browser's signed checkout cookie, or a new one """
+    quote_id = request.get_signed_cookie(QUOTE_COOKIE, default=None, salt=QUOTE_SALT,
+                                         max_age=getattr(settings, "QUOTE_MAX_AGE", 1800))
+    return quote_id or uuid.uuid4().hex
+
+
+def remember_quote(response, quote_id):
+    """ Keep the quote id in a signed cookie so the next quote reuses it (no session write) """
+    response.set_signed_cookie(QUOTE_COOKIE, quote_id, salt=QUOTE_SALT,
+                               max_age=getattr(settings, "QUOTE_MAX_AGE", 1800), httponly=True, samesite="Lax")
+    return response
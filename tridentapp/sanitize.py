@@ -0,0 +1,152 @@
+""" Save-time cleanup of CKEditor HTML for Event descriptions and content """
+import re
+from html import escape
+from html.parser import HTMLParser
+
+ALLOWED_TAGS = {
+    "a", "b", "blockquote", "br", "div", "em", "figcaption", "figure", "h1", "h2", "h3", "h4",
+    "h5", "h6", "hr", "i", "img", "li", "oembed", "ol", "p", "s", "span", "strong", "table",
+    "tbody", "td", "th", "thead", "tr", "u", "ul",
+}
+VOID_TAGS = {"br", "hr", "img"}
+ALLOWED_ATTRIBUTES = {
+    "*": {"class"},
+    "a": {"href", "title", "target", "rel"},
+    "img": {"src", "alt", "width", "height", "srcset", "sizes"},
+    "oembed": {"url"},
+    "td": {"colspan", "rowspan"},
+    "th": {"colspan", "rowspan"},
+}
+URL_ATTRIBUTES = {"href", "src", "url"}
+SAFE_URL = re.compile(r"^(https?:|mailto:|/|#|[^:]*$)", re.IGNORECASE)
+# Elements whose text is dropped along with the tags
+DROP_CONTENT_TAGS = {"script", "style", "iframe", "object", "embed", "noscript", "template"}
+BLOCK_TAGS = {"p", "br", "div", "li", "blockquote", "h1", "h2", "h3", "h4", "h5", "h6", "tr", "figcaption"}
+
+
+class _Sanitizer(HTMLParser):
+
+    def __init__(self, max_length):
+        super().__init__(convert_charrefs=True)
+        self.max_length = max_length
+        self.out = []
+        self.length = 0
+        self.open_tags = []
+        self.text = []
+        self.dropping = 0
+        self.truncated = False
+
+    def emit(self, chunk):
+        self.out.append(chunk)
+        self.length += len(chunk)
+
+    def room(self):
+        # Leave space to close whatever is still open
+        closing = sum(len(tag) + 3 for tag in self.open_tags)
+        return self.max_length - self.length - closing if self.max_length else None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping:
+            return
+        if tag in BLOCK_TAGS:
+            self.text.append(" ")
+        if tag not in ALLOWED_TAGS or self.truncated:
+            return
+
+        allowed = ALLOWED_ATTRIBUTES.get(tag, set()) | ALLOWED_ATTRIBUTES["*"]
+        clean = []
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            if name in URL_ATTRIBUTES and not SAFE_URL.match(value.strip()):
+                continue
+            clean.append((name, value))
+        if tag == "img":
+            clean += [("loading", "lazy"), ("decoding", "async")]
+        if tag == "a" and ("target", "_blank") in clean:
+            clean = [(name, value) for name, value in clean if name != "rel"] + [("rel", "noopener")]
+
+        chunk = "<" + tag + "".join(f' {name}="{escape(value)}"' for name, value in clean) + ">"
+        room = self.room()
+        closing = 0 if tag in VOID_TAGS else len(tag) + 3
+        if room is not None and len(chunk) + closing > room:
+            self.truncated = True
+            return
+        self.emit(chunk)
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and tag not in DROP_CONTENT_TAGS:
+            self.handle_endtag(tag)
+        elif tag in DROP_CONTENT_TAGS:
+            self.dropping -= 1
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping = max(0, self.dropping - 1)
+            return
+        if self.dropping or tag not in self.open_tags:
+            return
+        # Close anything left open inside this element as well
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.emit(f"</{open_tag}>")
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self.dropping:
+            return
+        self.text.append(data)
+        if self.truncated:
+            return
+        chunk = escape(data, quote=False)
+        room = self.room()
+        if room is not None and len(chunk) > room:
+            self.truncated = True
+            if room < 1:
+                return
+            keep = room - 1
+            while len(escape(data[:keep], quote=False)) > room - 1:
+                keep -= 1
+            chunk = escape(data[:keep], quote=False) + "…"
+        self.emit(chunk)
+
+    def close(self):
+        super().close()
+        while self.open_tags:
+            self.emit(f"</{self.open_tags.pop()}>")
+
+
+def sanitize_html(html, max_length=None):
+    """ Return `html` reduced to an allowlist of tags and attributes.
+
+    Images get loading="lazy", and if `max_length` is given the output is cut
+    to at most that many characters with every open tag closed.
+    """
+    if not html:
+        return ""
+    parser = _Sanitizer(max_length)
+    parser.feed(html)
+    parser.close()
+    return "".join(parser.out)
+
+
+def html_excerpt(html, length=255):
+    """ Plain-text summary of `html` of at most `length` characters, cut on a word boundary """
+    if not html:
+        return ""
+    parser = _Sanitizer(None)
+    parser.feed(html)
+    parser.close()
+    text = " ".join("".join(parser.text).split())
+    if len(text) <= length:
+        return text
+    cut = text[:length].rsplit(" ", 1)[0].rstrip(",.;:")
+    # Leave room for the ellipsis when there was no word boundary to cut on
+    return cut[:length - 1] + "…"
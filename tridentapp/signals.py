@@ -0,0 +1,62 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .cache import page_cache_key, invalidate_event_pages
+from .entitlements import invalidate_entitlements
+from .instrumentation import time_queries
+from .models import Event, Product
+from .thumbnails import schedule_thumbnails
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    # Per-request query counts and time for Server-Timing and /metrics
+    if time_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_queries)
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def event_changed(sender, instance, **kwargs):
+    invalidate_event_pages(instance.pk)
+
+
+@receiver(post_save, sender=Event)
+def event_image_saved(sender, instance, **kwargs):
+    if 'image' not in instance.get_deferred_fields() and instance.image:
+        # Resize once the upload is committed; existing renditions are skipped
+        name = instance.image.name
+        transaction.on_commit(lambda: schedule_thumbnails(name))
+
+
+@receiver(m2m_changed, sender=Event.purchasers.through)
+def event_purchasers_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+
+    if not reverse:
+        event_ids = [instance.pk]
+    elif pk_set is not None:
+        # user.purchased_events.add(...) - pk_set holds the event ids
+        event_ids = pk_set
+    else:
+        # user.purchased_events.clear() does not report which events were affected
+        event_ids = Event.objects.values_list('pk', flat=True)
+
+    cache.delete_many([page_cache_key("event_info", event_id) for event_id in event_ids])
+
+
+@receiver(m2m_changed, sender=Event.purchasers.through)
+@receiver(m2m_changed, sender=Product.purchasers.through)
+def purchasers_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # user.purchased_events / user.purchased_products changed
+        if action.startswith("post_"):
+            invalidate_entitlements([instance.pk])
+    elif action == "pre_clear":
+        invalidate_entitlements(instance.purchasers.values_list('pk', flat=True))
+    elif action.startswith("post_") and pk_set:
+        invalidate_entitlements(pk_set)
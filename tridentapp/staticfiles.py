@@ -0,0 +1,106 @@
+""" collectstatic storage that adds responsive image renditions and precompressed text assets """
+import gzip
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+
+from .images import supported_formats, open_image, variant_widths, resize_to_width, encode
+
+
+class OptimizedStaticFilesStorage(ManifestStaticFilesStorage):
+    """ ManifestStaticFilesStorage that also writes WebP/AVIF variants and .gz copies.
+
+    Every collected PNG or JPEG gets a rendition per format at each of
+    STATIC_IMAGE_WIDTHS narrower than the original, plus one at full width.
+    Variant names extend the original's hashed name, so unchanged images are
+    not re-encoded on the next deploy. The variants are listed in
+    image-variants.json for the {% responsive_image %} tag. Text assets get a
+    gzip sibling for servers that serve precompressed files.
+    """
+    variants_manifest_name = "image-variants.json"
+    image_extensions = (".png", ".jpg", ".jpeg")
+    compress_extensions = (".css", ".js", ".svg", ".txt", ".json", ".xml", ".map")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._variants = None
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+
+        images = [name for name in paths if name.lower().endswith(self.image_extensions)]
+        variants = {}
+        # Pillow releases the GIL while encoding, so images are processed side by side
+        with ThreadPoolExecutor() as pool:
+            for name, entry in zip(images, pool.map(lambda name: self.write_variants(name, paths[name]), images)):
+                if entry:
+                    variants[name] = entry
+                    yield name, self.stored_name(name), True
+        self.save_variants(variants)
+
+        for name in paths:
+            if name.lower().endswith(self.compress_extensions):
+                self.write_gzip(self.stored_name(name))
+
+    def write_variants(self, name, source):
+        """ Write the renditions of one image, returning its manifest entry """
+        storage, path = source
+        with storage.open(path) as handle:
+            image = open_image(handle)
+
+        widths = getattr(settings, "STATIC_IMAGE_WIDTHS", [480, 960, 1440])
+        if image.width < min(widths):
+            # Icons and other small images are already cheap
+            return None
+
+        quality = getattr(settings, "STATIC_IMAGE_QUALITY", 70)
+        root = os.path.splitext(self.stored_name(name))[0]
+        entry = {"width": image.width, "height": image.height, "sources": {}}
+        for fmt in supported_formats(getattr(settings, "STATIC_IMAGE_FORMATS", ["avif", "webp"])):
+            entry["sources"][fmt] = []
+            for width in variant_widths(image.width, widths):
+                variant_name = f"{root}.{width}w.{fmt}"
+                if not self.exists(variant_name):
+                    self._save(variant_name, ContentFile(encode(resize_to_width(image, width), fmt, quality)))
+                entry["sources"][fmt].append([width, variant_name])
+        return entry
+
+    def write_gzip(self, name):
+        with self.open(name) as handle:
+            content = handle.read()
+        compressed = gzip.compress(content, compresslevel=9, mtime=0)
+        if len(compressed) < len(content):
+            if self.exists(name + ".gz"):
+                self.delete(name + ".gz")
+            self._save(name + ".gz", ContentFile(compressed))
+
+    def save_variants(self, variants):
+        if self.exists(self.variants_manifest_name):
+            self.delete(self.variants_manifest_name)
+        content = json.dumps(variants, sort_keys=True).encode()
+        self._save(self.variants_manifest_name, ContentFile(content))
+        self._variants = variants
+
+    def load_variants(self):
+        try:
+            with self.open(self.variants_manifest_name) as handle:
+                return json.loads(handle.read())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def image_variants(self, name):
+        """ Manifest entry for a collected image, or None if it has no renditions """
+        if self._variants is None:
+            self._variants = self.load_variants()
+        return self._variants.get(name)
+
+    def variant_url(self, name):
+        # Variant names are already hashed and are not in the staticfiles manifest
+        return FileSystemStorage.url(self, name)
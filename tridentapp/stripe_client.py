@@ -0,0 +1,76 @@
+""" Process-wide Stripe configuration and the single entry point for Stripe API calls """
+import time
+import uuid
+
+import requests
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .instrumentation import record
+from .metrics import Histogram
+
+STRIPE_LATENCY = Histogram(
+    "stripe_request_duration_seconds",
+    "Time spent waiting on Stripe API calls",
+    labelnames=("method", "outcome"),
+)
+
+
+def configure_stripe():
+    """ Point the Stripe SDK at a shared, sized connection pool with explicit timeouts.
+
+    Called once from TridentappConfig.ready().
+    """
+    pool_size = getattr(settings, "STRIPE_HTTP_POOL_SIZE", 10)
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    stripe.max_network_retries = getattr(settings, "STRIPE_MAX_NETWORK_RETRIES", 2)
+    stripe.default_http_client = stripe.RequestsClient(
+        timeout=(
+            getattr(settings, "STRIPE_CONNECT_TIMEOUT", 5),
+            getattr(settings, "STRIPE_READ_TIMEOUT", 20),
+        ),
+        session=session,
+    )
+
+
+def stripe_call(method, *args, **kwargs):
+    """ Call a Stripe API method by name, e.g. stripe_call("PaymentIntent.create", amount=...).
+
+    Creates get a fresh idempotency key, so the SDK's network retries can
+    never create a second object, and every call is recorded in the
+    stripe_request_duration_seconds histogram.
+    """
+    *path, action = method.split(".")
+    func = stripe
+    for name in path + [action]:
+        func = getattr(func, name)
+    if action == "create":
+        kwargs.setdefault("idempotency_key", f"trident-{uuid.uuid4()}")
+
+    outcome = "error"
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+        outcome = "ok"
+        return result
+    finally:
+        elapsed = time.perf_counter() - start
+        STRIPE_LATENCY.observe(elapsed, method=method, outcome=outcome)
+        record("stripe", elapsed)
+
+
+async def astripe_call(method, *args, **kwargs):
+    """ Async stripe_call for views running under ASGI.
+
+    The blocking SDK call runs in a worker thread outside the request's
+    thread-sensitive executor, so slow Stripe responses never hold up other
+    requests' database work.
+    """
+    return await sync_to_async(stripe_call, thread_sensitive=False)(method, *args, **kwargs)
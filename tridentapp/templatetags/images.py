@@ -0,0 +1,70 @@
+from django import template
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+
+from ..images import MIME_TYPES
+from .. import thumbnails
+
+register = template.Library()
+
+
+def _variants(name):
+    lookup = getattr(staticfiles_storage, "image_variants", None)
+    return lookup(name) if lookup else None
+
+
+def _srcset(sources):
+    return ", ".join(f"{staticfiles_storage.variant_url(variant)} {width}w" for width, variant in sources)
+
+
+@register.simple_tag
+def responsive_image(name, alt="", sizes="100vw", **attrs):
+    """ <picture> for a static image with AVIF/WebP srcsets from collectstatic, lazy loaded.
+
+    Falls back to a plain lazy <img> when the image has no renditions
+    (runserver, or files too small to be worth resizing). Extra keyword
+    arguments become <img> attributes; pass loading="eager" for images
+    above the fold.
+    """
+    entry = _variants(name)
+    img_attrs = {"src": static(name), "alt": alt, "loading": "lazy", "decoding": "async"}
+    if entry:
+        img_attrs.update(width=entry["width"], height=entry["height"])
+    img_attrs.update((key.replace("_", "-"), value) for key, value in attrs.items())
+    img = format_html("<img{}>", format_html_join("", ' {}="{}"', img_attrs.items()))
+    if not entry:
+        return img
+
+    sources = format_html_join(
+        "",
+        '<source type="{}" srcset="{}" sizes="{}">',
+        ((MIME_TYPES[fmt], _srcset(entry["sources"][fmt]), sizes) for fmt in MIME_TYPES if fmt in entry["sources"]),
+    )
+    return format_html("<picture>{}{}</picture>", sources, img)
+
+
+@register.simple_tag
+def image_set(name):
+    """ CSS image-set() for a static background image, preferring the widest AVIF/WebP rendition """
+    entry = _variants(name)
+    if not entry:
+        return format_html("url('{}')", static(name))
+
+    options = [
+        (staticfiles_storage.variant_url(entry["sources"][fmt][-1][1]), MIME_TYPES[fmt])
+        for fmt in MIME_TYPES if fmt in entry["sources"]
+    ]
+    options.append((static(name), "image/" + name.rsplit(".", 1)[-1].lower().replace("jpg", "jpeg")))
+    return format_html("image-set({})", format_html_join(", ", "url('{}') type('{}')", options))
+
+
+@register.filter
+def thumbnail(image, width):
+    """ URL of an uploaded image's `width` rendition: {{ event.image|thumbnail:480 }} """
+    return thumbnails.thumbnail_url(image, int(width))
+
+
+@register.filter
+def thumbnail_srcset(image):
+    return thumbnails.thumbnail_srcset(image)
@@ -1,3 +1,1361 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import stripe
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.template import Template, Context
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .models import (Event, Product, Customer, StripeWebhookEvent, OutboundEmail, ProcessedStripeEvent,
+                     PaymentIntentRecord, TicketOrder)
+from .outbox import TokenBucket, send_outbox
+from .payments import customer_id_query
+from . import queries
+from .entitlements import (get_entitlements, is_registered, registered_event_ids, register_for_event, entitlements_query,
+                           registration_query, registered_ids_query)
+from .inventory import SoldOut, confirm_order, release_expired_holds, reserve_seats
+from .instrumentation import REQUEST_LATENCY
+from .metrics import render_metrics
+from .quotes import make_quote, load_quote
+from .sanitize import sanitize_html, html_excerpt
+from .staticfiles import OptimizedStaticFilesStorage
+from . import thumbnails
+from .benchmark import seed_data, run_benchmarks, compare
+from .loadtest import FakeStripe, FakeSES
+from .mail import reset_ses_client
+from .stripe_client import STRIPE_LATENCY, stripe_call, astripe_call
+from .views import not_found_body, route_list
+from .utils import due_rows
+from .webhooks import handle_event, process_inbox, recent_event_ids
+
+WEBHOOK_SECRET = "whsec_test"
+
+
+def signed_webhook_headers(payload, secret=WEBHOOK_SECRET):
+    """ Build a Stripe-Signature header the way Stripe does """
+    timestamp = int(time.time())
+    signature = hmac.new(
+        secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256
+    ).hexdigest()
+    return {"HTTP_STRIPE_SIGNATURE": f"t={timestamp},v1={signature}"}
+
+
+def payment_succeeded_payload(event, user, event_id="evt_1"):
+    return json.dumps({
+        "id": event_id,
+        "object": "event",
+        "type": "payment_intent.succeeded",
+        "data": {"object": {
+            "id": "pi_1",
+            "object": "payment_intent",
+            "metadata": {"event": str(event.id), "user_id": str(user.id), "quantity": "2"},
+        }},
+    })
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET)
+class StripeWebhookTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("buyer", "buyer@example.com", "pw")
+        self.event = Event.objects.create(title="Meetup", date=timezone.now() + timedelta(days=3), price=10)
+        recent_event_ids.clear()
+
+    def post_webhook(self, payload):
+        return self.client.post(reverse("stripe_webhook"), payload,
+                                content_type="application/json", **signed_webhook_headers(payload))
+
+    def test_rejects_bad_signature(self):
+        payload = payment_succeeded_payload(self.event, self.user)
+        response = self.client.post(reverse("stripe_webhook"), payload, content_type="application/json",
+                                    HTTP_STRIPE_SIGNATURE="t=1,v1=bad")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StripeWebhookEvent.objects.exists())
+
+    @mock.patch("tridentapp.webhooks.send_admin_email")
+    @mock.patch("tridentapp.webhooks.send_purchase_email")
+    def test_webhook_is_stored_then_processed(self, send_purchase, send_admin):
+        response = self.post_webhook(payment_succeeded_payload(self.event, self.user))
+        self.assertEqual(response.status_code, 200)
+
+        inbox_event = StripeWebhookEvent.objects.get()
+        self.assertEqual(inbox_event.status, StripeWebhookEvent.PENDING)
+        self.assertFalse(self.event.purchasers.exists())
+        send_purchase.assert_not_called()
+
+        self.assertEqual(process_inbox(), 1)
+        inbox_event.refresh_from_db()
+        self.assertEqual(inbox_event.status, StripeWebhookEvent.DONE)
+        self.assertIn(self.user, self.event.purchasers.all())
+        send_purchase.assert_called_once()
+        send_admin.assert_called_once()
+
+    @mock.patch("tridentapp.webhooks.send_admin_email")
+    @mock.patch("tridentapp.webhooks.send_purchase_email", side_effect=RuntimeError("SES down"))
+    def test_failed_processing_is_retried_later(self, send_purchase, send_admin):
+        self.post_webhook(payment_succeeded_payload(self.event, self.user))
+
+        self.assertEqual(process_inbox(), 1)
+        inbox_event = StripeWebhookEvent.objects.get()
+        self.assertEqual(inbox_event.status, StripeWebhookEvent.PENDING)
+        self.assertEqual(inbox_event.attempts, 1)
+        self.assertIn("SES down", inbox_event.last_error)
+        self.assertGreater(inbox_event.next_attempt_at, timezone.now())
+        # The purchaser insert is rolled back with the failed attempt
+        self.assertFalse(self.event.purchasers.exists())
+
+        # Not due yet, so nothing is picked up
+        self.assertEqual(process_inbox(), 0)
+
+    def test_repeat_delivery_short_circuits_in_process(self):
+        payload = payment_succeeded_payload(self.event, self.user)
+        self.post_webhook(payload)
+        with self.assertNumQueries(0):
+            response = self.post_webhook(payload)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(StripeWebhookEvent.objects.count(), 1)
+
+    def test_repeat_delivery_after_restart_is_handled_once(self):
+        payload = payment_succeeded_payload(self.event, self.user)
+        self.post_webhook(payload)
+        recent_event_ids.clear()
+        self.post_webhook(payload)
+        self.assertEqual(StripeWebhookEvent.objects.count(), 2)
+
+        self.assertEqual(process_inbox(), 2)
+        self.assertEqual(ProcessedStripeEvent.objects.count(), 1)
+        self.assertEqual(OutboundEmail.objects.filter(to_email=self.user.email).count(), 1)
+        self.assertFalse(StripeWebhookEvent.objects.exclude(status=StripeWebhookEvent.DONE).exists())
+
+    def test_prune_removes_old_ledger_rows(self):
+        ProcessedStripeEvent.objects.create(stripe_event_id="evt_old")
+        ProcessedStripeEvent.objects.update(processed_at=timezone.now() - timedelta(days=90))
+        ProcessedStripeEvent.objects.create(stripe_event_id="evt_new")
+        call_command("prune_stripe_events", stdout=StringIO())
+        self.assertEqual(list(ProcessedStripeEvent.objects.values_list("stripe_event_id", flat=True)), ["evt_new"])
+
+
+class SESEmailBackendTests(TestCase):
+    @mock.patch("tridentapp.mail.boto3")
+    def test_client_is_shared_and_html_is_kept(self, boto3):
+        from django.core.mail import EmailMultiAlternatives
+        from . import mail
+
+        client = boto3.session.Session.return_value.client.return_value
+        backend = mail.SESEmailBackend()
+        messages = []
+        for address in ["a@example.com", "b@example.com"]:
+            message = EmailMultiAlternatives("Hi", "plain body", "support@mocapschool.com", [address])
+            message.attach_alternative("<p>html body</p>", "text/html")
+            messages.append(message)
+
+        with mock.patch.object(mail, "_ses_client", None):
+            self.assertEqual(backend.send_messages(messages), 2)
+            self.assertEqual(backend.send_messages(messages[:1]), 1)
+
+        boto3.session.Session.return_value.client.assert_called_once()
+        self.assertEqual(client.send_raw_email.call_count, 3)
+        raw = client.send_raw_email.call_args.kwargs["RawMessage"]["Data"]
+        self.assertIn(b"text/html", raw)
+        self.assertIn(b"plain body", raw)
+
+
+@override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+class OutboxTests(TestCase):
+    def test_register_queues_activation_email(self):
+        response = self.client.post(reverse("register"), {
+            "username": "newuser", "email": "new@example.com",
+            "password1": "a-long-password-1", "password2": "a-long-password-1",
+        })
+        self.assertEqual(response.status_code, 200)
+        email = OutboundEmail.objects.get()
+        self.assertEqual(email.to_email, "new@example.com")
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_password_reset_queues_text_and_html(self):
+        User.objects.create_user("resetme", "reset@example.com", "pw")
+        self.client.post(reverse("password_reset"), {"email": "reset@example.com"})
+        email = OutboundEmail.objects.get()
+        self.assertTrue(email.body_text)
+        self.assertTrue(email.body_html)
+
+    def test_send_outbox_delivers_and_records_state(self):
+        OutboundEmail.objects.create(to_email="a@example.com", subject="Hi", body_text="x", body_html="<p>x</p>")
+        self.assertEqual(send_outbox(TokenBucket(100)), 1)
+        email = OutboundEmail.objects.get()
+        self.assertEqual(email.status, OutboundEmail.DONE)
+        self.assertIsNotNone(email.sent_at)
+        self.assertEqual(mail.outbox[0].alternatives[0][0], "<p>x</p>")
+
+    def test_throttled_send_is_retried_not_failed(self):
+        throttle = ClientError({"Error": {"Code": "Throttling", "Message": "Maximum sending rate exceeded."}},
+                               "SendRawEmail")
+        OutboundEmail.objects.create(to_email="a@example.com", subject="Hi", body_text="x")
+        with mock.patch("tridentapp.outbox.send_email", side_effect=throttle):
+            for _ in range(3):
+                OutboundEmail.objects.update(next_attempt_at=timezone.now())
+                send_outbox(TokenBucket(100))
+        email = OutboundEmail.objects.get()
+        self.assertEqual(email.status, OutboundEmail.PENDING)
+        self.assertEqual(email.attempts, 3)
+
+    def test_other_errors_fail_after_max_attempts(self):
+        OutboundEmail.objects.create(to_email="a@example.com", subject="Hi", body_text="x")
+        with mock.patch("tridentapp.outbox.send_email", side_effect=RuntimeError("boom")):
+            for _ in range(2):
+                OutboundEmail.objects.update(next_attempt_at=timezone.now())
+                send_outbox(TokenBucket(100))
+        self.assertEqual(OutboundEmail.objects.get().status, OutboundEmail.FAILED)
+
+    def test_rows_left_by_a_dead_worker_are_reclaimed(self):
+        now = timezone.now()
+        abandoned = OutboundEmail.objects.create(to_email="a@example.com", subject="Hi", body_text="x",
+                                                 status=OutboundEmail.PROCESSING,
+                                                 claimed_at=now - timedelta(seconds=601))
+        in_flight = OutboundEmail.objects.create(to_email="b@example.com", subject="Hi", body_text="x",
+                                                 status=OutboundEmail.PROCESSING, claimed_at=now)
+        inbox = StripeWebhookEvent.objects.create(stripe_event_id="evt_stale", event_type="customer.created",
+                                                  payload={"type": "customer.created"},
+                                                  status=StripeWebhookEvent.PROCESSING,
+                                                  claimed_at=now - timedelta(hours=1))
+
+        self.assertEqual(send_outbox(TokenBucket(100)), 1)
+        self.assertEqual(process_inbox(), 1)
+
+        abandoned.refresh_from_db()
+        in_flight.refresh_from_db()
+        inbox.refresh_from_db()
+        self.assertEqual(abandoned.status, OutboundEmail.DONE)
+        self.assertEqual(in_flight.status, OutboundEmail.PROCESSING)
+        self.assertEqual(inbox.status, StripeWebhookEvent.DONE)
+
+    def test_token_bucket_limits_rate(self):
+        clock = [0.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            clock[0] += seconds
+
+        bucket = TokenBucket(2, capacity=2, clock=lambda: clock[0], sleep=sleep)
+        for _ in range(6):
+            bucket.acquire()
+        # Two sends from the initial burst, then one every half second
+        self.assertAlmostEqual(clock[0], 2.0)
+
+
+class LivestreamTests(TestCase):
+    def create_events(self, count, **kwargs):
+        Event.objects.bulk_create(
+            Event(title=f"Past {i}", date=timezone.now() - timedelta(days=i + 2),
+                  livestream_url=f"https://example.com/past/{i}", **kwargs)
+            for i in range(count)
+        )
+
+    def test_partitions_current_next_and_past(self):
+        self.create_events(3)
+        Event.objects.create(title="Later", date=timezone.now() + timedelta(days=10))
+        Event.objects.create(title="Soon", date=timezone.now() + timedelta(days=1),
+                             livestream_url="https://example.com/soon")
+
+        response = self.client.get(reverse("livestream"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["next_livestream"]["title"], "Soon")
+        self.assertEqual([e.title for e in response.context["livestreams"]], ["Past 0", "Past 1", "Past 2"])
+
+    def test_query_count_does_not_grow_with_history(self):
+        self.create_events(5)
+        with self.assertNumQueries(4):
+            self.client.get(reverse("livestream"))
+
+        self.create_events(50)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse("livestream"))
+        self.assertEqual(len(response.context["livestreams"]), 10)
+        self.assertEqual(response.context["page_obj"].paginator.num_pages, 6)
+
+
+class QueryPlanTests(TestCase):
+    """ EXPLAIN QUERY PLAN the queries behind the views and fail on full table scans """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("planner", "planner@example.com", "pw")
+        cls.event = Event.objects.create(title="Meetup", date=timezone.now())
+
+    def assertNoTableScan(self, queryset):
+        plan = queryset.explain()
+        for line in plan.splitlines():
+            detail = line.split(" ", 3)[-1]
+            if detail.startswith("SCAN ") and " USING " not in detail:
+                self.fail(f"Full table scan in query plan:\n{plan}\n\nfor query:\n{queryset.query}")
+
+    def test_public_event_queries(self):
+        current_time = timezone.now()
+        self.assertNoTableScan(queries.upcoming_events(current_time))
+        self.assertNoTableScan(queries.listed_events(current_time))
+        self.assertNoTableScan(Event.objects.filter(pk=self.event.pk))
+
+    def test_livestream_queries(self):
+        current_time = timezone.now()
+        start_of_today = current_time.replace(hour=0, minute=0, second=0, microsecond=0)
+        self.assertNoTableScan(queries.current_livestream(start_of_today, current_time)[:1])
+        self.assertNoTableScan(queries.next_livestream(current_time)[:1])
+        self.assertNoTableScan(queries.past_livestreams(current_time, exclude_pk=self.event.pk)[:10])
+
+    def test_purchase_queries(self):
+        self.assertNoTableScan(entitlements_query(self.user.pk))
+        self.assertNoTableScan(registration_query(self.user.pk, self.event.pk))
+        self.assertNoTableScan(registered_ids_query(self.user.pk, [self.event.pk]))
+        self.assertNoTableScan(queries.purchased_events([self.event.pk]))
+        self.assertNoTableScan(queries.purchased_products([1]))
+        self.assertNoTableScan(customer_id_query(self.user))
+
+    def test_queue_claim_queries(self):
+        for model in (StripeWebhookEvent, OutboundEmail):
+            self.assertNoTableScan(due_rows(model, timezone.now()).order_by('pk')[:50])
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.event = Event.objects.create(title="Meetup", date=timezone.now() + timedelta(days=3))
+
+    def test_anonymous_pages_are_cached(self):
+        for url in [reverse("home"), reverse("events"), reverse("directions"),
+                    reverse("event_info", args=[self.event.pk])]:
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual(first.content, second.content)
+
+    def test_saving_event_invalidates_its_pages(self):
+        other = Event.objects.create(title="Other", date=timezone.now() + timedelta(days=5))
+        self.client.get(reverse("events"))
+        self.client.get(reverse("event_info", args=[other.pk]))
+
+        self.event.title = "Renamed meetup"
+        self.event.save()
+
+        self.assertContains(self.client.get(reverse("events")), "Renamed meetup")
+        with self.assertNumQueries(0):
+            self.client.get(reverse("event_info", args=[other.pk]))
+
+    def test_deleting_event_invalidates_listing(self):
+        self.assertContains(self.client.get(reverse("home")), "Meetup")
+        self.event.delete()
+        self.assertNotContains(self.client.get(reverse("home")), "Meetup")
+
+    def test_purchaser_change_invalidates_event_page_only(self):
+        user = User.objects.create_user("buyer", "buyer@example.com", "pw")
+        info_url = reverse("event_info", args=[self.event.pk])
+        self.client.get(info_url)
+        self.client.get(reverse("home"))
+
+        user.purchased_events.add(self.event)
+
+        with self.assertNumQueries(0):
+            self.client.get(reverse("home"))
+        with self.assertNumQueries(1):
+            self.client.get(info_url)
+
+    def test_logged_in_users_are_not_served_cached_pages(self):
+        self.client.get(reverse("home"))
+        User.objects.create_user("member", "member@example.com", "pw")
+        self.client.login(username="member", password="pw")
+        self.assertContains(self.client.get(reverse("home")), "Account")
+
+
+class SanitizeTests(TestCase):
+    def test_strips_unsafe_markup(self):
+        html = ('<p onclick="x()">Hi <script>alert(1)</script><a href="javascript:alert(1)">link</a></p>'
+                '<iframe src="https://evil.example"></iframe><style>p{}</style>')
+        self.assertEqual(sanitize_html(html), "<p>Hi <a>link</a></p>")
+
+    def test_images_are_lazy(self):
+        html = sanitize_html('<figure class="image"><img src="/media/a.png" alt="A"></figure>')
+        self.assertEqual(
+            html, '<figure class="image"><img src="/media/a.png" alt="A" loading="lazy" decoding="async"></figure>'
+        )
+
+    def test_truncation_keeps_markup_balanced(self):
+        html = sanitize_html("<ul>" + "<li><strong>item</strong> text</li>" * 50 + "</ul>", max_length=100)
+        self.assertLessEqual(len(html), 100)
+        self.assertTrue(html.endswith("</ul>"))
+        self.assertEqual(html.count("<li>"), html.count("</li>"))
+
+    def test_excerpt(self):
+        self.assertEqual(html_excerpt("<p>Hello&nbsp;<b>world</b></p><p>again</p>"), "Hello world again")
+        self.assertEqual(html_excerpt("<p>" + "word " * 100 + "</p>", length=20), "word word word word…")
+
+    def test_event_save_renders_columns(self):
+        event = Event.objects.create(title="Meetup", date=timezone.now(),
+                                     description='<p>About <img src="/x.png"></p>', content="<h2>More</h2>")
+        self.assertIn('loading="lazy"', event.description_html)
+        self.assertEqual(event.content_html, "<h2>More</h2>")
+        self.assertEqual(event.excerpt, "About")
+
+        event.description = "<p>Changed</p>"
+        event.save(update_fields=["description"])
+        event.refresh_from_db()
+        self.assertEqual(event.description_html, "<p>Changed</p>")
+
+    def test_unrelated_saves_skip_rendering(self):
+        event = Event.objects.create(title="Meetup", date=timezone.now(), description="<p>About</p>")
+        with mock.patch("tridentapp.models.sanitize_html") as sanitize:
+            event.title = "Renamed"
+            event.save()
+            event.save(update_fields=["capacity"])
+            # Saving a partial instance doesn't load the deferred sources just to compare them
+            with mock.patch.object(Event, "render_html") as render_html:
+                Event.objects.only("pk", "title").get(pk=event.pk).save()
+            render_html.assert_not_called()
+            Event.objects.get(pk=event.pk).save()
+        sanitize.assert_not_called()
+
+    def test_excerpt_fits_its_column(self):
+        event = Event.objects.create(title="Meetup", date=timezone.now(), description="<p>" + "x" * 400 + "</p>")
+        self.assertEqual(len(event.excerpt), Event._meta.get_field("excerpt").max_length)
+
+
+class EntitlementTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("member", "member@example.com", "pw")
+        self.event = Event.objects.create(title="Meetup", date=timezone.now() + timedelta(days=3))
+        self.other = Event.objects.create(title="Other", date=timezone.now() + timedelta(days=4))
+        self.product = Product.objects.create(product_name="Subscription", price=5)
+
+    def test_loads_events_and_products_in_one_query(self):
+        self.event.purchasers.add(self.user)
+        self.product.purchasers.add(self.user)
+        with self.assertNumQueries(1):
+            entitlements = get_entitlements(self.user)
+        self.assertEqual(entitlements.event_ids, {self.event.pk})
+        self.assertEqual(entitlements.product_ids, {self.product.pk})
+        with self.assertNumQueries(0):
+            get_entitlements(self.user)
+
+    def test_purchases_invalidate_cache(self):
+        self.assertEqual(get_entitlements(self.user).event_ids, set())
+        self.event.purchasers.add(self.user)
+        self.assertEqual(get_entitlements(self.user).event_ids, {self.event.pk})
+        self.user.purchased_events.add(self.other)
+        self.assertEqual(get_entitlements(self.user).event_ids, {self.event.pk, self.other.pk})
+        self.event.purchasers.clear()
+        self.assertEqual(get_entitlements(self.user).event_ids, {self.other.pk})
+
+    def test_user_home_and_badges(self):
+        self.event.purchasers.add(self.user)
+        self.client.login(username="member", password="pw")
+
+        response = self.client.get(reverse("user_home"))
+        self.assertEqual([e.title for e in response.context["events"]], ["Meetup"])
+
+        response = self.client.get(reverse("events"))
+        self.assertContains(response, "Registered", count=1)
+
+
+class EventRegisterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("member", "member@example.com", "pw")
+        self.event = Event.objects.create(title="Free meetup", date=timezone.now() + timedelta(days=3))
+        self.client.login(username="member", password="pw")
+
+    def test_registration_is_idempotent(self):
+        url = reverse("event_register", args=[self.event.pk])
+        self.client.post(url)
+        self.client.post(url)
+        self.assertEqual(self.event.purchasers.count(), 1)
+        self.assertEqual(get_entitlements(self.user).event_ids, {self.event.pk})
+
+        response = self.client.get(url)
+        self.assertTrue(response.context["already_registered"])
+
+    def test_membership_check_does_not_load_purchasers(self):
+        others = User.objects.bulk_create(User(username=f"u{i}") for i in range(20))
+        self.event.purchasers.add(*others)
+        self.assertFalse(is_registered(self.user, self.event.pk))
+        self.assertTrue(register_for_event(self.user, self.event))
+        self.assertFalse(register_for_event(self.user, self.event))
+        self.assertTrue(is_registered(self.user, self.event.pk))
+
+    def test_batch_check(self):
+        other = Event.objects.create(title="Other", date=timezone.now() + timedelta(days=4))
+        register_for_event(self.user, other)
+        with self.assertNumQueries(1):
+            ids = registered_event_ids(self.user, [self.event.pk, other.pk])
+        self.assertEqual(ids, {other.pk})
+
+
+@mock.patch("stripe.PaymentIntent.retrieve", return_value=mock.Mock(status="requires_payment_method"))
+@mock.patch("stripe.PaymentIntent.modify")
+@mock.patch("stripe.PaymentIntent.create")
+class PaymentIntentReuseTests(TestCase):
+    def setUp(self):
+        self.event = Event.objects.create(title="Paid meetup", date=timezone.now() + timedelta(days=3), price=20)
+
+    def continue_to_payment(self, quantity):
+        response = self.client.post(reverse("purchase_event", args=[self.event.pk]),
+                                    {"quantity": quantity, "action": "continue", "email": "guest@example.com"})
+        return self.client.get(response["Location"])
+
+    def test_reload_reuses_intent(self, create, modify, retrieve):
+        create.return_value = mock.Mock(id="pi_1", client_secret="pi_1_secret")
+        self.continue_to_payment(1)
+        response = self.continue_to_payment(1)
+
+        create.assert_called_once()
+        modify.assert_not_called()
+        self.assertEqual(response.context["client_secret"], "pi_1_secret")
+
+    def test_changed_quote_modifies_intent(self, create, modify, retrieve):
+        create.return_value = mock.Mock(id="pi_1", client_secret="pi_1_secret")
+        self.continue_to_payment(1)
+        self.continue_to_payment(3)
+
+        create.assert_called_once()
+        modify.assert_called_once()
+        self.assertEqual(modify.call_args.kwargs["amount"], 6000)
+        self.assertEqual(PaymentIntentRecord.objects.get().quantity, 3)
+
+    def test_paid_intent_is_not_reused(self, create, modify, retrieve):
+        create.side_effect = [mock.Mock(id="pi_1", client_secret="s1"), mock.Mock(id="pi_2", client_secret="s2")]
+        self.continue_to_payment(1)
+        handle_event({"type": "payment_intent.succeeded",
+                      "data": {"object": {"id": "pi_1", "metadata": {}}}})
+        response = self.continue_to_payment(1)
+
+        self.assertEqual(create.call_count, 2)
+        self.assertEqual(response.context["client_secret"], "s2")
+
+    def test_product_checkout_reuses_intent(self, create, modify, retrieve):
+        create.return_value = mock.Mock(id="pi_1", client_secret="pi_1_secret")
+        product = Product.objects.create(product_name="Workshop recording", price=15)
+        self.client.force_login(User.objects.create_user("buyer", "buyer@example.com", "pw"))
+        for _ in range(2):
+            response = self.client.get(reverse("purchase_product", args=[product.pk]))
+            self.assertContains(response, "1 x Workshop recording")
+            self.assertEqual(response.context["client_secret"], "pi_1_secret")
+
+        create.assert_called_once()
+        self.assertEqual(create.call_args.kwargs["amount"], 1500)
+        self.assertEqual(PaymentIntentRecord.objects.get().product, product)
+
+        retrieve.return_value = mock.Mock(status="processing")
+        response = self.client.get(reverse("purchase_product", args=[product.pk]))
+        self.assertRedirects(response, f"{reverse('payment_confirmation')}?intent=pi_1")
+
+    def test_intent_paid_before_the_webhook_is_not_served_or_replaced(self, create, modify, retrieve):
+        create.return_value = mock.Mock(id="pi_1", client_secret="s1")
+        self.continue_to_payment(1)
+        for status, record_status in (("processing", PaymentIntentRecord.OPEN),
+                                      ("succeeded", PaymentIntentRecord.SUCCEEDED)):
+            retrieve.return_value = mock.Mock(status=status)
+            response = self.continue_to_payment(3)
+            self.assertRedirects(response, f"{reverse('payment_confirmation')}?intent=pi_1")
+            self.assertEqual(PaymentIntentRecord.objects.get().status, record_status)
+        create.assert_called_once()
+        modify.assert_not_called()
+
+    def test_unmodifiable_intent_is_only_replaced_once_canceled(self, create, modify, retrieve):
+        create.side_effect = [mock.Mock(id="pi_1", client_secret="s1"), mock.Mock(id="pi_2", client_secret="s2")]
+        modify.side_effect = stripe.error.InvalidRequestError("Cannot modify", None)
+        self.continue_to_payment(1)
+
+        retrieve.side_effect = [mock.Mock(status="requires_payment_method"), mock.Mock(status="processing")]
+        self.assertRedirects(self.continue_to_payment(3), f"{reverse('payment_confirmation')}?intent=pi_1")
+        self.assertEqual(create.call_count, 1)
+        self.assertEqual(PaymentIntentRecord.objects.get().quantity, 1)
+
+        retrieve.side_effect = [mock.Mock(status="requires_payment_method"), mock.Mock(status="canceled")]
+        response = self.continue_to_payment(3)
+        self.assertEqual(response.context["client_secret"], "s2")
+        self.assertEqual(PaymentIntentRecord.objects.get(stripe_intent_id="pi_1").status,
+                         PaymentIntentRecord.CANCELED)
+
+
+@mock.patch("stripe.PaymentIntent.retrieve", return_value=mock.Mock(status="requires_payment_method"))
+@mock.patch("stripe.PaymentIntent.modify")
+@mock.patch("stripe.PaymentIntent.create")
+class SeatInventoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.event = Event.objects.create(title="Drop", date=timezone.now() + timedelta(days=3), price=20, capacity=5)
+
+    def continue_to_payment(self, quantity, client=None):
+        client = client or self.client
+        response = client.post(reverse("purchase_event", args=[self.event.pk]),
+                               {"quantity": quantity, "action": "continue", "email": "guest@example.com"})
+        if response.status_code != 302:
+            return response
+        return client.get(response["Location"])
+
+    def seats_remaining(self):
+        self.event.refresh_from_db(fields=["seats_remaining"])
+        return self.event.seats_remaining
+
+    def test_reservation_is_one_conditional_update(self, create, modify, retrieve):
+        self.assertEqual(self.event.seats_remaining, 5)
+        with self.assertNumQueries(1):
+            self.assertTrue(reserve_seats(self.event.pk, 3))
+        self.assertFalse(reserve_seats(self.event.pk, 3))
+        self.assertTrue(reserve_seats(self.event.pk, 2))
+        self.assertEqual(self.seats_remaining(), 0)
+        for quantity in (0, -1):
+            with self.assertRaises(ValueError):
+                reserve_seats(self.event.pk, quantity)
+
+        unlimited = Event.objects.create(title="Open", date=timezone.now() + timedelta(days=3))
+        self.assertTrue(reserve_seats(unlimited.pk, 1000))
+        unlimited.refresh_from_db()
+        self.assertIsNone(unlimited.seats_remaining)
+
+    def test_capacity_change_recounts_from_ledger(self, create, modify, retrieve):
+        TicketOrder.objects.create(event=self.event, quantity=2, status=TicketOrder.CONFIRMED)
+        TicketOrder.objects.create(event=self.event, quantity=1, status=TicketOrder.HELD)
+        TicketOrder.objects.create(event=self.event, quantity=4, status=TicketOrder.RELEASED)
+        self.event.capacity = 10
+        self.event.save(update_fields=["capacity"])
+        self.assertEqual(self.seats_remaining(), 7)
+
+        self.event.capacity = None
+        self.event.save()
+        self.assertIsNone(self.seats_remaining())
+
+    def test_free_registration_respects_capacity(self, create, modify, retrieve):
+        self.event.capacity = 1
+        self.event.save()
+        first, second = (User.objects.create_user(name, f"{name}@example.com", "pw") for name in ("first", "second"))
+        self.assertTrue(register_for_event(first, self.event))
+        self.assertFalse(register_for_event(first, self.event))
+        with self.assertRaises(SoldOut):
+            register_for_event(second, self.event)
+        self.assertEqual(list(self.event.purchasers.all()), [first])
+        self.assertEqual(TicketOrder.objects.get().user, first)
+
+        self.client.force_login(second)
+        response = self.client.post(reverse("event_register", args=[self.event.pk]), follow=True)
+        self.assertContains(response, "is full")
+
+    def test_checkout_holds_then_confirms_seats(self, create, modify, retrieve):
+        create.return_value = mock.Mock(id="pi_1", client_secret="pi_1_secret")
+        self.continue_to_payment(2)
+        self.assertEqual(self.seats_remaining(), 3)
+        # A changed quote only reserves the difference
+        self.continue_to_payment(3)
+        self.assertEqual(self.seats_remaining(), 2)
+        order = TicketOrder.objects.get()
+        self.assertEqual((order.status, order.quantity), (TicketOrder.HELD, 3))
+
+        response = self.continue_to_payment(3, client=Client())
+        self.assertContains(response, "Only 2 ticket(s) left.")
+
+        handle_event({"type": "payment_intent.succeeded", "data": {"object": {
+            "id": "pi_1", "metadata": {"event": self.event.pk, "quantity": "3"},
+            "charges": {"data": [{"billing_details": {"email": "guest@example.com", "name": "Guest"}}]},
+        }}})
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.quantity, order.email), (TicketOrder.CONFIRMED, 3, "guest@example.com"))
+        self.assertEqual(self.seats_remaining(), 2)
+
+    def test_expired_and_canceled_holds_are_released(self, create, modify, retrieve):
+        create.side_effect = [mock.Mock(id="pi_1", client_secret="s1"), mock.Mock(id="pi_2", client_secret="s2")]
+        self.continue_to_payment(2)
+        self.continue_to_payment(3, client=Client())
+        self.assertEqual(self.seats_remaining(), 0)
+
+        TicketOrder.objects.filter(payment_intent__stripe_intent_id="pi_1").update(
+            expires_at=timezone.now() - timedelta(minutes=1))
+        call_command("release_seat_holds", "--once", stdout=StringIO())
+        self.assertEqual(self.seats_remaining(), 2)
+        self.assertEqual(release_expired_holds(), 0)
+
+        handle_event({"type": "payment_intent.canceled", "data": {"object": {"id": "pi_2"}}})
+        self.assertEqual(self.seats_remaining(), 5)
+        self.assertEqual(TicketOrder.objects.filter(status=TicketOrder.RELEASED).count(), 2)
+
+        # Paying after the hold expired takes the seats again
+        confirm_order("pi_1", self.event.pk, 2)
+        self.assertEqual(self.seats_remaining(), 3)
+
+    def test_buyer_can_requote_into_their_own_hold(self, create, modify, retrieve):
+        create.side_effect = [mock.Mock(id="pi_1", client_secret="s1"), mock.Mock(id="pi_2", client_secret="s2")]
+        self.assertEqual(self.continue_to_payment(5).context["client_secret"], "s1")
+        self.assertEqual(self.continue_to_payment(5).context["client_secret"], "s1")
+
+        self.continue_to_payment(2)
+        self.continue_to_payment(1, client=Client())
+        self.assertEqual(self.continue_to_payment(4).context["client_secret"], "s1")
+        self.assertEqual(self.seats_remaining(), 0)
+
+    def test_sold_out_requote_leaves_the_intent_alone(self, create, modify, retrieve):
+        create.side_effect = [mock.Mock(id="pi_1", client_secret="s1"), mock.Mock(id="pi_2", client_secret="s2")]
+        response = self.client.post(reverse("purchase_event", args=[self.event.pk]),
+                                    {"quantity": 2, "action": "continue", "email": "guest@example.com"})
+        self.client.get(response["Location"])
+        quote_id = load_quote(response["Location"].split("quote=")[1], self.event.pk)["id"]
+        self.continue_to_payment(2, client=Client())
+
+        # Past the advisory check, as if the other buyer took the seats just after it
+        quote = make_quote(self.event, 4, "", "guest@example.com", quote_id=quote_id)
+        with mock.patch("tridentapp.views.held_seats", return_value=5):
+            response = self.client.get(reverse("pay_event", args=[self.event.pk]), {"quote": quote})
+
+        self.assertRedirects(response, reverse("purchase_event", args=[self.event.pk]))
+        modify.assert_not_called()
+        record = PaymentIntentRecord.objects.get(stripe_intent_id="pi_1")
+        self.assertEqual((record.quantity, record.amount, record.ticket_order.quantity), (2, 4000, 2))
+        self.assertEqual(self.seats_remaining(), 1)
+
+    def test_sold_out_checkout_makes_no_stripe_call(self, create, modify, retrieve):
+        reserve_seats(self.event.pk, 5)
+        response = self.continue_to_payment(1)
+        self.assertContains(response, "Sold out.")
+        create.assert_not_called()
+
+
+class StripeCustomerProvisioningTests(TestCase):
+    @mock.patch("stripe.Customer.create")
+    def test_command_provisions_active_users_once(self, create):
+        create.side_effect = lambda **kwargs: mock.Mock(id=f"cus_{kwargs['metadata']['user_id']}")
+        active = [User.objects.create_user(f"user{i}", f"user{i}@example.com", "pw") for i in range(3)]
+        User.objects.create_user("pending", "pending@example.com", "pw", is_active=False)
+
+        call_command("provision_stripe_customers", workers=2, stdout=StringIO())
+        call_command("provision_stripe_customers", workers=2, stdout=StringIO())
+
+        self.assertEqual(create.call_count, 3)
+        self.assertEqual(
+            set(Customer.objects.values_list("stripe_customer_id", flat=True)),
+            {f"cus_{user.pk}" for user in active},
+        )
+
+    @mock.patch("stripe.Customer.create")
+    def test_failing_users_do_not_block_later_ones(self, create):
+        users = [User.objects.create_user(f"user{i}", f"user{i}@example.com", "pw") for i in range(5)]
+        failing = {users[0].pk, users[1].pk}
+
+        def create_customer(**kwargs):
+            if kwargs["metadata"]["user_id"] in failing:
+                raise RuntimeError("Stripe down")
+            return mock.Mock(id=f"cus_{kwargs['metadata']['user_id']}")
+        create.side_effect = create_customer
+
+        err = StringIO()
+        call_command("provision_stripe_customers", batch_size=2, workers=1, stdout=StringIO(), stderr=err)
+
+        self.assertEqual(set(Customer.objects.values_list("user_id", flat=True)), {user.pk for user in users[2:]})
+        self.assertIn("2 user(s) could not be provisioned", err.getvalue())
+
+    @mock.patch("stripe.Customer.create")
+    @mock.patch("stripe.PaymentIntent.create", return_value=mock.Mock(id="pi_1", client_secret="s"))
+    def test_checkout_only_reads_cached_customer(self, create_intent, create_customer):
+        user = User.objects.create_user("buyer", "buyer@example.com", "pw")
+        Customer.objects.create(user=user, stripe_customer_id="cus_local")
+        event = Event.objects.create(title="Paid", date=timezone.now() + timedelta(days=1), price=10)
+        self.client.login(username="buyer", password="pw")
+
+        response = self.client.post(reverse("purchase_event", args=[event.pk]), {"quantity": 1, "action": "continue"})
+        self.client.get(response["Location"])
+
+        create_customer.assert_not_called()
+        self.assertEqual(create_intent.call_args.kwargs["customer"], "cus_local")
+
+
+class StripeClientTests(TestCase):
+    def test_configured_with_pool_and_timeouts(self):
+        import stripe
+        client = stripe.default_http_client
+        self.assertIsInstance(client, stripe.RequestsClient)
+        self.assertEqual(client._timeout, (5, 20))
+        self.assertEqual(stripe.max_network_retries, 2)
+
+    @mock.patch("stripe.PaymentIntent.create", return_value=mock.Mock(id="pi_1"))
+    def test_calls_are_timed_and_creates_are_idempotent(self, create):
+        STRIPE_LATENCY.reset()
+        stripe_call("PaymentIntent.create", amount=100, currency="usd")
+        self.assertTrue(create.call_args.kwargs["idempotency_key"].startswith("trident-"))
+
+        with mock.patch("stripe.PaymentIntent.modify", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                stripe_call("PaymentIntent.modify", "pi_1", amount=200)
+
+        snapshot = STRIPE_LATENCY.snapshot()
+        self.assertEqual(snapshot[("PaymentIntent.create", "ok")]["count"], 1)
+        self.assertEqual(snapshot[("PaymentIntent.modify", "error")]["count"], 1)
+        self.assertIn('stripe_request_duration_seconds_count{method="PaymentIntent.create",outcome="ok"} 1',
+                      render_metrics())
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.event = Event.objects.create(
+            title="Open Night", date=timezone.now() + timedelta(days=3), description="<p>Come along</p>"
+        )
+
+    async def test_read_views_under_async_client(self):
+        response = await self.async_client.get(reverse("events"))
+        self.assertContains(response, "Open Night")
+        response = await self.async_client.get(reverse("event_info", args=[self.event.pk]))
+        self.assertContains(response, "Come along")
+        response = await self.async_client.get(reverse("event_info", args=[self.event.pk + 100]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_stripe_calls_do_not_block_each_other(self):
+        # Each call waits for all four to be in flight, which only happens if none blocks the others
+        in_flight = threading.Barrier(4, timeout=10)
+
+        def create(**kwargs):
+            in_flight.wait()
+            return mock.Mock(id="pi_1")
+
+        with mock.patch("stripe.PaymentIntent.create", side_effect=create):
+            results = await asyncio.gather(*(astripe_call("PaymentIntent.create", amount=100) for _ in range(4)))
+        self.assertEqual([result.id for result in results], ["pi_1"] * 4)
+
+
+@mock.patch("stripe.PaymentIntent.create", return_value=mock.Mock(id="pi_1", client_secret="s"))
+class CheckoutQuoteTests(TestCase):
+    def setUp(self):
+        self.event = Event.objects.create(title="Paid", date=timezone.now() + timedelta(days=1), price=20,
+                                          promo_code="HALF", promo_discount=50)
+
+    def test_guest_checkout_writes_no_session(self, create):
+        response = self.client.post(reverse("purchase_event", args=[self.event.pk]),
+                                    {"quantity": 2, "promo": "HALF", "action": "continue", "email": "g@example.com"})
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+        response = self.client.get(response["Location"])
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertEqual(response.context["amount_display"], "$20.00")
+        self.assertEqual(create.call_args.kwargs["amount"], 2000)
+        self.assertTrue(PaymentIntentRecord.objects.get().owner_key.startswith("quote:"))
+
+    def test_tampered_or_foreign_quote_is_rejected(self, create):
+        other = Event.objects.create(title="Other", date=timezone.now() + timedelta(days=1), price=1)
+        token = make_quote(other, 1, "", "")
+        for quote in [token, token[:-2] + "xx", ""]:
+            response = self.client.get(reverse("pay_event", args=[self.event.pk]), {"quote": quote})
+            self.assertRedirects(response, reverse("purchase_event", args=[self.event.pk]),
+                                 fetch_redirect_response=False)
+        create.assert_not_called()
+
+    def test_invalid_quantity_quotes_one_ticket(self, create):
+        for quantity in ["abc", "0", "-3", ""]:
+            response = self.client.post(reverse("purchase_event", args=[self.event.pk]),
+                                        {"quantity": quantity, "action": "continue", "email": "g@example.com"})
+            quote = load_quote(response["Location"].split("quote=")[1], self.event.pk)
+            self.assertEqual((quote["quantity"], quote["amount"]), (1, 2000))
+
+    def test_expired_quote_is_rejected(self, create):
+        token = make_quote(self.event, 1, "", "")
+        with override_settings(QUOTE_MAX_AGE=-1):
+            self.assertIsNone(load_quote(token, self.event.pk))
+        self.assertEqual(load_quote(token, self.event.pk)["amount"], 2000)
+
+
+class SQLiteConcurrencyTests(SimpleTestCase):
+    """ Run the production database settings against a scratch file and hammer it from threads """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.settings_dict = {**connection.settings_dict, "NAME": os.path.join(self.tmpdir.name, "stress.sqlite3")}
+        with closing(self.connect()) as setup:
+            setup.execute("CREATE TABLE item (id INTEGER PRIMARY KEY, value INTEGER)")
+            setup.execute("INSERT INTO item (value) VALUES (0)")
+
+    def connect(self, **options):
+        settings_dict = {**self.settings_dict, "OPTIONS": {**self.settings_dict["OPTIONS"], **options}}
+        wrapper = SQLiteDatabaseWrapper(settings_dict, alias="stress")
+        wrapper.connect()
+        return wrapper.connection
+
+    def test_pragmas_and_transaction_mode(self):
+        wrapper = SQLiteDatabaseWrapper(self.settings_dict, alias="stress")
+        wrapper.connect()
+        with closing(wrapper.connection) as conn:
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)
+            self.assertEqual(conn.execute("PRAGMA busy_timeout").fetchone()[0], 20000)
+            self.assertEqual(wrapper.transaction_mode, "IMMEDIATE")
+
+    def test_reader_does_not_wait_for_exclusive_writer(self):
+        # With no busy timeout, any wait for the writer's lock would raise "database is locked"
+        with closing(self.connect()) as writer, \
+                closing(self.connect(init_command="PRAGMA busy_timeout=0")) as reader:
+            writer.execute("BEGIN EXCLUSIVE")
+            writer.execute("INSERT INTO item (value) VALUES (1)")
+            self.assertEqual(reader.execute("SELECT count(*) FROM item").fetchone()[0], 1)
+            writer.execute("COMMIT")
+            self.assertEqual(reader.execute("SELECT count(*) FROM item").fetchone()[0], 2)
+
+    def test_rollback_journal_would_block(self):
+        # Control: the same situation without WAL makes the reader fail
+        init = "PRAGMA journal_mode=DELETE;PRAGMA busy_timeout=50"
+        with closing(self.connect(init_command=init)) as writer, \
+                closing(self.connect(init_command=init)) as reader:
+            writer.execute("BEGIN EXCLUSIVE")
+            writer.execute("INSERT INTO item (value) VALUES (1)")
+            with self.assertRaisesMessage(sqlite3.OperationalError, "database is locked"):
+                reader.execute("SELECT count(*) FROM item").fetchone()
+            writer.execute("ROLLBACK")
+
+    def test_concurrent_readers_and_writers(self):
+        writers, writes_each, readers = 4, 50, 4
+        errors = []
+        reads = []
+        done = threading.Event()
+
+        def write():
+            with closing(self.connect()) as conn:
+                for _ in range(writes_each):
+                    try:
+                        conn.execute("BEGIN IMMEDIATE")
+                        conn.execute("UPDATE item SET value = value + 1 WHERE id = 1")
+                        conn.execute("INSERT INTO item (value) VALUES (1)")
+                        conn.execute("COMMIT")
+                    except sqlite3.Error as exc:
+                        errors.append(exc)
+
+        def read():
+            # No busy timeout: a reader that had to wait for a writer fails instead of stalling
+            seen = []
+            reads.append(seen)
+            with closing(self.connect(init_command="PRAGMA busy_timeout=0")) as conn:
+                while not done.is_set():
+                    try:
+                        seen.append(conn.execute("SELECT sum(value) FROM item").fetchone()[0])
+                    except sqlite3.Error as exc:
+                        errors.append(exc)
+
+        reader_threads = [threading.Thread(target=read) for _ in range(readers)]
+        writer_threads = [threading.Thread(target=write) for _ in range(writers)]
+        for thread in reader_threads + writer_threads:
+            thread.start()
+        for thread in writer_threads:
+            thread.join()
+        done.set()
+        for thread in reader_threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        with closing(self.connect()) as conn:
+            self.assertEqual(conn.execute("SELECT value FROM item WHERE id = 1").fetchone()[0], writers * writes_each)
+        for seen in reads:
+            # Every read saw a committed state, and never an older one than before
+            self.assertTrue(seen)
+            self.assertEqual(seen, sorted(seen))
+            self.assertTrue(all(total % 2 == 0 for total in seen))
+
+
+@override_settings(STATIC_IMAGE_WIDTHS=[200, 400], STATIC_IMAGE_FORMATS=["webp"])
+class StaticImageTests(SimpleTestCase):
+    def setUp(self):
+        source_dir = tempfile.TemporaryDirectory()
+        target_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(source_dir.cleanup)
+        self.addCleanup(target_dir.cleanup)
+        Image.new("RGB", (600, 300), "red").save(os.path.join(source_dir.name, "hero.png"))
+        Image.new("RGB", (32, 32), "red").save(os.path.join(source_dir.name, "icon.png"))
+        with open(os.path.join(source_dir.name, "site.css"), "w") as handle:
+            handle.write("body { color: red; }\n" * 50)
+
+        source = FileSystemStorage(location=source_dir.name)
+        self.storage = OptimizedStaticFilesStorage(location=target_dir.name, base_url="/static/")
+        paths = {}
+        for name in ("hero.png", "icon.png", "site.css"):
+            with source.open(name) as handle:
+                self.storage.save(name, handle)
+            paths[name] = (source, name)
+        list(self.storage.post_process(paths))
+
+    def render(self, template):
+        with mock.patch("tridentapp.templatetags.images.staticfiles_storage", self.storage), \
+                mock.patch("django.contrib.staticfiles.storage.staticfiles_storage", self.storage):
+            return Template("{% load images %}" + template).render(Context())
+
+    def test_site_templates_use_the_manifest(self):
+        # The test runner collected the real static files with the production storage
+        from django.contrib.staticfiles.storage import staticfiles_storage
+        self.assertIsInstance(staticfiles_storage, OptimizedStaticFilesStorage)
+        html = Template("{% load images %}{% image_set 'bg2.png' %}").render(Context())
+        self.assertIn(staticfiles_storage.stored_name("bg2.png")[:-4], html)
+
+    def test_collectstatic_writes_variants_and_gzip(self):
+        entry = OptimizedStaticFilesStorage(location=self.storage.location).image_variants("hero.png")
+        self.assertEqual((entry["width"], entry["height"]), (600, 300))
+        self.assertEqual([width for width, _ in entry["sources"]["webp"]], [200, 400, 600])
+        for _, name in entry["sources"]["webp"]:
+            self.assertTrue(name.startswith(self.storage.stored_name("hero.png")[:-4]))
+            self.assertTrue(self.storage.exists(name))
+        self.assertIsNone(self.storage.image_variants("icon.png"))
+        self.assertTrue(self.storage.exists(self.storage.stored_name("site.css") + ".gz"))
+
+    def test_responsive_image_tag(self):
+        html = self.render('{% responsive_image "hero.png" alt="Hero" sizes="50vw" %}')
+        self.assertIn('<source type="image/webp" srcset="/static/', html)
+        self.assertIn('.200w.webp 200w', html)
+        self.assertIn('sizes="50vw"', html)
+        self.assertIn('loading="lazy"', html)
+        self.assertIn('width="600" height="300"', html)
+
+        html = self.render('{% responsive_image "icon.png" loading="eager" %}')
+        self.assertNotIn("<picture>", html)
+        self.assertIn('loading="eager"', html)
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = override_settings(MEDIA_ROOT=media.name, EVENT_THUMBNAIL_WIDTHS=[100, 300])
+        override.enable()
+        self.addCleanup(override.disable)
+        thumbnails._ready.clear()
+
+        buffer = BytesIO()
+        Image.new("RGB", (800, 400), "blue").save(buffer, format="PNG")
+        self.upload = SimpleUploadedFile("poster.png", buffer.getvalue(), content_type="image/png")
+
+    @mock.patch("tridentapp.signals.schedule_thumbnails")
+    def test_upload_schedules_generation(self, schedule):
+        with self.captureOnCommitCallbacks(execute=True):
+            event = Event.objects.create(title="Poster", date=timezone.now(), image=self.upload)
+        schedule.assert_called_once_with(event.image.name)
+
+    @mock.patch("tridentapp.signals.schedule_thumbnails")
+    def test_generated_once_under_deterministic_names(self, schedule):
+        event = Event.objects.create(title="Poster", date=timezone.now(), image=self.upload)
+        self.assertEqual(thumbnails.generate_thumbnails(event.image.name), 2)
+        self.assertEqual(thumbnails.generate_thumbnails(event.image.name), 0)
+
+        name = thumbnails.thumbnail_name(event.image.name, 100)
+        self.assertEqual(name, thumbnails.thumbnail_name(event.image.name, 100))
+        with default_storage.open(name) as handle:
+            self.assertEqual(Image.open(handle).size, (100, 50))
+        self.assertEqual(thumbnails.thumbnail_url(event.image, 100), default_storage.url(name))
+        self.assertIn(" 300w", thumbnails.thumbnail_srcset(event.image))
+
+    @mock.patch("tridentapp.signals.schedule_thumbnails")
+    def test_missing_thumbnail_serves_original_and_queues(self, schedule):
+        event = Event.objects.create(title="Poster", date=timezone.now(), image=self.upload)
+        with mock.patch("tridentapp.thumbnails.schedule_thumbnails") as lazy:
+            self.assertEqual(thumbnails.thumbnail_url(event.image, 100), event.image.url)
+        lazy.assert_called_once_with(event.image.name)
+
+        out = StringIO()
+        call_command("generate_thumbnails", stdout=out)
+        self.assertIn("Created 2 thumbnail(s) for 1 image(s)", out.getvalue())
+        self.assertNotEqual(thumbnails.thumbnail_url(event.image, 100), event.image.url)
+
+    @mock.patch("tridentapp.signals.schedule_thumbnails")
+    def test_generation_drops_pages_cached_with_the_original(self, schedule):
+        event = Event.objects.create(title="Poster", date=timezone.now() + timedelta(days=1), image=self.upload)
+        cache.clear()
+        with mock.patch("tridentapp.thumbnails.schedule_thumbnails"):
+            self.assertIn(event.image.url, self.client.get(reverse("event_info", args=[event.pk])).content.decode())
+
+        thumbnails._generate(event.image.name)
+        page = self.client.get(reverse("event_info", args=[event.pk])).content.decode()
+        self.assertIn(thumbnails.thumbnail_name(event.image.name, 300), page)
+
+    @override_settings(THUMBNAIL_READY_CACHE_SIZE=2)
+    @mock.patch("tridentapp.signals.schedule_thumbnails")
+    def test_ready_names_are_bounded(self, schedule):
+        event = Event.objects.create(title="Poster", date=timezone.now(), image=self.upload)
+        thumbnails.generate_thumbnails(event.image.name)
+        for width in (100, 300, 100, 300):
+            self.assertTrue(thumbnails.thumbnail_exists(event.image.name, width))
+        thumbnails._mark_ready("thumbs/other.webp")
+        self.assertEqual(len(thumbnails._ready), 2)
+        self.assertTrue(thumbnails.thumbnail_exists(event.image.name, 100))
+
+
+class BenchmarkTests(TestCase):
+    def test_seed_and_benchmark_every_route(self):
+        seed_data(users=30, events=12, products=2, purchasers_per_event=3,
+                  large_events=1, large_event_purchasers=20, batch_size=50, log=lambda line: None)
+        self.assertEqual(User.objects.count(), 30)
+        self.assertGreaterEqual(Event.purchasers.through.objects.count(), 11 * 3 + 20)
+
+        baseline = run_benchmarks(iterations=2, warmup=0, log=lambda line: None)
+        routes = {name.split(" ")[0] for name in baseline["results"]}
+        self.assertTrue({"home", "events", "event_info", "pay_event", "stripe_webhook"} <= routes)
+        for name, result in baseline["results"].items():
+            if name != "not_found (anonymous)":
+                self.assertLess(result["status"], 400, name)
+        self.assertGreater(baseline["results"]["user_home (user)"]["rows"], 0)
+        # Benchmark writes are rolled back
+        self.assertFalse(StripeWebhookEvent.objects.exists())
+
+        slower = json.loads(json.dumps(baseline))
+        slower["results"]["home (user)"]["queries"] += 1
+        lines, regressed = compare(baseline, slower)
+        self.assertTrue(regressed)
+        self.assertTrue(any("MORE QUERIES" in line for line in lines))
+        self.assertFalse(compare(baseline, baseline)[1])
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        REQUEST_LATENCY.reset()
+        self.event = Event.objects.create(title="Timed", date=timezone.now() + timedelta(days=1), price=20)
+        self.staff = User.objects.create_user("ops", "ops@example.com", "pw", is_staff=True)
+
+    def test_server_timing_is_not_sent_to_anonymous_clients(self):
+        self.assertNotIn("Server-Timing", self.client.get(reverse("events")))
+        with self.settings(SERVER_TIMING_HEADER=True):
+            self.assertIn("Server-Timing", self.client.get(reverse("events")))
+
+    def test_server_timing_header(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse("events"))
+        timing = response["Server-Timing"]
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn("tpl;dur=", timing)
+        self.assertIn("total;dur=", timing)
+        self.assertNotIn("stripe", timing)
+
+    @mock.patch("stripe.PaymentIntent.create", return_value=mock.Mock(id="pi_1", client_secret="s"))
+    @override_settings(SERVER_TIMING_HEADER=True)
+    def test_stripe_time_is_attributed_to_the_request(self, create):
+        token = make_quote(self.event, 1, "", "guest@example.com", quote_id="q1")
+        response = self.client.get(reverse("pay_event", args=[self.event.pk]), {"quote": token})
+        self.assertIn("stripe;dur=", response["Server-Timing"])
+
+    def test_metrics_endpoint_is_restricted(self):
+        self.client.get(reverse("events"))
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('http_request_duration_seconds_count{view="events",method="GET",status="200"} 1',
+                      response.content.decode())
+        self.assertIn("http_request_db_queries_bucket", response.content.decode())
+
+    @override_settings(METRICS_TOKEN="scrape-token")
+    def test_metrics_bearer_token(self):
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer scrape-token")
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer wrong")
+        self.assertEqual(response.status_code, 403)
+
+
+class LoadTestFakesTests(TestCase):
+    def start(self, service):
+        service.start()
+        self.addCleanup(service.stop)
+        return service
+
+    def test_fake_stripe_retries_are_idempotent(self):
+        import stripe
+
+        fake = self.start(FakeStripe(error_rate=0.5, seed=3))
+        with mock.patch.object(stripe, "api_base", fake.url), mock.patch.object(stripe, "api_key", "sk_test"), \
+                mock.patch.object(stripe, "max_network_retries", 10), \
+                mock.patch("stripe._http_client.HTTPClient._sleep_time_seconds", return_value=0):
+            intents = [stripe_call("PaymentIntent.create", amount=500, currency="usd",
+                                   metadata={"event": "1"}) for _ in range(5)]
+        self.assertGreater(fake.errors, 0)
+        self.assertEqual(len(fake.intents), 5)
+        self.assertEqual(intents[0].metadata["event"], "1")
+
+        event = fake.succeed(intents[0].client_secret, "buyer@example.com")
+        self.assertEqual(event["data"]["object"]["status"], "succeeded")
+
+    def test_fake_ses_receives_outbox_mail(self):
+        fake = self.start(FakeSES())
+        with override_settings(EMAIL_BACKEND="tridentapp.mail.SESEmailBackend", SES_ENDPOINT_URL=fake.url,
+                               SES_MOCAPSCHOOL_KEY="k", SES_MOCAPSCHOOL_SECRET="s",
+                               SES_MOCAPSCHOOL_REGION="us-east-1"):
+            reset_ses_client()
+            self.addCleanup(reset_ses_client)
+            mail.send_mail("Hi", "Body", "from@example.com", ["to@example.com"])
+        self.assertEqual(fake.delivered["to@example.com"], 1)
+
+
+class AttendeeExportTests(TestCase):
+    def setUp(self):
+        self.event = Event.objects.create(title="Door", date=timezone.now() + timedelta(days=2), price=10)
+        self.buyer = User.objects.create_user("buyer", "buyer@example.com", "pw", first_name="Ada", last_name="Byron")
+        self.free = User.objects.create_user("free", "free@example.com", "pw")
+        self.event.purchasers.add(self.buyer, self.free)
+        for user, quantity, email, status in [
+            (self.buyer, 3, "buyer@example.com", TicketOrder.CONFIRMED),
+            (None, 2, "guest@example.com", TicketOrder.CONFIRMED),
+            (None, 5, "abandoned@example.com", TicketOrder.HELD),
+            (None, 1, "expired@example.com", TicketOrder.RELEASED),
+        ]:
+            TicketOrder.objects.create(event=self.event, user=user, quantity=quantity, email=email, status=status)
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "pw")
+
+    def export(self, action):
+        self.client.force_login(self.admin)
+        response = self.client.post(reverse("admin:tridentapp_event_changelist"),
+                                    {"action": action, "_selected_action": [self.event.pk]})
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+    def test_csv_door_list(self):
+        lines = self.export("export_door_list_csv").splitlines()
+        self.assertEqual(lines[0], "event_id,event,name,email,quantity,kind")
+        self.assertEqual(lines[1:], [
+            f"{self.event.pk},Door,free,free@example.com,1,account",
+            f"{self.event.pk},Door,Ada Byron,buyer@example.com,3,account",
+            f"{self.event.pk},Door,,guest@example.com,2,guest",
+        ])
+
+    def test_json_door_list_and_command(self):
+        rows = json.loads(self.export("export_door_list_json"))
+        self.assertEqual([(row["email"], row["quantity"]) for row in rows],
+                         [("free@example.com", 1), ("buyer@example.com", 3), ("guest@example.com", 2)])
+
+        out = StringIO()
+        call_command("export_attendees", str(self.event.pk), "--format", "json", stdout=out)
+        self.assertEqual(json.loads(out.getvalue()), rows)
+
+
+class PurchaserAdminTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "pw")
+        self.users = [User.objects.create_user(f"user{i}", f"user{i}@example.com", "pw") for i in range(5)]
+        self.event = Event.objects.create(title="Gala", date=timezone.now() + timedelta(days=3))
+        self.other = Event.objects.create(title="Quiet", date=timezone.now() + timedelta(days=4))
+        self.event.purchasers.add(*self.users[:3])
+        self.client.force_login(self.admin)
+
+    def test_change_page_uses_autocomplete(self):
+        response = self.client.get(reverse("admin:tridentapp_event_change", args=[self.event.pk]))
+        self.assertContains(response, "admin-autocomplete")
+        self.assertNotContains(response, "user4@example.com")
+
+    def test_changelist_counts_purchasers_in_the_list_query(self):
+        url = reverse("admin:tridentapp_event_changelist")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, '<td class="field-purchaser_count">3</td>', html=True)
+        self.assertContains(response, '<td class="field-purchaser_count">0</td>', html=True)
+
+        Event.objects.bulk_create(
+            [Event(title=f"More {i}", date=timezone.now() + timedelta(days=i)) for i in range(10)]
+        )
+        with self.assertNumQueries(len(queries)):
+            self.client.get(url)
+
+    def test_add_purchasers_from_emails(self):
+        url = reverse("admin:tridentapp_event_changelist")
+        selected = {"action": "add_purchasers_from_emails", "_selected_action": [self.event.pk, self.other.pk]}
+        response = self.client.post(url, selected)
+        self.assertContains(response, 'name="emails"')
+
+        self.assertEqual(get_entitlements(self.users[3]).event_ids, set())
+        emails = "USER0@example.com, user3@example.com;\nuser4@example.com nobody@example.com"
+        response = self.client.post(url, {**selected, "apply": "1", "emails": emails}, follow=True)
+        self.assertContains(response, "No account for: nobody@example.com")
+
+        self.assertEqual(set(self.event.purchasers.all()), set(self.users))
+        self.assertEqual(set(self.other.purchasers.all()), {self.users[0], self.users[3], self.users[4]})
+        self.assertEqual(get_entitlements(self.users[3]).event_ids, {self.event.pk, self.other.pk})
+
+    def test_bulk_add_takes_seats_and_rejects_a_full_event(self):
+        full = Event.objects.create(title="Full", date=timezone.now() + timedelta(days=3), capacity=1)
+        register_for_event(self.users[0], full)
+        open_seats = Event.objects.create(title="Open", date=timezone.now() + timedelta(days=3), capacity=5)
+
+        response = self.client.post(reverse("admin:tridentapp_event_changelist"), {
+            "action": "add_purchasers_from_emails", "_selected_action": [full.pk, open_seats.pk], "apply": "1",
+            "emails": "user0@example.com user1@example.com",
+        }, follow=True)
+        self.assertContains(response, f"nobody added to: {full}")
+
+        self.assertEqual(list(full.purchasers.all()), [self.users[0]])
+        self.assertEqual(set(open_seats.purchasers.all()), set(self.users[:2]))
+        for event, remaining in ((full, 0), (open_seats, 3)):
+            event.refresh_from_db()
+            self.assertEqual(event.seats_remaining, remaining)
+            self.assertEqual(
+                TicketOrder.objects.filter(event=event, status=TicketOrder.CONFIRMED).count(),
+                event.capacity - remaining,
+            )
+
+    def test_change_form_purchasers_take_seats(self):
+        event = Event.objects.create(title="Small", date=timezone.now() + timedelta(days=3), capacity=1)
+        url = reverse("admin:tridentapp_event_change", args=[event.pk])
+        data = {"title": event.title, "date_0": event.date.date().isoformat(), "date_1": "12:00:00",
+                "price": "0", "capacity": "1", "promo_discount": "0"}
+
+        response = self.client.post(url, {**data, "purchasers": [self.users[0].pk, self.users[1].pk]}, follow=True)
+        self.assertContains(response, "Not enough seats left")
+        self.assertFalse(event.purchasers.exists())
+
+        self.client.post(url, {**data, "purchasers": [self.users[1].pk]})
+        event.refresh_from_db()
+        self.assertEqual(list(event.purchasers.all()), [self.users[1]])
+        self.assertEqual(event.seats_remaining, 0)
+        self.assertEqual(TicketOrder.objects.get(event=event).user, self.users[1])
+
+    def test_invalid_addresses_redisplay_the_form(self):
+        product = Product.objects.create(product_name="Pass", price=5)
+        response = self.client.post(reverse("admin:tridentapp_product_changelist"), {
+            "action": "add_purchasers_from_emails", "_selected_action": [product.pk], "apply": "1",
+            "emails": "user1@example.com not-an-email",
+        })
+        self.assertContains(response, "Not valid email addresses: not-an-email")
+        self.assertFalse(product.purchasers.exists())
+
+
+class NotFoundTests(TestCase):
+    def setUp(self):
+        not_found_body.cache_clear()
+
+    def test_anonymous_404_is_prerendered(self):
+        self.client.get("/no-such-page/")
+        with self.assertNumQueries(0), mock.patch("tridentapp.views.render_to_string") as render_to_string:
+            response = self.client.get("/wp-login.php")
+        render_to_string.assert_not_called()
+        self.assertEqual(response.status_code, 404)
+        self.assertContains(response, "Page Not Found", status_code=404)
+        self.assertNotContains(response, "Routes (staff only)", status_code=404)
+
+    def test_staff_see_routes(self):
+        member = User.objects.create_user("member", "member@example.com", "pw")
+        self.client.force_login(member)
+        response = self.client.get("/no-such-page/")
+        self.assertContains(response, "Page Not Found", status_code=404)
+        self.assertNotContains(response, "Routes (staff only)", status_code=404)
+
+        member.is_staff = True
+        member.save()
+        response = self.client.get("/no-such-page/")
+        self.assertContains(response, "<code>events/</code>", html=True, status_code=404)
+        self.assertIn("admin/", route_list())
@@ -0,0 +1,134 @@
+""" Resized renditions of uploaded Event images, generated off the request path by a Pillow thread pool """
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from .cache import invalidate_event_pages
+from .images import open_image, resize_to_width, encode
+from .models import Event
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+# Sources with a generation job queued or running
+_pending = set()
+# Recently seen thumbnail names known to exist, so templates skip the filesystem check
+_ready = OrderedDict()
+_ready_lock = threading.Lock()
+
+
+def thumbnail_widths():
+    return getattr(settings, "EVENT_THUMBNAIL_WIDTHS", [160, 480, 960])
+
+
+def thumbnail_name(name, width):
+    """ Deterministic storage name for one rendition of the image stored at `name` """
+    fmt = getattr(settings, "EVENT_THUMBNAIL_FORMAT", "webp")
+    digest = hashlib.sha1(name.encode()).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return f"thumbs/{stem}.{digest}.{width}w.{fmt}"
+
+
+def _mark_ready(thumb):
+    """ Remember `thumb` exists, forgetting the least recently used names past THUMBNAIL_READY_CACHE_SIZE """
+    with _ready_lock:
+        _ready[thumb] = True
+        _ready.move_to_end(thumb)
+        while len(_ready) > getattr(settings, "THUMBNAIL_READY_CACHE_SIZE", 4096):
+            _ready.popitem(last=False)
+
+
+def thumbnail_exists(name, width, storage=default_storage):
+    thumb = thumbnail_name(name, width)
+    with _ready_lock:
+        if thumb in _ready:
+            _ready.move_to_end(thumb)
+            return True
+    if storage.exists(thumb):
+        _mark_ready(thumb)
+        return True
+    return False
+
+
+def generate_thumbnails(name, storage=default_storage):
+    """ Write any missing renditions of the image at `name`, returning how many were created """
+    missing = [width for width in thumbnail_widths() if not thumbnail_exists(name, width, storage)]
+    if not missing:
+        return 0
+
+    with storage.open(name) as handle:
+        image = open_image(handle)
+
+    fmt = getattr(settings, "EVENT_THUMBNAIL_FORMAT", "webp")
+    quality = getattr(settings, "EVENT_THUMBNAIL_QUALITY", 75)
+    for width in missing:
+        thumb = thumbnail_name(name, width)
+        saved = storage.save(thumb, ContentFile(encode(resize_to_width(image, width), fmt, quality)))
+        if saved != thumb:
+            # Another worker wrote it first; keep theirs
+            storage.delete(saved)
+        _mark_ready(thumb)
+    return len(missing)
+
+
+def invalidate_image_pages(name):
+    """ Drop cached pages of the events using `name`, rendered with the original as a fallback """
+    for event_id in Event.objects.filter(image=name).values_list('pk', flat=True):
+        invalidate_event_pages(event_id)
+
+
+def _generate(name):
+    try:
+        if generate_thumbnails(name):
+            invalidate_image_pages(name)
+    except Exception:
+        logger.exception("Could not generate thumbnails for %s", name)
+    finally:
+        with _pool_lock:
+            _pending.discard(name)
+
+
+def schedule_thumbnails(name):
+    """ Queue thumbnail generation for `name` on the process-wide worker pool """
+    global _pool
+    with _pool_lock:
+        if name in _pending:
+            return
+        _pending.add(name)
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=getattr(settings, "THUMBNAIL_WORKERS", 2), thread_name_prefix="thumbnails"
+            )
+    _pool.submit(_generate, name)
+
+
+def thumbnail_url(image, width):
+    """ URL of the `width` rendition of an ImageField file.
+
+    Until the rendition exists the original is returned and generation is
+    queued, so images uploaded before thumbnails existed catch up lazily.
+    """
+    if not image:
+        return ""
+    if thumbnail_exists(image.name, width, image.storage):
+        return image.storage.url(thumbnail_name(image.name, width))
+    schedule_thumbnails(image.name)
+    return image.url
+
+
+def thumbnail_srcset(image):
+    """ srcset of the renditions that exist so far """
+    if not image:
+        return ""
+    return ", ".join(
+        f"{image.storage.url(thumbnail_name(image.name, width))} {width}w"
+        for width in thumbnail_widths() if thumbnail_exists(image.name, width, image.storage)
+    )
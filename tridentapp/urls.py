@@ -1,10 +1,8 @@
 from .views import home, user_home, events, purchase_product, purchase_event, pay_event
 from .views import PasswordResetSESView, stripe_webhook, payment_confirmation
-from .views import event_info, event_register, directions, register, activate
+from .views import event_info, event_register, directions, register, activate, livestream, metrics
 from django.urls import path
 
-handler404 = "tridentapp.views.handler404"
-
 urlpatterns = [
 
     # Forgot password form (SES-powered)
@@ -18,6 +16,7 @@ urlpatterns = [
     path('user/', user_home, name='user_home'),
     path('events/', events, name="events"),
     path('directions/', directions, name="directions"),
+    path('livestream/', livestream, name="livestream"),
     path('event_info/<int:event_id>', event_info, name="event_info"),
     path("register/", register, name="register"),
     path("activate/<uidb64>/<token>/", activate, name="activate"),
@@ -27,6 +26,7 @@ urlpatterns = [
     path('event_register/<int:event_id>/', event_register, name='event_register'),
     path("stripe/webhook/", stripe_webhook, name="stripe_webhook"),
     path("payment/confirmation/", payment_confirmation, name="payment_confirmation"),
+    path("metrics", metrics, name="metrics"),
 
 ]
 
@@ -2,33 +2,35 @@ from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes
 from django.template.loader import render_to_string
+from django.core.mail import EmailMultiAlternatives
 from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
 
-import boto3
+from datetime import timedelta
 
+from .models import OutboundEmail
 
-def send_email(email, subject, body_text):
 
-    # Create boto3 SES client
-    ses_client = boto3.client(
-        "ses",
-        aws_access_key_id=settings.SES_MOCAPSCHOOL_KEY,
-        aws_secret_access_key=settings.SES_MOCAPSCHOOL_SECRET,
-        region_name=settings.SES_MOCAPSCHOOL_REGION,
-    )
+def send_email(email, subject, body_text, body_html=None):
+    """ Send a plain-text email, with an optional HTML alternative, through EMAIL_BACKEND """
+    message = EmailMultiAlternatives(subject, body_text, settings.DEFAULT_FROM_EMAIL, [email])
+    if body_html:
+        message.attach_alternative(body_html, "text/html")
+    message.send()
+
 
-    # Send email using AWS SES API
-    ses_client.send_email(
-        Source=settings.DEFAULT_FROM_EMAIL,
-        Destination={
-            "ToAddresses": [email],
-        },
-        Message={
-            "Subject": {"Data": subject, "Charset": "UTF-8"},
-            "Body": {
-                "Text": {"Data": body_text, "Charset": "UTF-8"},
-            },
-        },
+def enqueue_email(email, subject, body_text, body_html=""):
+    """ Store a rendered email in the outbox for the send_outbox command.
+
+    Call inside the caller's transaction so the email only goes out if the
+    surrounding work commits.
+    """
+    return OutboundEmail.objects.create(
+        to_email=email,
+        subject=subject,
+        body_text=body_text,
+        body_html=body_html or '',
     )
 
 
@@ -42,13 +44,46 @@ def send_new_account_email(user, confirm_url):
         "confirm_url": confirm_url,
     })
 
-    send_email(user.email, subject, body_text)
+    enqueue_email(user.email, subject, body_text)
 
 
 def send_purchase_email(email, title):
     body_text = render_to_string("purchase_ok.txt", {'title': title})
-    send_email(email, "Purchase ok", body_text)
+    enqueue_email(email, "Purchase ok", body_text)
 
 
 def send_admin_email(subject, message):
-    send_email("al@peeldev.com", subject, message)
+    enqueue_email("al@peeldev.com", subject, message)
+
+
+def retry_delay(attempts, base=30, cap=3600):
+    """ Exponential backoff for background retries: 30s, 60s, 120s ... capped at an hour """
+    return timedelta(seconds=min(cap, base * 2 ** max(attempts - 1, 0)))
+
+
+def due_rows(model, now):
+    """ Queue rows ready for a worker at `now`: due PENDING rows and PROCESSING rows whose claim expired """
+    stale = now - timedelta(seconds=getattr(settings, "QUEUE_CLAIM_LEASE", 600))
+    return model.objects.filter(
+        Q(status=model.PENDING, next_attempt_at__lte=now) | Q(status=model.PROCESSING, claimed_at__lte=stale)
+    )
+
+
+def claim_due_rows(model, batch_size):
+    """ Mark up to batch_size due rows of a queue model as PROCESSING and return them.
+
+    Due rows are PENDING ones whose next_attempt_at has passed, and PROCESSING
+    ones whose claim is older than QUEUE_CLAIM_LEASE seconds, i.e. left behind
+    by a worker that died. Used by the webhook inbox and the email outbox,
+    which share the status / next_attempt_at / claimed_at layout.
+    """
+    now = timezone.now()
+    due = due_rows(model, now).order_by('pk').values_list('pk', flat=True)[:batch_size]
+
+    claimed = []
+    for pk in list(due):
+        # Claim row by row so two workers never handle the same row
+        if due_rows(model, now).filter(pk=pk).update(status=model.PROCESSING, claimed_at=now):
+            claimed.append(pk)
+
+    return list(model.objects.filter(pk__in=claimed).order_by('pk'))
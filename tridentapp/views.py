@@ -1,59 +1,67 @@
+from asgiref.sync import sync_to_async
 from django.utils import timezone
 from django.utils.timezone import now
-from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_decode
 from django.conf import settings
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseNotFound
 from django.contrib.auth import views as auth_views
-from django.contrib.auth.models import User
+from django.contrib.auth.models import AnonymousUser, User
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.decorators import login_required
-from django.urls import reverse
+from django.urls import URLPattern, URLResolver, get_resolver, reverse
+from django.core.paginator import Paginator
+from django.db import transaction
 from django.contrib import messages
 from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes
+from django.utils.crypto import constant_time_compare
 
 
+from . import queries
+from .cache import cache_anonymous_page
+from .metrics import render_metrics
+from .entitlements import get_entitlements, is_registered, register_for_event, ais_registered, aregistered_event_ids
 from .forms import RegisterForm
+from .inventory import SoldOut, held_seats, hold_seats
 from .forms import SESEmailPasswordResetForm
-from .models import Event, Product, Customer
-from .utils import send_new_account_email, send_purchase_email, send_admin_email
-
+from .models import Event, Product, StripeWebhookEvent
+from .stripe_client import astripe_call
+from .payments import PaymentInProgress, checkout_owner_key, aget_payment_intent, acached_stripe_customer_id
+from .quotes import parse_quantity, quote_price, make_quote, load_quote, checkout_quote_id, remember_quote
+from .utils import send_new_account_email
+from .webhooks import recent_event_ids
+
+import functools
+import json
 import pytz
+from datetime import datetime
 import stripe
-from decimal import Decimal
-
-stripe.api_key = settings.STRIPE_SECRET_KEY
-
-
-def get_or_create_stripe_customer(user):
-    customer_obj, created = Customer.objects.get_or_create(user=user)
-    if created or not customer_obj.stripe_customer_id:
-        stripe_customer = stripe.Customer.create(
-            email=user.email,
-            name=user.get_full_name() or user.username,
-        )
-        customer_obj.stripe_customer_id = stripe_customer.id
-        customer_obj.save()
-    return customer_obj.stripe_customer_id
 
 
-def home(request):
-    future_events = Event.objects.filter(date__gt=timezone.now()).order_by('date')
+@cache_anonymous_page("home")
+async def home(request):
+    future_events = [
+        event async for event in
+        queries.upcoming_events(timezone.now())
+    ]
     return render(request, 'home.html', {'events': future_events})
 
 
+@cache_anonymous_page("directions")
 def directions(request):
     return render(request, 'directions.html')
 
 
 @login_required
 def user_home(request):
-    products = request.user.purchased_products.all()
-    events = request.user.purchased_events.all()
+    entitlements = get_entitlements(request.user)
+    products = queries.purchased_products(entitlements.product_ids)
+    events = queries.purchased_events(entitlements.event_ids)
     return render(request, "user_home.html", {"products": products, "events": events})
 
 
@@ -61,13 +69,14 @@ def register(request):
     if request.method == "POST":
         form = RegisterForm(request.POST)
         if form.is_valid():
-            user = form.save(commit=False)
-            user.is_active = False  # deactivate until confirmed
-            user.save()
-            uid = urlsafe_base64_encode(force_bytes(user.pk))
-            token = default_token_generator.make_token(user)
-            confirm_url = request.build_absolute_uri(f"/activate/{uid}/{token}/")
-            send_new_account_email(user, confirm_url)
+            with transaction.atomic():
+                user = form.save(commit=False)
+                user.is_active = False  # deactivate until confirmed
+                user.save()
+                uid = urlsafe_base64_encode(force_bytes(user.pk))
+                token = default_token_generator.make_token(user)
+                confirm_url = request.build_absolute_uri(f"/activate/{uid}/{token}/")
+                send_new_account_email(user, confirm_url)
             return render(request, "registration/registration_pending.html")
     else:
         form = RegisterForm()
@@ -97,18 +106,22 @@ class PasswordResetSESView(auth_views.PasswordResetView):
     subject_template_name = "registration/password_reset_subject.txt"
 
 
-def events(request):
-    events = (
-        Event.objects.filter(date__gte=timezone.now())
-        .order_by("date")
-    )
+@cache_anonymous_page("events")
+async def events(request):
+    events = [
+        event async for event in
+        queries.listed_events(timezone.now())
+    ]
+    registered_ids = await aregistered_event_ids(request.user, [event.pk for event in events])
 
-    return render(request, "events.html", {"events": events})
+    return render(request, "events.html", {"events": events, "registered_ids": registered_ids})
 
 
-def event_info(request, event_id):
-    event = get_object_or_404(Event, pk=event_id)
-    return render(request, "event_info.html", {"event": event})
+@cache_anonymous_page("event_info")
+async def event_info(request, event_id):
+    event = await aget_object_or_404(Event, pk=event_id)
+    registered = request.user.is_authenticated and await ais_registered(request.user, event.pk)
+    return render(request, "event_info.html", {"event": event, "registered": registered})
 
 
 def livestream(request):
@@ -116,77 +129,80 @@ def livestream(request):
     pacific = pytz.timezone('America/Los_Angeles')
     current_time = now().astimezone(pacific)
     current_date = current_time.date()
-    current_clock_time = current_time.time()
-
-    events = Event.objects.all().order_by('-date')
-
-    past_events = []
-    next_event = None
-    current_event = None
-
-    for event in events:
-        event_dt = event.date.astimezone(pacific)
-        event_date = event_dt.date()
-        event_time = event_dt.time()
-
-        if event_date == current_date and event_time <= current_clock_time:
-            # This is the current livestream (today, and already started)
-            current_event = {
-                'title': event.title,
-                'url': event.livestream_url,
-                'start_time': event_dt.isoformat()
-            }
-        elif event_dt > current_time:
-            # This is the next upcoming livestream
-            delta = event_dt - current_time
-            starts_in = None
-            if event_date == current_date:
-                hours, remainder = divmod(delta.total_seconds(), 3600)
-                minutes = remainder // 60
-                starts_in = f"in {int(hours)} hour{'s' if hours != 1 else ''} {int(minutes)} minute{'s' if minutes != 1 else ''}"
-
-            next_livestream = {
-                'title': event.title,
-                'url': event.livestream_url,
-                'redirect_time': event_dt.isoformat(),
-                'starts_in': starts_in
-            }
-        else:
-            # This is a past livestream
-            past_events.append(event)
+    start_of_today = pacific.localize(datetime.combine(current_date, datetime.min.time()))
+
+    # Each lookup is a bounded range query on Event.date, so the page costs the same
+    # however many years of events there are
+    current_livestream = None
+    current = queries.current_livestream(start_of_today, current_time).first()
+    if current:
+        # This is the current livestream (today, and already started)
+        current_livestream = {
+            'title': current.title,
+            'url': current.livestream_url,
+            'start_time': current.date.astimezone(pacific).isoformat()
+        }
+
+    next_livestream = None
+    upcoming = queries.next_livestream(current_time).first()
+    if upcoming:
+        event_dt = upcoming.date.astimezone(pacific)
+        delta = event_dt - current_time
+        starts_in = None
+        if event_dt.date() == current_date:
+            hours, remainder = divmod(delta.total_seconds(), 3600)
+            minutes = remainder // 60
+            starts_in = f"in {int(hours)} hour{'s' if hours != 1 else ''} {int(minutes)} minute{'s' if minutes != 1 else ''}"
+
+        next_livestream = {
+            'title': upcoming.title,
+            'url': upcoming.livestream_url,
+            'redirect_time': event_dt.isoformat(),
+            'starts_in': starts_in
+        }
+
+    past_events = queries.past_livestreams(current_time, exclude_pk=current.pk if current else None)
+    page = Paginator(past_events, 10).get_page(request.GET.get('page'))
 
     return render(request, 'livestream.html', {
-        'past_events': past_events,
-        'next_event': next_event,
-        'current_livestream': current_event,
+        'livestreams': page,
+        'page_obj': page,
+        'next_livestream': next_livestream,
+        'current_livestream': current_livestream,
     })
 
 
 @login_required
-def purchase_product(request, product_id):
+async def purchase_product(request, product_id):
+    request.user = await request.auser()
     # Get the product or return 404 if not found
-    product = get_object_or_404(Product, pk=product_id)
+    product = await aget_object_or_404(Product, pk=product_id)
 
     # Convert price (Decimal) to integer cents
     amount_cents = int(product.price * 100)
     amount_display = f"${product.price:.2f}"
 
-    # Create a Stripe PaymentIntent
-    intent = stripe.PaymentIntent.create(
-        amount=amount_cents,
-        currency="usd",
-        automatic_payment_methods={"enabled": True},
-        metadata={
-            "product": product.id,
-            "user_id": request.user.id if request.user.is_authenticated else None,
-        },
-    )
+    # Reuse this user's open PaymentIntent for the product where possible
+    try:
+        intent = await aget_payment_intent(
+            checkout_owner_key(request),
+            amount=amount_cents,
+            product=product,
+            metadata={
+                "product_id": product.id,
+                "user_id": request.user.id if request.user.is_authenticated else None,
+            },
+        )
+    except PaymentInProgress as exc:
+        return await payment_in_progress(request, exc.record)
 
-    return render(request, "payment.html", {
+    return render(request, "event_payment.html", {
+        "item_name": product.product_name,
+        "quantity": 1,
+        "email": request.user.email if request.user.is_authenticated else "",
+        "amount_display": amount_display,
         "client_secret": intent.client_secret,
         "STRIPE_PUBLISHABLE_KEY": settings.STRIPE_PUBLISHABLE_KEY,
-        "amount_display": amount_display,
-        "item_name": product.product_name,
     })
 
 
@@ -200,15 +216,19 @@ def event_register(request, event_id):
 
     # Handle POST registration (after login)
     if request.method == "POST":
-        if request.user not in event.purchasers.all():
-            event.purchasers.add(request.user)
-            messages.success(request, f"You have successfully registered for {event.title}!")
+        try:
+            registered = register_for_event(request.user, event)
+        except SoldOut:
+            messages.error(request, f"Sorry, {event.title} is full.")
         else:
-            messages.info(request, "You are already registered for this event.")
+            if registered:
+                messages.success(request, f"You have successfully registered for {event.title}!")
+            else:
+                messages.info(request, "You are already registered for this event.")
         return redirect("event_info", event_id=event.id)
 
     # Determine if already registered
-    already_registered = request.user in event.purchasers.all()
+    already_registered = is_registered(request.user, event.pk)
 
     return render(request, "event_register.html", {
         "event": event,
@@ -218,25 +238,14 @@ def event_register(request, event_id):
 
 def purchase_event(request, event_id):
     event = get_object_or_404(Event, pk=event_id)
-    quantity = int(request.POST.get("quantity", 1))
+    quantity = parse_quantity(request.POST.get("quantity"))
     promo_code = request.POST.get("promo", "").strip()
     action = request.POST.get("action", "")
     email = request.POST.get("email", "")
     login_error = ""
 
-    # Apply promo if valid for this event
-    promo_message = ""
-    discount = Decimal('0')
-    if promo_code:
-        if event.promo_code and promo_code == event.promo_code.upper():
-            discount = event.promo_discount
-            promo_message = f"{event.promo_discount}% discount applied"
-        else:
-            promo_message = "Invalid code"
-
-    # Calculate discounted total
-    base_price = event.price * quantity
-    discounted_price = base_price * (Decimal('1') - discount / Decimal('100'))
+    # Apply promo if valid for this event and calculate the discounted total
+    discounted_price, promo_message = quote_price(event, quantity, promo_code)
     total_display = f"${discounted_price:.2f}"
 
     # --- Handle login submission ---
@@ -249,14 +258,19 @@ def purchase_event(request, event_id):
         else:
             login_error = "Invalid Credentials"
 
+    quote_id = checkout_quote_id(request)
+    if action == "continue" and event.seats_remaining is not None and quantity > event.seats_remaining:
+        # Advisory only; pay_event reserves the seats. The buyer's own hold is replaced by this quote.
+        available = event.seats_remaining + held_seats(checkout_owner_key(request, quote_id), event.id)
+        if quantity > available:
+            action = ""
+            messages.error(request, "Sold out." if not available else f"Only {available} ticket(s) left.")
+
     if action == "continue":
-        # Store chosen data in session and redirect to payment
-        request.session["purchase_data"] = {
-            "quantity": quantity,
-            "promo_code": promo_code,
-            "email": email,
-        }
-        return redirect(reverse("pay_event", args=[event_id]))
+        # Carry the priced order to the payment page in a signed token, not the session
+        token = make_quote(event, quantity, promo_code, email, quote_id=quote_id)
+        response = redirect(f"{reverse('pay_event', args=[event_id])}?quote={token}")
+        return remember_quote(response, quote_id)
 
     return render(request, "event_purchase.html", {
         "event": event,
@@ -270,50 +284,72 @@ def purchase_event(request, event_id):
     })
 
 
-def pay_event(request, event_id):
-    event = get_object_or_404(Event, pk=event_id)
-    data = request.session.get("purchase_data")
+async def sold_out(request, event):
+    await sync_to_async(messages.error)(request, f"Sorry, there are not enough tickets left for {event.title}.")
+    return redirect("purchase_event", event_id=event.id)
+
+
+async def payment_in_progress(request, intent):
+    await sync_to_async(messages.info)(request, "Your payment for this order is already being processed.")
+    return redirect(f"{reverse('payment_confirmation')}?intent={intent.stripe_intent_id}")
+
 
-    if not data:
+async def pay_event(request, event_id):
+    request.user = await request.auser()
+    event = await aget_object_or_404(Event, pk=event_id)
+    quote = load_quote(request.GET.get("quote", ""), event.id)
+
+    if not quote:
         return redirect("purchase_event", event_id=event.id)
 
-    quantity = int(data["quantity"])
-    promo_code = data.get("promo_code", "")
-    email = data.get("email", "")
-    discount = Decimal('0')
+    quantity = quote["quantity"]
+    promo_code = quote["promo_code"]
+    email = quote["email"]
+    amount_cents = quote["amount"]
+    amount_display = quote["display"]
 
-    if promo_code and event.promo_code and promo_code == event.promo_code.upper():
-        discount = event.promo_discount
+    owner_key = checkout_owner_key(request, quote["id"])
+    user = request.user if request.user.is_authenticated else None
 
-    base_price = event.price * quantity
-    discounted_price = base_price * (Decimal('1') - discount / Decimal('100'))
-    amount_cents = int(discounted_price * 100)
-    amount_display = f"${discounted_price:.2f}"
+    # Cheap check against the counter before talking to Stripe; hold_seats is authoritative
+    if event.seats_remaining is not None and quantity > event.seats_remaining \
+            and quantity > event.seats_remaining + await sync_to_async(held_seats)(owner_key, event.id):
+        return await sold_out(request, event)
 
-    # Stripe customer
+    # Stripe customer, provisioned in the background by provision_stripe_customers
     if request.user.is_authenticated:
-        customer_id = get_or_create_stripe_customer(request.user)
+        customer_id = await acached_stripe_customer_id(request.user)
         email = request.user.email
     else:
         customer_id = None
 
-    # Create PaymentIntent
-    intent = stripe.PaymentIntent.create(
-        amount=amount_cents,
-        currency="usd",
-        customer=customer_id,
-        automatic_payment_methods={"enabled": True},
-        metadata={
-            "email": email,
-            "event": event.id,
-            "quantity": quantity,
-            "user_id": request.user.id if request.user.is_authenticated else None,
-            "promo_code": promo_code,
-        },
-    )
+    # Reuse the buyer's open PaymentIntent for this event, modifying it if the quote changed
+    try:
+        intent = await aget_payment_intent(
+            owner_key,
+            amount=amount_cents,
+            event=event,
+            quantity=quantity,
+            promo_code=promo_code,
+            email=email or "",
+            customer=customer_id,
+            metadata={
+                "email": email,
+                "event": event.id,
+                "quantity": quantity,
+                "user_id": request.user.id if request.user.is_authenticated else None,
+                "promo_code": promo_code,
+            },
+            hold=lambda record: sync_to_async(hold_seats)(record, user),
+        )
+    except SoldOut:
+        return await sold_out(request, event)
+    except PaymentInProgress as exc:
+        return await payment_in_progress(request, exc.record)
 
     context = {
         "event": event,
+        "item_name": event.title,
         "quantity": quantity,
         "promo_code": promo_code,
         "email": email,
@@ -324,8 +360,9 @@ def pay_event(request, event_id):
     return render(request, "event_payment.html", context)
 
 
-def create_checkout_session(request):
-    session = stripe.checkout.Session.create(
+async def create_checkout_session(request):
+    session = await astripe_call(
+        "checkout.Session.create",
         payment_method_types=['card'],
         line_items=[{
             'price_data': {
@@ -345,7 +382,7 @@ def create_checkout_session(request):
 
 
 @csrf_exempt  # Stripe doesn't send CSRF tokens
-def stripe_webhook(request):
+async def stripe_webhook(request):
     payload = request.body
     sig_header = request.META.get("HTTP_STRIPE_SIGNATURE")
 
@@ -360,74 +397,28 @@ def stripe_webhook(request):
         # Invalid signature
         return HttpResponse(status=400)
 
-    # Handle the event types you care about
-    if event["type"] == "payment_intent.succeeded":
-        intent = event["data"]["object"]
-        user_id = intent["metadata"].get("user_id")
-        quantity = intent["metadata"].get("quantity")
-        charges = intent.get("charges", {}).get("data", [])
-
-        # Product
-        product_id = intent["metadata"].get("product_id")
-        if product_id:
-            try:
-                product = Product.objects.get(pk=product_id)
-            except Product.DoesNotExist:
-                return HttpResponse(status=200)
-
-            # Assign product to the user (ManyToMany example)
-            if user_id:
-                try:
-                    user = User.objects.get(pk=user_id)
-                    product.purchasers.add(user)
-                except User.DoesNotExist:
-                    pass
-
-        # Event
-        event_id = intent["metadata"].get("event")
-        if event_id:
-            try:
-                event = Event.objects.get(pk=event_id)
-            except Event.DoesNotExist:
-                return HttpResponse(status=200)
-
-            email = None
-            name = None
-
-            # Assign event to user
-            if user_id:
-                try:
-                    user = User.objects.get(pk=user_id)
-                    name = user.get_full_name()
-                    email = user.email
-                    event.purchasers.add(user)
-                except User.DoesNotExist:
-                    pass
-            else:
-                if charges:
-                    email = charges[0].get("billing_details", {}).get("email")
-                    name = charges[0].get("billing_details", {}).get("name")
-
-            if email:
-                formatted_date = event.date.strftime("%b %d, %Y %I:%M %p")
-                message = "Thank you for your purchase of: \n\n"
-                message += f" {quantity} x {event.title} - {formatted_date} \n\n"
-                message += f"For :  {email} {name}\n\n"
-                message += f"Your name will be on the list at the door - See you then!"
-                send_purchase_email(email, message)
+    # Stripe retries deliveries; ones this process has already accepted cost nothing
+    if event["id"] in recent_event_ids:
+        return HttpResponse(status=200)
 
-            message = "New Purchase: "
-            message += f"  {quantity} x {event.title} - {formatted_date} \n\n"
-            message += f"For :  {email} {name}\n" 
-            send_admin_email("New Event Purchase", message)
+    # Store the delivery and acknowledge at once; process_webhooks does the work
+    await StripeWebhookEvent.objects.acreate(
+        stripe_event_id=event["id"],
+        event_type=event["type"],
+        payload=json.loads(payload),
+    )
+    recent_event_ids.add(event["id"])
 
-    elif event["type"] == "payment_intent.payment_failed":
-        intent = event["data"]["object"]
-        print(f"Payment failed for intent: {intent['id']}")
+    return HttpResponse(status=200)
 
-    # You can handle other event types if needed
 
-    return HttpResponse(status=200)
+def metrics(request):
+    """ Prometheus scrape endpoint for this process's request, Stripe and SES histograms """
+    token = getattr(settings, "METRICS_TOKEN", None)
+    bearer = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not request.user.is_staff and not (token and constant_time_compare(bearer, token)):
+        return HttpResponse(status=403)
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 def payment_confirmation(request):
@@ -436,15 +427,33 @@ def payment_confirmation(request):
     return render(request, "payment_confirmation.html", {"intent_id": intent_id})
 
 
-def handler404(request, exception=None):
-    def collect(urls):
-        patterns = []
+@functools.cache
+def route_list():
+    """ Every URL pattern in the project, collected once per process for the staff 404 page """
+    def collect(urls, prefix=""):
         for u in urls:
             if isinstance(u, URLPattern):
-                patterns.append(u)
+                yield prefix + str(u.pattern)
             elif isinstance(u, URLResolver):
-                patterns.extend(collect(u.url_patterns))
-        return patterns
+                yield from collect(u.url_patterns, prefix + str(u.pattern))
 
-    patterns = collect(get_resolver().url_patterns)
-    return render(request, "404.html", {"urls": patterns}, status=404)
+    return tuple(collect(get_resolver().url_patterns))
+
+
+@functools.cache
+def not_found_body():
+    """ The anonymous 404 page, rendered once per process """
+    return render_to_string("404.html", {"user": AnonymousUser()}).encode()
+
+
+def handler404(request, exception=None):
+    """ Serve 404s from a pre-rendered body.
+
+    Requests without a session cookie, which is what scanners send, never
+    touch the session, the database or the template engine. Signed-in users
+    get a fresh render so the navigation is right, and staff see the routes.
+    """
+    if settings.SESSION_COOKIE_NAME in request.COOKIES and request.user.is_authenticated:
+        context = {"urls": route_list()} if request.user.is_staff else {}
+        return render(request, "404.html", context, status=404)
+    return HttpResponseNotFound(not_found_body())
@@ -0,0 +1,181 @@
+import logging
+import threading
+import traceback
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .inventory import confirm_order, release_intent_hold
+from .models import Event, Product, StripeWebhookEvent, ProcessedStripeEvent, PaymentIntentRecord
+from .payments import mark_intent_status
+from .utils import send_purchase_email, send_admin_email, retry_delay, claim_due_rows
+
+logger = logging.getLogger(__name__)
+
+
+class RecentEventIds:
+    """ Bounded, thread-safe LRU of Stripe event ids this process has already accepted """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, event_id):
+        with self._lock:
+            if event_id in self._ids:
+                self._ids.move_to_end(event_id)
+                return True
+            return False
+
+    def add(self, event_id):
+        with self._lock:
+            self._ids[event_id] = None
+            self._ids.move_to_end(event_id)
+            while len(self._ids) > self.maxsize:
+                self._ids.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+
+# Repeat deliveries seen by this process are answered without touching the database
+recent_event_ids = RecentEventIds(getattr(settings, "STRIPE_WEBHOOK_LRU_SIZE", 10000))
+
+
+def mark_processed(stripe_event_id):
+    """ Record the event id in the ledger; returns False if it was already there """
+    try:
+        with transaction.atomic():
+            ProcessedStripeEvent.objects.create(stripe_event_id=stripe_event_id)
+    except IntegrityError:
+        return False
+    return True
+
+
+def handle_payment_succeeded(intent):
+    """ Assign the purchased product or event to the buyer and send the confirmation emails """
+    user_id = intent["metadata"].get("user_id")
+    quantity = intent["metadata"].get("quantity")
+    charges = intent.get("charges", {}).get("data", [])
+
+    # Product
+    product_id = intent["metadata"].get("product_id")
+    if product_id:
+        try:
+            product = Product.objects.get(pk=product_id)
+        except Product.DoesNotExist:
+            return
+
+        # Assign product to the user (ManyToMany example)
+        if user_id:
+            try:
+                user = User.objects.get(pk=user_id)
+                product.purchasers.add(user)
+            except User.DoesNotExist:
+                pass
+
+    # Event
+    event_id = intent["metadata"].get("event")
+    if event_id:
+        try:
+            event = Event.objects.get(pk=event_id)
+        except Event.DoesNotExist:
+            return
+
+        email = None
+        name = None
+        buyer_id = None
+
+        # Assign event to user
+        if user_id:
+            try:
+                user = User.objects.get(pk=user_id)
+                name = user.get_full_name()
+                email = user.email
+                buyer_id = user.pk
+                event.purchasers.add(user)
+            except User.DoesNotExist:
+                pass
+        else:
+            if charges:
+                email = charges[0].get("billing_details", {}).get("email")
+                name = charges[0].get("billing_details", {}).get("name")
+
+        # The seats held at checkout become sold
+        confirm_order(intent["id"], event.pk, int(quantity or 1),
+                      user_id=buyer_id, email=email or "")
+
+        formatted_date = event.date.strftime("%b %d, %Y %I:%M %p")
+
+        if email:
+            message = "Thank you for your purchase of: \n\n"
+            message += f" {quantity} x {event.title} - {formatted_date} \n\n"
+            message += f"For :  {email} {name}\n\n"
+            message += f"Your name will be on the list at the door - See you then!"
+            send_purchase_email(email, message)
+
+        message = "New Purchase: "
+        message += f"  {quantity} x {event.title} - {formatted_date} \n\n"
+        message += f"For :  {email} {name}\n"
+        send_admin_email("New Event Purchase", message)
+
+
+def handle_event(event):
+    """ Dispatch a decoded Stripe event payload to its handler """
+    if event["type"] == "payment_intent.succeeded":
+        mark_intent_status(event["data"]["object"]["id"], PaymentIntentRecord.SUCCEEDED)
+        handle_payment_succeeded(event["data"]["object"])
+
+    elif event["type"] == "payment_intent.canceled":
+        mark_intent_status(event["data"]["object"]["id"], PaymentIntentRecord.CANCELED)
+        release_intent_hold(event["data"]["object"]["id"])
+
+    elif event["type"] == "payment_intent.payment_failed":
+        intent = event["data"]["object"]
+        logger.info("Payment failed for intent: %s", intent["id"])
+
+    # You can handle other event types if needed
+
+
+def process_inbox_event(inbox_event):
+    """ Run the handler for one inbox row, recording success or scheduling a retry """
+    max_attempts = getattr(settings, "STRIPE_WEBHOOK_MAX_ATTEMPTS", 8)
+    inbox_event.attempts += 1
+
+    try:
+        with transaction.atomic():
+            # The ledger row commits or rolls back together with the handler's writes
+            if mark_processed(inbox_event.stripe_event_id):
+                handle_event(inbox_event.payload)
+            else:
+                logger.info("Skipping duplicate Stripe event %s", inbox_event.stripe_event_id)
+    except Exception:
+        logger.exception("Stripe webhook %s failed", inbox_event.stripe_event_id)
+        inbox_event.last_error = traceback.format_exc()
+        if inbox_event.attempts >= max_attempts:
+            inbox_event.status = StripeWebhookEvent.FAILED
+        else:
+            inbox_event.status = StripeWebhookEvent.PENDING
+            inbox_event.next_attempt_at = timezone.now() + retry_delay(inbox_event.attempts)
+        inbox_event.save(update_fields=['attempts', 'status', 'last_error', 'next_attempt_at'])
+        return False
+
+    recent_event_ids.add(inbox_event.stripe_event_id)
+    inbox_event.status = StripeWebhookEvent.DONE
+    inbox_event.last_error = ''
+    inbox_event.processed_at = timezone.now()
+    inbox_event.save(update_fields=['attempts', 'status', 'last_error', 'processed_at'])
+    return True
+
+
+def process_inbox(batch_size=50):
+    """ Drain one batch of the webhook inbox, returning the number of rows handled """
+    batch = claim_due_rows(StripeWebhookEvent, batch_size)
+    for inbox_event in batch:
+        process_inbox_event(inbox_event)
+    return len(batch)